@@ -0,0 +1,155 @@
+"""
+Micro-benchmark of per-update dispatch cost for message content routing.
+
+Compares precomputed content routing table (single router-level ContentRouter filter,
+result is passed to a single handler) with the previous approach, where every message went through a chain of async BaseFilter objects,
+each recomputing Message.content_type.
+Handlers are no-op, so only aiogram dispatch and classification are measured.
+
+Run from repository root:
+    python -m benchmarks.content_dispatch [--updates 20000] [--rounds 5]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timezone
+from time import perf_counter
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.enums import ContentType
+from aiogram.filters import BaseFilter
+from aiogram.types import Message, Update
+
+from bot.config_reader import ContentConfig
+from bot.content_routing import ContentAction, ContentRoute, ContentRouter
+
+content_config = ContentConfig()
+
+
+class LegacyForwardableTypesFilter(BaseFilter):
+    async def __call__(self, message: Message) -> bool | dict:
+        if message.text is not None:
+            return True
+        if message.content_type in content_config.allowed_types:
+            if message.caption is None:
+                return True
+            return {"caption_length": len(message.caption)}
+        return False
+
+
+class LegacyServiceMessagesFilter(BaseFilter):
+    async def __call__(self, message: Message) -> bool | dict:
+        return message.content_type in content_config.dropped_types
+
+
+async def noop_handler(message: Message):
+    return None
+
+
+async def noop_routed_handler(message: Message, content: ContentRoute):
+    # Same branching as in real handlers
+    if content.action is ContentAction.REJECT:
+        return None
+    return None
+
+
+def make_legacy_router() -> Router:
+    router = Router()
+    router.message.register(noop_handler, LegacyForwardableTypesFilter())
+    router.message.register(noop_handler, LegacyServiceMessagesFilter())
+    router.message.register(noop_handler)
+    return router
+
+
+def make_table_router() -> Router:
+    router = Router()
+    router.message.filter(ContentRouter(content_config))
+    router.message.register(noop_routed_handler)
+    return router
+
+
+def make_updates(count: int) -> list[Update]:
+    date = int(datetime.now(timezone.utc).timestamp())
+    chat = {"id": 1, "type": "private", "first_name": "User"}
+    user = {"id": 1, "is_bot": False, "first_name": "User"}
+    payloads = [
+        {"text": "hello"},
+        {"text": "how are you?"},
+        {"text": "one more text"},
+        {"photo": [{"file_id": "p", "file_unique_id": "pu", "width": 90, "height": 90}], "caption": "photo"},
+        {"sticker": {
+            "file_id": "s", "file_unique_id": "su", "type": "regular",
+            "width": 512, "height": 512, "is_animated": False, "is_video": False,
+        }},
+        {"voice": {"file_id": "v", "file_unique_id": "vu", "duration": 3}},
+        {"dice": {"emoji": ContentType.DICE, "value": 3}},
+        {"pinned_message": {"message_id": 1, "date": date, "chat": chat, "text": "pinned"}},
+    ]
+    updates = list()
+    for i in range(count):
+        message = {"message_id": i + 1, "date": date, "chat": chat, "from": user}
+        message.update(payloads[i % len(payloads)])
+        updates.append(Update.model_validate({"update_id": i + 1, "message": message}))
+    return updates
+
+
+async def measure(name: str, router: Router, bot: Bot, updates: list[Update], rounds: int) -> float:
+    dp = Dispatcher()
+    dp.include_router(router)
+    # Warm up
+    for update in updates[:1000]:
+        await dp.feed_update(bot, update)
+
+    # Best of several rounds, to reduce noise from GC and other processes
+    best = float("inf")
+    for _ in range(rounds):
+        started = perf_counter()
+        for update in updates:
+            await dp.feed_update(bot, update)
+        best = min(best, perf_counter() - started)
+    per_update = best / len(updates) * 1_000_000
+    print(f"{name:<16} {per_update:8.2f} µs/update")
+    return per_update
+
+
+async def measure_classification(updates: list[Update], rounds: int):
+    # Only content checks, without aiogram dispatch machinery
+    forwardable_filter = LegacyForwardableTypesFilter()
+    service_filter = LegacyServiceMessagesFilter()
+    content_router = ContentRouter(content_config)
+    messages = [update.message for update in updates]
+
+    best_legacy = best_table = float("inf")
+    for _ in range(rounds):
+        started = perf_counter()
+        for message in messages:
+            if not await forwardable_filter(message):
+                await service_filter(message)
+        best_legacy = min(best_legacy, perf_counter() - started)
+
+        started = perf_counter()
+        for message in messages:
+            await content_router(message)
+        best_table = min(best_table, perf_counter() - started)
+
+    print(f"{'filter chain':<16} {best_legacy / len(messages) * 1_000_000:8.2f} µs/message (classification only)")
+    print(f"{'routing table':<16} {best_table / len(messages) * 1_000_000:8.2f} µs/message (classification only)")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    # Updates must be bound to the same bot, otherwise aiogram re-validates every update
+    bot = Bot("42:BENCHMARK")
+    updates = [update.as_(bot) for update in make_updates(args.updates)]
+    legacy = await measure("filter chain", make_legacy_router(), bot, updates, args.rounds)
+    table = await measure("routing table", make_table_router(), bot, updates, args.rounds)
+    print(f"speedup: {legacy / table:.2f}x")
+    await measure_classification(updates, args.rounds)
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
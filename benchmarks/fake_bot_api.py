@@ -0,0 +1,89 @@
+"""
+Local fake Bot API server for benchmarks.
+
+Answers every method with a plausible successful result after a configurable delay,
+which stands for network round trip and server processing time.
+Can be used from other benchmarks with start_fake_bot_api(), or started on its own:
+    python -m benchmarks.fake_bot_api [--port 8081] [--latency 0.02]
+"""
+import argparse
+import asyncio
+import itertools
+from time import time
+
+from aiohttp import web
+
+FAKE_BOT_ID = 42
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.message_ids = itertools.count(1)
+        self.calls: dict[str, int] = dict()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": self.make_result(method, data)})
+
+    def make_result(self, method: str, data) -> object:
+        if method == "getMe":
+            return {"id": FAKE_BOT_ID, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        if method == "getUpdates":
+            return []
+        if method == "copyMessage":
+            return {"message_id": next(self.message_ids)}
+        if method == "copyMessages":
+            count = data["message_ids"].count(",") + 1
+            return [{"message_id": next(self.message_ids)} for _ in range(count)]
+        if method == "createForumTopic":
+            return {"message_thread_id": next(self.message_ids), "name": data.get("name", ""), "icon_color": 0}
+        if method.startswith("send") or method.startswith("edit"):
+            return {
+                "message_id": next(self.message_ids),
+                "date": int(time()),
+                "chat": {"id": int(data.get("chat_id", 1)), "type": "private"},
+                "text": data.get("text", ""),
+            }
+        return True
+
+
+async def start_fake_bot_api(
+        host: str = "127.0.0.1",
+        port: int = 8081,
+        latency: float = 0.0,
+) -> tuple[web.AppRunner, FakeBotAPI, str]:
+    """
+    Returns runner (to be cleaned up), server state and base URL
+    to be used with TelegramAPIServer.from_base()
+    """
+    fake_api = FakeBotAPI(latency)
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", fake_api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    return runner, fake_api, f"http://{host}:{port}"
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.02, help="Delay of every response, in seconds")
+    args = parser.parse_args()
+
+    runner, _, base_url = await start_fake_bot_api(args.host, args.port, args.latency)
+    print(f"Fake Bot API is listening on {base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+"""
+Throughput of copyMessage calls against local fake Bot API, depending on connection pool size.
+
+Compares aiogram's default AiohttpSession with TunedAiohttpSession (same pool size, keep-alive
+and orjson codec). Fake server delays every response, standing for network round trip,
+so throughput is mostly limited by the number of connections: pick connection_limit
+so that expected send rate fits with some headroom.
+
+Run from repository root:
+    python -m benchmarks.http_session [--requests 2000] [--concurrency 200] [--latency 0.02]
+"""
+import argparse
+import asyncio
+from time import perf_counter
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from benchmarks.fake_bot_api import start_fake_bot_api
+from bot.config_reader import HttpConfig
+from bot.http_session import TunedAiohttpSession
+
+
+async def measure(session: BaseSession, requests: int, concurrency: int) -> float:
+    bot = Bot("42:BENCHMARK", session=session)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def copy(message_id: int):
+        async with semaphore:
+            await bot.copy_message(chat_id=-1001, from_chat_id=1, message_id=message_id)
+
+    # Warm up, so that connections are already open
+    await asyncio.gather(*(copy(i) for i in range(concurrency)))
+
+    started = perf_counter()
+    await asyncio.gather(*(copy(i) for i in range(requests)))
+    elapsed = perf_counter() - started
+    await bot.session.close()
+    return requests / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200, help="Requests in flight at once")
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake server response delay, in seconds")
+    parser.add_argument("--limits", type=int, nargs="+", default=[1, 5, 10, 25, 50, 100, 200])
+    args = parser.parse_args()
+
+    runner, _, base_url = await start_fake_bot_api(latency=args.latency)
+    api = TelegramAPIServer.from_base(base_url)
+    print(f"{'connections':>11} {'default, rps':>14} {'tuned, rps':>12}")
+    try:
+        for limit in args.limits:
+            default_rps = await measure(
+                AiohttpSession(api=api, limit=limit),
+                args.requests,
+                args.concurrency,
+            )
+            tuned_rps = await measure(
+                TunedAiohttpSession(HttpConfig(connection_limit=limit), api=api),
+                args.requests,
+                args.concurrency,
+            )
+            print(f"{limit:>11} {default_rps:>14.1f} {tuned_rps:>12.1f}")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
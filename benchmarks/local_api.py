@@ -0,0 +1,82 @@
+"""
+Per-call latency of Bot API methods used in relay path, through official-like and co-located servers.
+
+Two fake Bot API servers are started: "remote" one delays every response by typical
+round trip to api.telegram.org, and "local" one stands for telegram-bot-api instance
+on the same host. Bot is configured in the same way as in production, via BotConfig.api_url,
+and calls the same methods as handlers do: copyMessage, editMessageMedia and createForumTopic.
+
+Run from repository root:
+    python -m benchmarks.local_api [--calls 200] [--remote-latency 0.06] [--local-latency 0.001]
+"""
+import argparse
+import asyncio
+from statistics import median, quantiles
+from time import perf_counter
+
+from aiogram import Bot
+from aiogram.types import InputMediaPhoto
+
+from benchmarks.fake_bot_api import start_fake_bot_api
+from bot.config_reader import BotConfig, HttpConfig
+from bot.http_session import TunedAiohttpSession, get_api_server
+
+
+async def measure(bot: Bot, calls: int) -> dict[str, list[float]]:
+    methods = {
+        "copyMessage": lambda i: bot.copy_message(chat_id=-1001, from_chat_id=1, message_id=i),
+        "editMessageMedia": lambda i: bot.edit_message_media(
+            chat_id=-1001,
+            message_id=i,
+            media=InputMediaPhoto(media="file-id"),
+        ),
+        "createForumTopic": lambda i: bot.create_forum_topic(chat_id=-1001, name=f"#id{i}"),
+    }
+    timings: dict[str, list[float]] = {name: list() for name in methods}
+    # One call of each method to open connection
+    for call in methods.values():
+        await call(0)
+    for i in range(1, calls + 1):
+        for name, call in methods.items():
+            started = perf_counter()
+            await call(i)
+            timings[name].append(perf_counter() - started)
+    return timings
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--remote-latency", type=float, default=0.06)
+    parser.add_argument("--local-latency", type=float, default=0.001)
+    args = parser.parse_args()
+
+    servers = {
+        "remote": await start_fake_bot_api(port=8081, latency=args.remote_latency),
+        "local": await start_fake_bot_api(port=8082, latency=args.local_latency),
+    }
+    print(f"{'server':<8} {'method':<18} {'p50, ms':>8} {'p95, ms':>8}")
+    try:
+        for name, (_, _, base_url) in servers.items():
+            bot_config = BotConfig(
+                token="42:BENCHMARK",
+                supergroup_id=-1001,
+                api_url=base_url,
+                api_is_local=name == "local",
+            )
+            bot = Bot(
+                bot_config.token.get_secret_value(),
+                session=TunedAiohttpSession(HttpConfig(), api=get_api_server(bot_config)),
+            )
+            timings = await measure(bot, args.calls)
+            await bot.session.close()
+            for method, values in timings.items():
+                p95 = quantiles(values, n=20)[-1]
+                print(f"{name:<8} {method:<18} {median(values) * 1000:>8.2f} {p95 * 1000:>8.2f}")
+    finally:
+        for runner, _, _ in servers.values():
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,181 @@
+"""
+Writes and lookups of memory-mapped pair file from bot.pair_file.
+
+First checks that a record read while it's being overwritten is either the old pair, the new one
+or a miss, for every order of the writer's and the reader's steps.
+
+Then fills the file with --pairs pairs (more than --capacity, so that the oldest ones are overwritten),
+then looks up recent pairs by original message and by copy, plus missing ones, from a separate
+read-only mapping, as workers do. Prints time per operation and file size per million pairs.
+The file is created in temporary directory.
+
+Run from repository root:
+    python -m benchmarks.pair_file [--capacity 1000000] [--pairs 1500000] [--lookups 200000]
+"""
+import argparse
+import itertools
+import os
+import random
+import struct
+import tempfile
+import threading
+from time import perf_counter
+
+from bot import pair_file
+from bot.db.queries import StoredPair
+from bot.pair_file import PairFile
+
+FORUM_CHAT_ID = -1001
+BOT_ID = 42
+# Like in real chats, some messages have several copies, e.g. album and its caption
+BATCH_SIZE = 2
+
+
+def get_pair(i: int) -> StoredPair:
+    return StoredPair(
+        from_chat_id=i % 10_000 + 1,
+        from_message_id=i // BATCH_SIZE,
+        to_chat_id=FORUM_CHAT_ID,
+        to_message_id=i,
+    )
+
+
+def measure(name: str, lookup, keys: list[int], expected: bool) -> float:
+    started = perf_counter()
+    found = 0
+    for i in keys:
+        if lookup(i) is not None:
+            found += 1
+    elapsed = perf_counter() - started
+    if expected and found != len(keys):
+        print(f"{name}: only {found} of {len(keys)} pairs found")
+    print(f"{name}: {elapsed / len(keys) * 1e6:.2f} µs per lookup")
+    return elapsed
+
+
+class Schedule:
+    """
+    Lets struct calls of writer and reader threads through one at a time, in the given order
+    """
+
+    def __init__(self, order: tuple[str, ...]):
+        self.order = order
+        self.step = 0
+        self.condition = threading.Condition()
+
+    def run(self, role: str, call, *args):
+        with self.condition:
+            self.condition.wait_for(lambda: self.order[self.step] == role)
+            result = call(*args)
+            self.step += 1
+            self.condition.notify_all()
+            return result
+
+
+class ScheduledStruct:
+    """
+    Packs and unpacks every field as a separate step, since copying of a whole struct isn't atomic either
+    """
+
+    def __init__(self, wrapped: struct.Struct, schedule: Schedule):
+        self.field = struct.Struct(f"={wrapped.format[1]}")
+        self.count = wrapped.size // self.field.size
+        self.schedule = schedule
+        self.size = wrapped.size
+
+    def pack_into(self, buffer, offset: int, *values):
+        for i, value in enumerate(values):
+            self.schedule.run("write", self.field.pack_into, buffer, offset + i * self.field.size, value)
+
+    def unpack_from(self, buffer, offset: int) -> tuple:
+        return tuple(
+            self.schedule.run("read", self.field.unpack_from, buffer, offset + i * self.field.size)[0]
+            for i in range(self.count)
+        )
+
+
+def check_torn_records(directory: str):
+    old = (BOT_ID, 1, 10, FORUM_CHAT_ID, 100)
+    new = (BOT_ID, 2, 20, FORUM_CHAT_ID - 1, 200)
+    path = os.path.join(directory, "torn.index")
+    writer = PairFile.create(path, 1)
+    reader = PairFile.open_readonly(path)
+    generation, body = pair_file.GENERATION, pair_file.BODY
+    # Every field of the record is one step for each side
+    steps = pair_file.RECORD.format.count("q") + 2
+    orders = [
+        tuple("write" if i in writes else "read" for i in range(steps * 2))
+        for writes in itertools.combinations(range(steps * 2), steps)
+    ]
+    accepted = 0
+    try:
+        for order in orders:
+            writer.write_record(0, 1, old)
+            schedule = Schedule(order)
+            pair_file.GENERATION = ScheduledStruct(generation, schedule)
+            pair_file.BODY = ScheduledStruct(body, schedule)
+            thread = threading.Thread(target=writer.write_record, args=(0, 2, new))
+            thread.start()
+            record = reader.read_record(0)
+            thread.join()
+            pair_file.GENERATION, pair_file.BODY = generation, body
+            if record not in (None, old, new):
+                error = f"Torn record {record} was read with order {order}"
+                raise AssertionError(error)
+            accepted += record is not None
+    finally:
+        pair_file.GENERATION, pair_file.BODY = generation, body
+        reader.close()
+        writer.close()
+    print(f"torn records: none in {len(orders)} orders of steps, {accepted} reads accepted")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--capacity", type=int, default=1_000_000)
+    parser.add_argument("--pairs", type=int, default=1_500_000)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        check_torn_records(directory)
+        path = os.path.join(directory, "pairs.index")
+        writer = PairFile.create(path, args.capacity)
+        reader = PairFile.open_readonly(path)
+        try:
+            started = perf_counter()
+            for start in range(0, args.pairs, BATCH_SIZE):
+                writer.add_many(BOT_ID, [get_pair(i) for i in range(start, min(start + BATCH_SIZE, args.pairs))])
+            elapsed = perf_counter() - started
+            print(f"add: {elapsed / args.pairs * 1e6:.2f} µs per pair")
+
+            # Only pairs which are still in ring, the newest ones
+            kept = range(max(args.pairs - args.capacity, 0), args.pairs)
+            keys = random.choices(kept, k=args.lookups)
+            measure(
+                "find by original message",
+                lambda i: reader.find(BOT_ID, *get_pair(i)[:2], originated_from_user=True),
+                keys,
+                expected=True,
+            )
+            measure(
+                "find by copy",
+                lambda i: reader.find(BOT_ID, *get_pair(i)[2:], originated_from_user=False),
+                keys,
+                expected=True,
+            )
+            measure(
+                "miss",
+                lambda i: reader.find(BOT_ID, FORUM_CHAT_ID, args.pairs + i, originated_from_user=False),
+                keys,
+                expected=False,
+            )
+            size = os.path.getsize(path)
+            print(f"file size: {size / 2 ** 20:.1f} MiB, {size / args.capacity * 1e6 / 2 ** 20:.1f} MiB per million pairs")
+        finally:
+            reader.close()
+            writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Soak test: hours of synthetic traffic through the production dispatcher (create_dispatcher,
+with all its middlewares, caches and background tasks), local fake Bot API and a database,
+to find slow memory leaks which only show after days of uptime.
+
+Users write new messages and edit recent ones, operators reply in topics. Every --interval
+seconds a tracemalloc snapshot is taken, and RSS, traced memory, live database sessions,
+open and checked out connections, asyncio tasks, live aiogram objects and sizes of all
+containers (caches, queues, dicts, sets) held by shared objects and middlewares are printed.
+The first measurement after --warmup is the baseline. In the end growth since baseline
+is checked against budgets, top allocating sites are printed as a diff with baseline snapshot,
+and exit status is non-zero when any budget is exceeded. Bounded caches may fill up
+after baseline, so only containers without size limit are checked against --items-budget.
+
+By default, SQLite file in temporary directory is used as database. Use --dsn to run
+against PostgreSQL (tables must not exist there). Logs are rendered as in production,
+but written to /dev/null.
+
+Run from repository root:
+    python -m benchmarks.soak [--duration 3600] [--rate 50] [--users 10000] [--interval 60] [--warmup 300]
+        [--rss-budget 50] [--heap-budget 20] [--count-budget 100] [--items-budget 1000] [--top 15]
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import resource
+import tempfile
+import tracemalloc
+from collections import deque
+from time import monotonic
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import TelegramObject
+from cachetools import Cache
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from sqlalchemy.orm import session as orm_session
+from sqlalchemy.pool import QueuePool
+import structlog
+from structlog import WriteLoggerFactory
+
+from benchmarks.fake_bot_api import FAKE_BOT_ID, start_fake_bot_api
+from benchmarks.relay_load import DATE, FORUM_CHAT_ID, Scenario, get_topic_ids
+from bot.config_reader import DbConfig, HttpConfig, LogConfig, LogRenderer
+from bot.db import Base
+from bot.db.backends import create_engine
+from bot.dispatcher import create_dispatcher
+from bot.http_session import TunedAiohttpSession
+from bot.logs import get_structlog_config
+from bot.middlewares import DbSessionMiddleware
+
+MB = 1024 * 1024
+
+# Containers are searched in attributes of shared objects and middlewares this deep,
+# e.g. middleware -> recent pairs index -> its caches
+SEARCH_DEPTH = 3
+
+
+class SoakScenario(Scenario):
+    def __init__(self, users: int):
+        super().__init__(users, messages=0)
+        self.recent_messages: deque[tuple[int, int]] = deque(maxlen=1000)
+        self.topic_ids: list[int] = list()
+
+    def next_update(self) -> dict:
+        roll = random.random()
+        if roll < 0.25 and self.topic_ids:
+            return self.operator_reply(random.choice(self.topic_ids), 0)
+        if roll < 0.35 and self.recent_messages:
+            return self.user_edit(*random.choice(self.recent_messages))
+        user_id = random.randint(1, self.users)
+        update = self.user_message(user_id, 0)
+        self.recent_messages.append((user_id, update["message"]["message_id"]))
+        return update
+
+    def user_edit(self, user_id: int, message_id: int) -> dict:
+        return {
+            "update_id": next(self.update_ids),
+            "edited_message": {
+                "message_id": message_id,
+                "date": DATE,
+                "edit_date": DATE + 1,
+                "chat": {"id": user_id, "type": "private", "first_name": "User"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+                "text": f"Edited message {message_id}",
+            },
+        }
+
+
+class ConnectionCounter:
+    # Not every pool counts its connections (e.g. SQLite uses NullPool), so pool events are counted
+    def __init__(self, engine: AsyncEngine):
+        pool = engine.pool
+        self.open = pool.checkedin() + pool.checkedout() if isinstance(pool, QueuePool) else 0
+        self.checked_out = pool.checkedout() if isinstance(pool, QueuePool) else 0
+        event.listen(pool, "connect", self.on_connect)
+        event.listen(pool, "close", self.on_close)
+        event.listen(pool, "checkout", self.on_checkout)
+        event.listen(pool, "checkin", self.on_checkin)
+
+    def on_connect(self, dbapi_connection, connection_record):
+        self.open += 1
+
+    def on_close(self, dbapi_connection, connection_record):
+        self.open -= 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checked_out += 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        self.checked_out -= 1
+
+
+def container_size(value: Any) -> int | None:
+    if isinstance(value, asyncio.Queue):
+        return value.qsize()
+    if isinstance(value, (dict, set, list, deque, Cache)):
+        return len(value)
+    return None
+
+
+def is_bounded(value: Any) -> bool:
+    return (
+        isinstance(value, Cache)
+        or isinstance(value, asyncio.Queue) and value.maxsize > 0
+        or isinstance(value, deque) and value.maxlen is not None
+    )
+
+
+def find_containers(dp: Dispatcher) -> dict[str, Any]:
+    owners: dict[str, Any] = dict(dp.workflow_data)
+    for router in dp.chain_tail:
+        for observer in router.observers.values():
+            for middleware in (*observer.outer_middleware, *observer.middleware):
+                owners.setdefault(type(middleware).__name__, middleware)
+
+    containers: dict[str, Any] = dict()
+    seen: set[int] = set()
+
+    def search(name: str, value: Any, depth: int):
+        if id(value) in seen:
+            return
+        seen.add(id(value))
+        if container_size(value) is not None:
+            containers[name] = value
+            return
+        # Only the bot's own objects are searched, not e.g. engine or localization internals
+        if depth == 0 or not type(value).__module__.startswith("bot."):
+            return
+        for attribute, attribute_value in getattr(value, "__dict__", {}).items():
+            if attribute.startswith("_"):
+                continue
+            search(f"{name}.{attribute}", attribute_value, depth - 1)
+
+    for name, owner in owners.items():
+        search(name, owner, SEARCH_DEPTH)
+    # Default FSM storage of aiogram keeps an entry for every chat and user it has seen
+    if isinstance(dp.fsm.storage, MemoryStorage):
+        containers["fsm_storage"] = dp.fsm.storage.storage
+    return containers
+
+
+def get_rss() -> int:
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak instead of current on systems without procfs, in kilobytes on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(connections: ConnectionCounter, containers: dict[str, Any]) -> dict[str, int]:
+    # Garbage in reference cycles is not a leak
+    gc.collect()
+    return {
+        "rss": get_rss(),
+        "heap": tracemalloc.get_traced_memory()[0],
+        "sessions": len(orm_session._sessions),
+        "connections": connections.open,
+        "checked_out": connections.checked_out,
+        "tasks": len(asyncio.all_tasks()),
+        # Checked by MRO, isinstance() of pydantic models looks up attributes of every object
+        "aiogram_objects": sum(TelegramObject in type(obj).__mro__ for obj in gc.get_objects()),
+        **{name: container_size(value) for name, value in containers.items()},
+    }
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+
+
+def print_measurement(elapsed: float, handled: int, errors: int, values: dict[str, int]):
+    print(
+        f"{elapsed / 60:7.1f} min  updates {handled:>9}  errors {errors:>5}"
+        f"  rss {values['rss'] / MB:7.1f} MB  heap {values['heap'] / MB:7.1f} MB"
+        f"  sessions {values['sessions']:>4}  connections {values['connections']:>3}"
+        f"  tasks {values['tasks']:>4}  aiogram objects {values['aiogram_objects']:>6}"
+    )
+
+
+def check_budgets(
+        args: argparse.Namespace,
+        containers: dict[str, Any],
+        baseline: dict[str, int],
+        final: dict[str, int],
+) -> list[str]:
+    growth = {name: final[name] - baseline[name] for name in final}
+    failures = list()
+    if growth["rss"] > args.rss_budget * MB:
+        failures.append(f"RSS grew by {growth['rss'] / MB:.1f} MB")
+    if growth["heap"] > args.heap_budget * MB:
+        failures.append(f"traced memory grew by {growth['heap'] / MB:.1f} MB")
+    for name in ("sessions", "connections", "checked_out", "tasks", "aiogram_objects"):
+        if growth[name] > args.count_budget:
+            failures.append(f"{name} grew by {growth[name]}")
+    for name, value in containers.items():
+        if not is_bounded(value) and growth[name] > args.items_budget:
+            failures.append(f"{name} grew by {growth[name]} items")
+    return failures
+
+
+async def run_soak(args: argparse.Namespace) -> list[str]:
+    runner, _, base_url = await start_fake_bot_api(port=args.port, latency=args.latency)
+    bot = Bot(
+        f"{FAKE_BOT_ID}:SOAK",
+        session=TunedAiohttpSession(HttpConfig(), api=TelegramAPIServer.from_base(base_url)),
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        dsn = args.dsn or f"sqlite+aiosqlite:///{os.path.join(directory, 'soak.sqlite')}"
+        # Separate engine, so that schema setup doesn't leave connections in the measured pool
+        schema_engine = create_engine(DbConfig(dsn=dsn, echo=False))
+        async with schema_engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+        # Settings are read by create_dispatcher, all optional sections keep their defaults
+        settings_path = os.path.join(directory, "settings.toml")
+        with open(settings_path, "w") as file:
+            file.write(
+                f'[bot]\ntoken = "{FAKE_BOT_ID}:SOAK"\nsupergroup_id = {FORUM_CHAT_ID}\n\n'
+                f'[db]\ndsn = "{dsn}"\necho = false\n'
+            )
+        os.environ["CONFIG_FILE_PATH"] = settings_path
+
+        dp = await create_dispatcher(bot)
+        session_middleware = next(
+            middleware for middleware in dp.update.outer_middleware
+            if isinstance(middleware, DbSessionMiddleware)
+        )
+        session_pool: async_sessionmaker = session_middleware.session_pool
+        engine: AsyncEngine = session_pool.kw["bind"]
+        connections = ConnectionCounter(engine)
+        await dp.emit_startup(bot=bot, **dp.workflow_data)
+        containers = find_containers(dp)
+
+        scenario = SoakScenario(args.users)
+        handled = 0
+        errors = 0
+        baseline: dict[str, int] | None = None
+        baseline_snapshot: tracemalloc.Snapshot | None = None
+        values: dict[str, int] = dict()
+
+        started = monotonic()
+        next_measurement = started + args.warmup
+        while monotonic() - started < args.duration:
+            second_started = monotonic()
+            results = await asyncio.gather(
+                *(dp.feed_raw_update(bot, scenario.next_update()) for _ in range(args.rate)),
+                return_exceptions=True,
+            )
+            handled += len(results)
+            errors += sum(isinstance(result, Exception) for result in results)
+
+            if monotonic() >= next_measurement:
+                scenario.topic_ids = await get_topic_ids(session_pool)
+                values = measure(connections, containers)
+                print_measurement(monotonic() - started, handled, errors, values)
+                if baseline is None:
+                    baseline = values
+                    baseline_snapshot = take_snapshot()
+                else:
+                    top = take_snapshot().compare_to(baseline_snapshot, "lineno")[0]
+                    print(f"           top site: {top}")
+                next_measurement = monotonic() + args.interval
+            elif not scenario.topic_ids:
+                # Operators start replying as soon as the first topics are created
+                scenario.topic_ids = await get_topic_ids(session_pool)
+
+            await asyncio.sleep(max(0.0, 1 - (monotonic() - second_started)))
+
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+        final = measure(connections, containers)
+        final_snapshot = take_snapshot()
+        await engine.dispose()
+        async with schema_engine.begin() as connection:
+            await connection.run_sync(Base.metadata.drop_all)
+        await schema_engine.dispose()
+
+    await bot.session.close()
+    await runner.cleanup()
+
+    if baseline is None:
+        return ["duration is shorter than warm-up, nothing to compare"]
+
+    print(f"\n{'growth since baseline':<60} {'baseline':>12} {'final':>12}")
+    for name in final:
+        marker = "" if name not in containers or is_bounded(containers[name]) else "  (unbounded)"
+        print(f"{name:<60} {baseline[name]:>12} {final[name]:>12}{marker}")
+    print(f"\nTop {args.top} allocating sites since baseline:")
+    for stat in final_snapshot.compare_to(baseline_snapshot, "lineno")[:args.top]:
+        print(f"  {stat}")
+    return check_budgets(args, containers, baseline, final)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=int, default=3600, help="In seconds")
+    parser.add_argument("--rate", type=int, default=50, help="Updates per second")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--interval", type=int, default=60, help="Seconds between measurements")
+    parser.add_argument("--warmup", type=int, default=300, help="Seconds before baseline measurement")
+    parser.add_argument("--rss-budget", type=float, default=50, help="Allowed RSS growth, in MB")
+    parser.add_argument("--heap-budget", type=float, default=20, help="Allowed traced memory growth, in MB")
+    parser.add_argument("--count-budget", type=int, default=100, help="Allowed growth of sessions, tasks, etc.")
+    parser.add_argument("--items-budget", type=int, default=1000, help="Allowed growth of unbounded containers")
+    parser.add_argument("--top", type=int, default=15, help="Allocating sites in the final diff")
+    parser.add_argument("--frames", type=int, default=1, help="Traceback depth kept by tracemalloc")
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake Bot API response delay, in seconds")
+    parser.add_argument("--port", type=int, default=8095)
+    parser.add_argument("--dsn", default=None)
+    args = parser.parse_args()
+
+    # Same logging as in production, including cached loggers, but nothing is shown
+    log_config = LogConfig(
+        show_datetime=True,
+        datetime_format="%Y-%m-%d %H:%M:%S",
+        show_debug_logs=False,
+        time_in_utc=False,
+        use_colors_in_console=False,
+        renderer=LogRenderer.JSON,
+    )
+    structlog_config = get_structlog_config(log_config)
+    structlog_config["logger_factory"] = WriteLoggerFactory(file=open(os.devnull, "w"))
+    structlog.configure(**structlog_config)
+
+    tracemalloc.start(args.frames)
+    failures = asyncio.run(run_soak(args))
+    if failures:
+        raise SystemExit("Budget exceeded: " + "; ".join(failures))
+    print("All budgets are met")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,45 @@
-import asyncio
+from argparse import ArgumentParser
 
 import structlog
-from aiogram import Bot, Dispatcher
-from sqlalchemy import text
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from aiogram import Bot
 from structlog.typing import FilteringBoundLogger
 
-from bot.config_reader import get_config, LogConfig, BotConfig, DbConfig
-from bot.fluent_loader import get_fluent_localization
-from bot.handlers import get_routers
+from bot.config_reader import (
+    get_config, get_optional_config,
+    LogConfig, BotConfig, HttpConfig, MetricsConfig, EventLoopConfig, MultiTenantConfig,
+)
+from bot.event_loop import run
+from bot.dispatcher import create_dispatcher
+from bot.http_session import TunedAiohttpSession, get_api_server
 from bot.logs import get_structlog_config
-from bot.middlewares import DbSessionMiddleware
+from bot.metrics import start_metrics_server
+from bot.tenants import run_tenants
+from bot.workers import Supervisor
 
 
 async def main():
     log_config: LogConfig = get_config(model=LogConfig, root_key="logs")
     structlog.configure(**get_structlog_config(log_config))
 
-    bot_config: BotConfig = get_config(model=BotConfig, root_key="bot")
-    bot = Bot(bot_config.token.get_secret_value())
-
-    l10n = get_fluent_localization()
-
-    dp = Dispatcher(
-        l10n=l10n,
-    )
+    metrics_config: MetricsConfig = get_optional_config(model=MetricsConfig, root_key="metrics")
+    multi_tenant_config: MultiTenantConfig = get_optional_config(model=MultiTenantConfig, root_key="multi_tenant")
+    if multi_tenant_config.bots:
+        if metrics_config.enabled:
+            await start_metrics_server(metrics_config)
+        await run_tenants(multi_tenant_config)
+        return
 
-    db_config: DbConfig = get_config(model=DbConfig, root_key="db")
-
-    engine = create_async_engine(
-        url=str(db_config.dsn),
+    bot_config: BotConfig = get_config(model=BotConfig, root_key="bot")
+    http_config: HttpConfig = get_optional_config(model=HttpConfig, root_key="http")
+    bot = Bot(
+        bot_config.token.get_secret_value(),
+        session=TunedAiohttpSession(http_config, api=get_api_server(bot_config)),
     )
-    async with engine.begin() as conn:
-        await conn.execute(text("SELECT 1"))
 
-    Sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
-    dp.update.outer_middleware(DbSessionMiddleware(Sessionmaker))
+    dp = await create_dispatcher(bot)
 
-    dp.include_routers(*get_routers(supergroup_id=bot_config.supergroup_id))
+    if metrics_config.enabled:
+        await start_metrics_server(metrics_config)
 
     logger: FilteringBoundLogger = structlog.get_logger()
     await logger.ainfo("Starting polling...")
@@ -45,4 +47,21 @@ async def main():
     await dp.start_polling(bot)
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes. With more than one, updates are handled in separate processes",
+    )
+    args = parser.parse_args()
+
+    loop_config: EventLoopConfig = get_optional_config(model=EventLoopConfig, root_key="event_loop")
+    multi_tenant_config: MultiTenantConfig = get_optional_config(model=MultiTenantConfig, root_key="multi_tenant")
+    if args.workers > 1 and multi_tenant_config.bots:
+        parser.error("worker processes can't be used with several bots in [multi_tenant] section")
+    if args.workers > 1:
+        run(Supervisor(args.workers).run(), loop_config)
+    else:
+        run(main(), loop_config)
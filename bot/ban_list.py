@@ -0,0 +1,183 @@
+import asyncio
+import math
+from functools import partial
+from hashlib import blake2b
+from typing import Callable
+
+import structlog
+from cachetools import LRUCache
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import BanListConfig
+from bot.db.models import BannedUser
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+LOAD_BATCH_SIZE = 10_000
+
+
+class BloomFilter:
+    """
+    Set of integers with no false negatives and configured rate of false positives,
+    which takes about 1.2 bytes per item at 1% error rate.
+    Items cannot be removed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item: int):
+        # Double hashing: k positions are derived from two independent 64-bit hashes
+        digest = blake2b(item.to_bytes(8, "big", signed=True), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big")
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, item: int):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class BanList:
+    """
+    In-memory index of users banned in one bot, so that their updates are dropped without touching database.
+    Up to configured count, ids are kept in a set and answers are exact. Above it, a bloom filter
+    is used, and only its positive answers (banned users and rare false positives)
+    are confirmed with database.
+
+    Changes made with ban() and unban() are passed to listeners, which deliver them
+    to other processes. Changes from other processes are applied with apply().
+    """
+
+    def __init__(self, session_pool: async_sessionmaker, ban_list_config: BanListConfig, bot_id: int):
+        self.session_pool = session_pool
+        self.config = ban_list_config
+        self.bot_id = bot_id
+        self.banned: set[int] = set()
+        self.bloom: BloomFilter | None = None
+        self.confirmed: LRUCache[int, bool] = LRUCache(maxsize=ban_list_config.confirm_cache_size)
+        self.listeners: list[Callable[[int, bool], None]] = list()
+
+    async def load(self):
+        async with self.session_pool() as session:
+            count = await session.scalar(
+                select(func.count()).select_from(BannedUser).where(BannedUser.bot_id == self.bot_id)
+            )
+            if count > self.config.set_limit:
+                # Spare capacity for bans made while the bot is running
+                self.bloom = BloomFilter(capacity=count * 2, error_rate=self.config.false_positive_rate)
+            user_ids = await session.stream_scalars(
+                select(BannedUser.user_id)
+                .where(BannedUser.bot_id == self.bot_id)
+                .execution_options(yield_per=LOAD_BATCH_SIZE)
+            )
+            async for user_id in user_ids:
+                if self.bloom is not None:
+                    self.bloom.add(user_id)
+                else:
+                    self.banned.add(user_id)
+        await logger.ainfo("Ban list loaded", bot_id=self.bot_id, banned=count, bloom_filter=self.bloom is not None)
+
+    def might_be_banned(self, user_id: int) -> bool:
+        if self.bloom is None:
+            return user_id in self.banned
+        return user_id in self.bloom
+
+    async def is_banned(self, user_id: int) -> bool:
+        if not self.might_be_banned(user_id):
+            return False
+        if self.bloom is None:
+            return True
+        banned = self.confirmed.get(user_id)
+        if banned is None:
+            async with self.session_pool() as session:
+                banned = await session.get(BannedUser, (self.bot_id, user_id)) is not None
+            self.confirmed[user_id] = banned
+        return banned
+
+    def apply(self, user_id: int, banned: bool):
+        if self.bloom is not None:
+            if banned:
+                self.bloom.add(user_id)
+            self.confirmed[user_id] = banned
+        elif banned:
+            self.banned.add(user_id)
+        else:
+            self.banned.discard(user_id)
+
+    def ban(self, user_id: int):
+        self.apply(user_id, True)
+        self.notify(user_id, True)
+
+    def unban(self, user_id: int):
+        self.apply(user_id, False)
+        self.notify(user_id, False)
+
+    def notify(self, user_id: int, banned: bool):
+        for listener in self.listeners:
+            listener(user_id, banned)
+
+
+class RedisBanListSync:
+    """
+    Keeps ban lists of several bot instances in sync with Redis pub/sub. One connection serves
+    ban lists of all bots of the process: messages carry bot id and are applied to the ban list
+    of that bot, if it's served here. Bans are persisted in database anyway, so a missed message
+    only matters until the next restart of that instance.
+    """
+
+    def __init__(self, redis_url: str, channel: str):
+        from redis.asyncio import Redis
+
+        self.redis = Redis.from_url(redis_url)
+        self.channel = channel
+        self.ban_lists: dict[int, BanList] = dict()
+        self.task: asyncio.Task | None = None
+        self.publishing: set[asyncio.Task] = set()
+
+    async def add(self, ban_list: BanList):
+        # Added after ban list is loaded, so that changes from other instances go on top of loaded bans
+        self.ban_lists[ban_list.bot_id] = ban_list
+        ban_list.listeners.append(partial(self.publish, ban_list.bot_id))
+
+    async def start(self):
+        self.task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, *self.publishing, return_exceptions=True)
+        await self.redis.aclose()
+
+    def publish(self, bot_id: int, user_id: int, banned: bool):
+        message = f"{'ban' if banned else 'unban'}:{bot_id}:{user_id}"
+        task = asyncio.create_task(self.redis.publish(self.channel, message))
+        self.publishing.add(task)
+        task.add_done_callback(self.publishing.discard)
+
+    async def listen(self):
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        action, bot_id, user_id = message["data"].decode().split(":")
+                        # Own messages come back too, which is harmless
+                        ban_list = self.ban_lists.get(int(bot_id))
+                        if ban_list is not None:
+                            ban_list.apply(int(user_id), action == "ban")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await logger.aexception("Ban list sync failed, reconnecting")
+                await asyncio.sleep(5)
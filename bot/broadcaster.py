@@ -0,0 +1,290 @@
+import asyncio
+from time import monotonic
+from uuid import UUID
+
+import structlog
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+from fluent.runtime import FluentLocalization
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import BroadcastConfig
+from bot.db.models import Broadcast, BroadcastFailure, Topic
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+
+class RateLimiter:
+    """
+    Spreads calls evenly, so that no more than `rate` calls per second are made in total,
+    no matter how many workers share this limiter.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_time = 0.0
+        self.paused_until = 0.0
+
+    async def wait(self):
+        while True:
+            now = monotonic()
+            if self.next_time < now:
+                self.next_time = now
+            delay = self.next_time - now
+            self.next_time += self.interval
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Slot could have been taken before limiter was paused
+            if monotonic() >= self.paused_until:
+                return
+
+    def pause(self, seconds: float):
+        # Flood limit is applied to the whole bot, so all workers back off, not only the one which hit it
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+        self.next_time = max(self.next_time, self.paused_until)
+
+
+class Broadcaster:
+    """
+    Copies a message from forum chat to every user of the bot from topics table.
+    Recipients are streamed with server-side cursor in order of user id and sent in chunks
+    by a pool of workers. After every chunk, failures are saved in bulk and progress is checkpointed,
+    so an unfinished broadcast is resumed after restart.
+    """
+
+    def __init__(
+            self,
+            bot: Bot,
+            session_pool: async_sessionmaker,
+            forum_chat_id: int,
+            l10n: FluentLocalization,
+            broadcast_config: BroadcastConfig,
+    ):
+        self.bot = bot
+        self.session_pool = session_pool
+        self.forum_chat_id = forum_chat_id
+        self.l10n = l10n
+        self.config = broadcast_config
+        # Keep references to running tasks, otherwise they can be garbage collected
+        self.tasks: dict[UUID, asyncio.Task] = dict()
+
+    async def start(
+            self,
+            message_id: int,
+            status_message_id: int,
+    ) -> Broadcast:
+        async with self.session_pool() as session:
+            total = await session.scalar(
+                select(func.count()).select_from(Topic).where(Topic.bot_id == self.bot.id)
+            )
+            broadcast = Broadcast(
+                bot_id=self.bot.id,
+                message_id=message_id,
+                status_message_id=status_message_id,
+                total=total,
+                sent=0,
+                failed=0,
+            )
+            session.add(broadcast)
+            await session.commit()
+        await logger.ainfo("Started broadcast", broadcast_id=str(broadcast.id), total=total)
+        self.spawn(broadcast)
+        return broadcast
+
+    async def resume_unfinished(self):
+        async with self.session_pool() as session:
+            result = await session.scalars(
+                select(Broadcast).where(Broadcast.bot_id == self.bot.id, Broadcast.finished.is_(False))
+            )
+            broadcasts = result.all()
+        for broadcast in broadcasts:
+            await logger.ainfo(
+                "Resuming broadcast",
+                broadcast_id=str(broadcast.id),
+                last_user_id=broadcast.last_user_id,
+            )
+            self.spawn(broadcast)
+
+    async def stop(self):
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    def spawn(self, broadcast: Broadcast):
+        if broadcast.id in self.tasks:
+            return
+        task = asyncio.create_task(self.run(broadcast))
+        self.tasks[broadcast.id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(broadcast.id, None))
+
+    async def run(self, broadcast: Broadcast):
+        rate_limiter = RateLimiter(self.config.rate_limit)
+        queue: asyncio.Queue[int] = asyncio.Queue(maxsize=self.config.workers * 2)
+        failures: list[BroadcastFailure] = list()
+        workers = [
+            asyncio.create_task(self.worker(broadcast, queue, rate_limiter, failures))
+            for _ in range(self.config.workers)
+        ]
+
+        query = (
+            select(Topic.user_id)
+            .where(Topic.bot_id == self.bot.id)
+            .order_by(Topic.user_id)
+            .execution_options(yield_per=self.config.chunk_size)
+        )
+        if broadcast.last_user_id is not None:
+            query = query.where(Topic.user_id > broadcast.last_user_id)
+
+        started_at = monotonic()
+        last_report_at = started_at
+        processed_at_start = broadcast.sent + broadcast.failed
+        try:
+            async with self.session_pool() as stream_session:
+                recipients = await stream_session.stream_scalars(query)
+                async for chunk in recipients.partitions():
+                    for user_id in chunk:
+                        await queue.put(user_id)
+                    await queue.join()
+
+                    await self.checkpoint(broadcast, chunk[-1], len(chunk), failures)
+                    failures.clear()
+
+                    now = monotonic()
+                    if now - last_report_at >= self.config.progress_interval:
+                        last_report_at = now
+                        processed = broadcast.sent + broadcast.failed
+                        speed = (processed - processed_at_start) / (now - started_at)
+                        await self.report_progress(broadcast, speed)
+        except asyncio.CancelledError:
+            await logger.ainfo("Broadcast interrupted", broadcast_id=str(broadcast.id))
+            raise
+        except Exception:
+            await logger.aexception("Broadcast failed", broadcast_id=str(broadcast.id))
+            return
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        await self.finish(broadcast)
+
+    async def worker(
+            self,
+            broadcast: Broadcast,
+            queue: asyncio.Queue[int],
+            rate_limiter: RateLimiter,
+            failures: list[BroadcastFailure],
+    ):
+        while True:
+            user_id = await queue.get()
+            try:
+                error = await self.send(broadcast, user_id, rate_limiter)
+                if error is not None:
+                    failures.append(BroadcastFailure(
+                        broadcast_id=broadcast.id,
+                        user_id=user_id,
+                        error=error,
+                    ))
+            finally:
+                queue.task_done()
+
+    async def send(
+            self,
+            broadcast: Broadcast,
+            user_id: int,
+            rate_limiter: RateLimiter,
+            max_attempts: int = 3,
+    ) -> str | None:
+        for _ in range(max_attempts):
+            await rate_limiter.wait()
+            try:
+                await self.bot.copy_message(
+                    chat_id=user_id,
+                    from_chat_id=self.forum_chat_id,
+                    message_id=broadcast.message_id,
+                )
+                return None
+            except TelegramRetryAfter as ex:
+                await logger.awarning("Hit flood limit during broadcast", retry_after=ex.retry_after)
+                rate_limiter.pause(ex.retry_after)
+            except TelegramForbiddenError as ex:
+                # Most likely, user has blocked the bot
+                return f"{ex.__class__.__name__}: {ex.message}"
+            except TelegramAPIError as ex:
+                return f"{ex.__class__.__name__}: {ex.message}"
+        return "Too many flood limit errors"
+
+    async def checkpoint(
+            self,
+            broadcast: Broadcast,
+            last_user_id: int,
+            processed: int,
+            failures: list[BroadcastFailure],
+    ):
+        broadcast.last_user_id = last_user_id
+        broadcast.failed += len(failures)
+        broadcast.sent += processed - len(failures)
+        async with self.session_pool() as session:
+            session.add_all(failures)
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast.id)
+                .values(
+                    last_user_id=broadcast.last_user_id,
+                    sent=broadcast.sent,
+                    failed=broadcast.failed,
+                )
+            )
+            await session.commit()
+
+    async def report_progress(self, broadcast: Broadcast, speed: float):
+        processed = broadcast.sent + broadcast.failed
+        remaining = max(broadcast.total - processed, 0)
+        eta_minutes = round(remaining / speed / 60) if speed > 0 else 0
+        await self.update_status(
+            broadcast,
+            self.l10n.format_value(
+                "broadcast-progress",
+                {
+                    "sent": broadcast.sent,
+                    "failed": broadcast.failed,
+                    "total": broadcast.total,
+                    "speed": round(speed, 1),
+                    "eta": eta_minutes,
+                },
+            ),
+        )
+
+    async def finish(self, broadcast: Broadcast):
+        broadcast.finished = True
+        async with self.session_pool() as session:
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast.id)
+                .values(finished=True)
+            )
+            await session.commit()
+        await logger.ainfo(
+            "Finished broadcast",
+            broadcast_id=str(broadcast.id),
+            sent=broadcast.sent,
+            failed=broadcast.failed,
+        )
+        await self.update_status(
+            broadcast,
+            self.l10n.format_value(
+                "broadcast-finished",
+                {"sent": broadcast.sent, "failed": broadcast.failed},
+            ),
+        )
+
+    async def update_status(self, broadcast: Broadcast, text: str):
+        try:
+            await self.bot.edit_message_text(
+                chat_id=self.forum_chat_id,
+                message_id=broadcast.status_message_id,
+                text=text,
+            )
+        except TelegramAPIError:
+            await logger.aexception("Failed to update broadcast status message")
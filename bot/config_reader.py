@@ -2,12 +2,18 @@ from enum import StrEnum, auto
 from functools import lru_cache
 from os import getenv
 from tomllib import load
-from typing import Type, TypeVar
+from typing import Annotated, Type, TypeVar
 
-from pydantic import BaseModel, SecretStr, field_validator, PostgresDsn
+from aiogram.enums import ContentType
+from pydantic import (
+    AnyUrl, BaseModel, Field, SecretStr, StringConstraints, UrlConstraints, field_validator, PostgresDsn,
+)
 
 ConfigType = TypeVar("ConfigType", bound=BaseModel)
 
+# Embedded database, e.g. "sqlite+aiosqlite:///data/feedback_bot.sqlite"
+SqliteDsn = Annotated[AnyUrl, UrlConstraints(allowed_schemes=["sqlite+aiosqlite"])]
+
 
 class LogRenderer(StrEnum):
     JSON = auto()
@@ -17,6 +23,27 @@ class LogRenderer(StrEnum):
 class BotConfig(BaseModel):
     token: SecretStr
     supergroup_id: int
+    # Base URL of self-hosted Bot API server, e.g. "http://localhost:8081".
+    # Official server (https://api.telegram.org) is used by default.
+    api_url: str | None = None
+    # Whether self-hosted server runs with --local flag, i.e. files are served from local disk
+    api_is_local: bool = False
+
+
+class TenantConfig(BaseModel):
+    token: SecretStr
+    supergroup_id: int
+    # Directory with strings.ftl inside bot/locale, e.g. "en" for bot/locale/en/strings.ftl.
+    # Its name is also used as language code for plural forms and numbers, so it can only have letters
+    locale: Annotated[str, StringConstraints(pattern=r"^[A-Za-z_-]+$")] = "current"
+
+
+class MultiTenantConfig(BaseModel):
+    # When not empty, all these bots are served by one process instead of the one from [bot] section
+    bots: list[TenantConfig] = []
+    # Same as in [bot] section, for all bots
+    api_url: str | None = None
+    api_is_local: bool = False
 
 
 class LogConfig(BaseModel):
@@ -33,8 +60,223 @@ class LogConfig(BaseModel):
         return v.lower()
 
 class DbConfig(BaseModel):
-    dsn: PostgresDsn
+    dsn: PostgresDsn | SqliteDsn
     echo: bool
+    # psycopg prepares statement on server side after it was executed this many times.
+    # Must be disabled when connecting through PgBouncer in transaction mode.
+    prepared_statements: bool = True
+    prepare_threshold: int = 1
+    # Read-only lookups are spread between these servers, writes always go to dsn
+    replica_dsns: list[PostgresDsn] = []
+    # Replica is not used for this many seconds after an error or too high replication lag
+    replica_ejection_time: int = 30
+    # Maximum replication lag, in seconds, and how often it is checked
+    replica_max_lag: float = 5
+    replica_health_check_interval: int = 5
+
+
+class CacheConfig(BaseModel):
+    unroutable_topics_size: int = 1024
+    unroutable_topics_ttl: int = 600
+    recent_pairs_size: int = 50_000
+    recent_pairs_window: int = 1800
+    # Links between users and topics, which never change once topic is created
+    topics_size: int = 100_000
+    file_ids_size: int = 10_000
+
+
+class ContentConfig(BaseModel):
+    # Types which are copied to the other side
+    allowed_types: set[ContentType] = {
+        ContentType.TEXT,
+        # These can have caption
+        ContentType.ANIMATION,
+        ContentType.AUDIO,
+        ContentType.DOCUMENT,
+        ContentType.PAID_MEDIA,
+        ContentType.PHOTO,
+        ContentType.VIDEO,
+        ContentType.VOICE,
+        # These cannot
+        ContentType.CONTACT,
+        ContentType.LOCATION,
+        ContentType.STICKER,
+        ContentType.STORY,
+        ContentType.VENUE,
+        ContentType.VIDEO_NOTE,
+    }
+    # Types which are ignored without any reply.
+    # All other types (games, polls, dice, invoices etc.) are rejected with error message.
+    dropped_types: set[ContentType] = {
+        ContentType.FORUM_TOPIC_CREATED,
+        ContentType.FORUM_TOPIC_EDITED,
+        ContentType.FORUM_TOPIC_CLOSED,
+        ContentType.FORUM_TOPIC_REOPENED,
+        ContentType.PINNED_MESSAGE,
+        ContentType.MESSAGE_AUTO_DELETE_TIMER_CHANGED,
+        ContentType.NEW_CHAT_PHOTO,
+        ContentType.DELETE_CHAT_PHOTO,
+        ContentType.NEW_CHAT_TITLE,
+        ContentType.CHAT_BACKGROUND_SET,
+        ContentType.USER_SHARED,
+        ContentType.CHAT_SHARED,
+    }
+    # Captions longer than this cannot be copied to forum topics, see
+    # https://github.com/tdlib/telegram-bot-api/issues/334#issuecomment-1311709507
+    caption_limit: int = 1023
+
+
+class BroadcastConfig(BaseModel):
+    # Telegram allows about 30 messages per second to different chats
+    rate_limit: float = 25
+    workers: int = 10
+    # Progress is saved after every chunk, so after restart at most one chunk is sent again
+    chunk_size: int = 500
+    progress_interval: int = 15
+
+
+class HttpConfig(BaseModel):
+    # Simultaneous connections to Bot API server
+    connection_limit: int = 100
+    # How long (in seconds) idle connections are kept open for reuse
+    keepalive_timeout: float = 60
+    dns_cache_ttl: int = 3600
+    # Default request timeout, in seconds
+    timeout: float = 60
+    # Timeouts for specific methods, e.g. {"copyMessage" = 10}
+    method_timeouts: dict[str, float] = {}
+    # Use orjson instead of json module to encode requests and decode responses
+    fast_json: bool = True
+
+
+class StatsConfig(BaseModel):
+    # Counters are saved to database when either of these is reached
+    flush_interval: int = 5
+    flush_size: int = 500
+    top_users: int = 10
+
+
+class EventLoopConfig(BaseModel):
+    # Use uvloop if it is installed, otherwise fall back to default asyncio loop
+    use_uvloop: bool = False
+    # How often event loop lag is measured, in seconds
+    lag_interval: float = 0.1
+    # Percentiles are calculated over this many latest measurements
+    lag_window: int = 600
+    # How often percentiles are logged and exported, in seconds
+    report_interval: int = 60
+    # Log a warning when 99th percentile of lag is above this, in seconds
+    lag_warning_threshold: float = 0.1
+
+
+class ProfilerConfig(BaseModel):
+    output_dir: str = "profiles"
+    # Default and maximum profiling duration, in seconds
+    duration: int = 30
+    max_duration: int = 600
+    # Stop after this many updates, even if duration hasn't passed yet
+    max_updates: int | None = None
+    # How often stacks are sampled and event loop lag is measured, in seconds
+    sample_interval: float = 0.005
+    loop_lag_interval: float = 0.05
+    # Callbacks which block event loop for longer than this are reported, in seconds
+    slow_callback_duration: float = 0.05
+
+
+class FloodConfig(BaseModel):
+    # Every user may send `burst` messages at once, and then `rate` messages per second
+    rate: float = 1.0
+    burst: int = 20
+    # Slow-down notice is sent to the same user at most once per this many seconds
+    notice_interval: int = 30
+    # Limits of users who haven't written for a while are forgotten
+    buckets_size: int = 100_000
+    buckets_ttl: int = 600
+    # Shedding mode is on while this share of database connections or Bot API connections is in use
+    shedding_threshold: float = 0.8
+    # How often (in seconds) deferred work checks if load went down
+    defer_interval: float = 1
+    # Deferred work above this count is dropped
+    max_deferred: int = 1000
+
+
+class SlowQueriesConfig(BaseModel):
+    enabled: bool = False
+    # Statements executed longer than this (in seconds) are logged with their parameters
+    threshold: float = 0.1
+    # And with their plan, but the same statement is explained at most once per this many seconds.
+    # Explaining runs the statement again, which adds load when database is already slow
+    explain: bool = False
+    explain_interval: int = 300
+    # Summary of statements with the highest total time, logged and reset periodically
+    summary_interval: int = 300
+    summary_size: int = 10
+    # Statements above this number are not counted in summary until it's reset
+    max_statements: int = 1000
+
+
+class WarmUpConfig(BaseModel):
+    enabled: bool = False
+    # Topics and message pairs active within this many seconds before start are loaded
+    # into memory, in background while the bot already handles updates
+    window: int = 3600
+    # Rows fetched from database at once
+    batch_size: int = 1000
+
+
+class PairFileConfig(BaseModel):
+    enabled: bool = False
+    # Pairs of recent messages are kept in this memory-mapped file, which survives restarts
+    # and is shared by all worker processes of the host
+    path: str = "pairs.index"
+    # The oldest pairs are overwritten above this count, file takes about 64 bytes per pair
+    capacity: int = 1_000_000
+    # With --workers, pairs saved by a worker are sent to supervisor at most this often, in seconds
+    flush_interval: float = 0.5
+
+
+class RelayBatchConfig(BaseModel):
+    enabled: bool = False
+    # Messages of one user which come within this many seconds after the first one are copied
+    # to forum topic at once. The first message waits for this long too
+    window: float = 0.3
+    # Bot API copies at most 100 messages at once
+    max_size: Annotated[int, Field(ge=1, le=100)] = 100
+
+
+class TracingConfig(BaseModel):
+    enabled: bool = False
+    # Traces of updates handled slower than this (in seconds) or with errors are always kept,
+    # and this share of other traces is kept at random
+    slow_threshold: float = 1.0
+    sample_rate: float = 0.0
+    # Kept traces are appended to this file in OTLP JSON format, one trace per line
+    output_file: str | None = "traces.jsonl"
+    # And/or sent to OpenTelemetry collector, e.g. "http://localhost:4318/v1/traces"
+    otlp_endpoint: str | None = None
+    service_name: str = "feedback-bot"
+    # How often (in seconds) kept traces are written and sent
+    flush_interval: int = 5
+    # SQL statements longer than this are cut in span attributes
+    max_statement_length: int = 1000
+
+
+class BanListConfig(BaseModel):
+    # Banned user ids are kept in a set up to this count. Above it, a bloom filter is used instead,
+    # and its positive answers are confirmed with database
+    set_limit: int = 1_000_000
+    false_positive_rate: float = 0.01
+    # Confirmed answers of database for bloom filter mode
+    confirm_cache_size: int = 10_000
+    # When set, bans are published to other bot instances with Redis pub/sub
+    redis_url: str | None = None
+    channel: str = "feedback-bot:bans"
+
+
+class MetricsConfig(BaseModel):
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 9090
 
 
 @lru_cache
@@ -57,3 +299,10 @@ def get_config(model: Type[ConfigType], root_key: str) -> ConfigType:
         error = f"Key {root_key} not found"
         raise ValueError(error)
     return model.model_validate(config_dict[root_key])
+
+
+@lru_cache
+def get_optional_config(model: Type[ConfigType], root_key: str) -> ConfigType:
+    # Same as get_config, but falls back to model defaults when section is missing
+    config_dict = parse_config_file()
+    return model.model_validate(config_dict.get(root_key, {}))
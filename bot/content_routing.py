@@ -0,0 +1,95 @@
+from enum import StrEnum, auto
+from typing import Callable, NamedTuple
+
+from aiogram.enums import ContentType
+from aiogram.filters import BaseFilter
+from aiogram.types import (
+    Message,
+    InputMediaAnimation, InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo,
+)
+
+from bot.config_reader import ContentConfig
+
+EditableMedia = InputMediaAnimation | InputMediaAudio | InputMediaDocument | InputMediaPhoto | InputMediaVideo
+
+
+class ContentAction(StrEnum):
+    FORWARD = auto()  # copy to the other side
+    DROP = auto()  # ignore silently (e.g. service messages)
+    REJECT = auto()  # tell sender that this type cannot be forwarded
+
+
+class ContentRoute(NamedTuple):
+    content_type: str
+    action: ContentAction
+    caption_too_long: bool
+
+
+class ContentRouter(BaseFilter):
+    """
+    Precomputed table of what to do with each content type.
+    Used as router-level filter: every message is classified once,
+    and the result is passed to middlewares and handlers as "content" argument.
+    """
+
+    def __init__(self, content_config: ContentConfig):
+        self.caption_limit = content_config.caption_limit
+        # Routes are immutable, so they are built once for every known type.
+        # Filter results are built once too, since aiogram only reads them.
+        self.routes: dict[str, ContentRoute] = dict()
+        for content_type in content_config.allowed_types:
+            self.routes[content_type] = ContentRoute(content_type, ContentAction.FORWARD, False)
+        for content_type in content_config.dropped_types:
+            self.routes[content_type] = ContentRoute(content_type, ContentAction.DROP, False)
+        self.results: dict[str, dict] = {
+            content_type: {"content": route} for content_type, route in self.routes.items()
+        }
+        self.text_route = self.routes.get(
+            ContentType.TEXT,
+            ContentRoute(ContentType.TEXT, ContentAction.REJECT, False),
+        )
+
+    def classify(self, message: Message) -> ContentRoute:
+        # Most likely, a message contains just text, so check this first
+        # before going through all the types in Message.content_type
+        if message.text is not None:
+            return self.text_route
+
+        content_type = message.content_type
+        route = self.routes.get(content_type)
+        if route is None:
+            route = ContentRoute(content_type, ContentAction.REJECT, False)
+        if message.caption is not None and len(message.caption) > self.caption_limit:
+            route = route._replace(caption_too_long=True)
+        return route
+
+    async def __call__(self, message: Message) -> bool | dict:
+        content = self.classify(message)
+        # Dropped messages (e.g. service ones) don't need any further processing,
+        # including handlers and database lookups in middlewares.
+        if content.action is ContentAction.DROP:
+            return False
+        if content.caption_too_long or content.action is ContentAction.REJECT:
+            return {"content": content}
+        return self.results[content.content_type]
+
+
+# How to build new media for editing, depending on content type of edited message
+EDITABLE_MEDIA: dict[str, Callable[[Message], EditableMedia]] = {
+    ContentType.ANIMATION: lambda message: InputMediaAnimation(media=message.animation.file_id),
+    ContentType.AUDIO: lambda message: InputMediaAudio(media=message.audio.file_id),
+    ContentType.DOCUMENT: lambda message: InputMediaDocument(media=message.document.file_id),
+    ContentType.PHOTO: lambda message: InputMediaPhoto(media=message.photo[-1].file_id),
+    ContentType.VIDEO: lambda message: InputMediaVideo(media=message.video.file_id),
+}
+
+
+def build_input_media(message: Message) -> EditableMedia | None:
+    builder = EDITABLE_MEDIA.get(message.content_type)
+    if builder is None:
+        return None
+    new_media = builder(message)
+    if message.caption:
+        new_media.caption = message.caption
+        new_media.caption_entities = message.caption_entities
+    return new_media
@@ -1,8 +1,16 @@
 from .base import Base
-from .models import MessageConnection, Topic
+from .models import (
+    BannedUser, Broadcast, BroadcastFailure, DailyStats, HourlyStats, MessageConnection, Topic, UserStats,
+)
 
 __all__ = [
     "Base",
+    "BannedUser",
+    "Broadcast",
+    "BroadcastFailure",
+    "DailyStats",
+    "HourlyStats",
     "MessageConnection",
     "Topic",
+    "UserStats",
 ]
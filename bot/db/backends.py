@@ -0,0 +1,114 @@
+from typing import Any
+
+from sqlalchemy import Table, event, func, make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.sql import ColumnElement
+
+from bot.config_reader import DbConfig
+
+
+class StorageBackend:
+    """
+    Everything which differs between supported databases: engine setup and the few statements
+    without a common SQL form. Models, lookups and migrations are the same for all of them.
+    """
+
+    name: str
+    # Prefixes of statement which show its plan, tried in order until one succeeds
+    explain_prefixes: tuple[str, ...]
+
+    def create_engine(self, dsn: str, db_config: DbConfig) -> AsyncEngine:
+        raise NotImplementedError()
+
+    def insert(self, table: type | Table) -> postgresql.Insert | sqlite.Insert:
+        # Insert which supports on_conflict_do_update()
+        raise NotImplementedError()
+
+    def greatest(self, *values: Any) -> ColumnElement:
+        raise NotImplementedError()
+
+
+class PostgresBackend(StorageBackend):
+    name = "postgresql"
+    # Analyzing insert of a pair which was already saved fails on unique constraint,
+    # then plan without execution is shown
+    explain_prefixes = ("EXPLAIN (ANALYZE, BUFFERS) ", "EXPLAIN ")
+
+    def create_engine(self, dsn: str, db_config: DbConfig) -> AsyncEngine:
+        connect_args = dict()
+        # Other drivers (e.g. asyncpg) don't accept this argument
+        if make_url(dsn).get_driver_name() == "psycopg":
+            connect_args["prepare_threshold"] = db_config.prepare_threshold if db_config.prepared_statements else None
+        return create_async_engine(
+            url=dsn,
+            echo=db_config.echo,
+            connect_args=connect_args,
+        )
+
+    def insert(self, table: type | Table) -> postgresql.Insert:
+        return postgresql.insert(table)
+
+    def greatest(self, *values: Any) -> ColumnElement:
+        return func.greatest(*values)
+
+
+class SqliteBackend(StorageBackend):
+    """
+    Embedded database in a single file, for small deployments and for running benchmarks
+    without a server. Only one process may write at a time, so it's not suitable
+    for multi-process mode with many workers.
+    """
+
+    name = "sqlite"
+    explain_prefixes = ("EXPLAIN QUERY PLAN ",)
+
+    # Waiting for a lock of another writer, in seconds
+    busy_timeout = 30
+
+    def create_engine(self, dsn: str, db_config: DbConfig) -> AsyncEngine:
+        engine = create_async_engine(
+            url=dsn,
+            echo=db_config.echo,
+            connect_args={"timeout": self.busy_timeout},
+        )
+        event.listen(engine.sync_engine, "connect", self.configure_connection)
+        return engine
+
+    @staticmethod
+    def configure_connection(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        # Readers don't block the writer and aren't blocked by it, as in PostgreSQL
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # Committed transactions survive crash of the process, but may be lost on power failure
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        # Needed for ON DELETE CASCADE of broadcast failures
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    def insert(self, table: type | Table) -> sqlite.Insert:
+        return sqlite.insert(table)
+
+    def greatest(self, *values: Any) -> ColumnElement:
+        # Multi-argument max() is a scalar function in SQLite
+        return func.max(*values)
+
+
+BACKENDS: dict[str, StorageBackend] = {
+    backend.name: backend
+    for backend in (PostgresBackend(), SqliteBackend())
+}
+
+
+def get_backend(dsn_or_dialect: str) -> StorageBackend:
+    # Accepts either DSN or dialect name, e.g. of session's engine
+    name = make_url(dsn_or_dialect).get_backend_name() if ":" in dsn_or_dialect else dsn_or_dialect
+    if name not in BACKENDS:
+        error = f"Unsupported database: {name}"
+        raise ValueError(error)
+    return BACKENDS[name]
+
+
+def create_engine(db_config: DbConfig, dsn: Any = None) -> AsyncEngine:
+    dsn = str(dsn or db_config.dsn)
+    return get_backend(dsn).create_engine(dsn, db_config)
@@ -1,8 +1,9 @@
-from datetime import datetime
-from uuid import uuid4
+from datetime import date, datetime
+from uuid import UUID, uuid4
 
-from sqlalchemy import UniqueConstraint, func, select, and_, TIMESTAMP
-from sqlalchemy.dialects.postgresql import UUID, BIGINT, INTEGER
+# Generic types, so that the same schema works with both PostgreSQL and SQLite
+from sqlalchemy import UniqueConstraint, ForeignKey, Index, func, select, and_, TIMESTAMP
+from sqlalchemy import Uuid, BIGINT, INTEGER, BOOLEAN, TEXT, DATE
 from sqlalchemy.orm import mapped_column, Mapped
 from sqlalchemy import select, desc
 
@@ -12,13 +13,20 @@ from bot.db.base import Base
 class MessageConnection(Base):
     __tablename__ = "messages"
     __table_args__ = (
+        # Every lookup is made within one bot, so bot id goes first in all indexes
         UniqueConstraint(
-            'from_chat_id', 'from_message_id', 'to_chat_id', 'to_message_id',
+            'bot_id', 'from_chat_id', 'from_message_id', 'to_chat_id', 'to_message_id',
             name='unique_messages_ids_combinations'
         ),
+        # Unique constraint above covers lookups by original message, this one is for lookups by copy
+        Index("ix_messages_bot_id_to_chat_id_to_message_id", "bot_id", "to_chat_id", "to_message_id"),
+        # For warm-up, which loads pairs created recently
+        Index("ix_messages_bot_id_created_at", "bot_id", "created_at"),
     )
 
-    id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    id: Mapped[UUID] = mapped_column(Uuid(as_uuid=True), primary_key=True, default=uuid4)
+    # Several bots can share one database, user ids and private chat ids are the same for all of them
+    bot_id: Mapped[int] = mapped_column(BIGINT, nullable=False)
     from_chat_id: Mapped[int] = mapped_column(BIGINT, nullable=False)
     from_message_id: Mapped[int] = mapped_column(BIGINT, nullable=False)
     to_chat_id: Mapped[int] = mapped_column(BIGINT, nullable=False)
@@ -32,6 +40,7 @@ class MessageConnection(Base):
     @classmethod
     def find_pair_message(
             cls,
+            bot_id: int,
             chat_id: int,
             message_id: int,
             originated_from_user: bool,
@@ -43,14 +52,19 @@ class MessageConnection(Base):
             chat_search_condition = cls.to_chat_id == chat_id
             message_search_condition = cls.to_message_id == message_id
 
+        # One original message can have several copies (e.g. media and its caption),
+        # in this case the first copy is the main one.
         return (
             select(cls)
             .where(
                 and_(
+                    cls.bot_id == bot_id,
                     chat_search_condition,
                     message_search_condition,
                 )
             )
+            .order_by(cls.to_message_id)
+            .limit(1)
         )
 
     def as_dict(self) -> dict:
@@ -66,12 +80,15 @@ class Topic(Base):
     __tablename__ = "topics"
     __table_args__ = (
         UniqueConstraint(
-            'user_id', 'topic_id',
+            'bot_id', 'user_id', 'topic_id',
             name='unique_topics_pairs'
         ),
+        # Unique constraint above covers lookups by user, this one is for lookups by topic
+        Index("ix_topics_bot_id_topic_id_created_at", "bot_id", "topic_id", "created_at"),
     )
 
-    id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    id: Mapped[UUID] = mapped_column(Uuid(as_uuid=True), primary_key=True, default=uuid4)
+    bot_id: Mapped[int] = mapped_column(BIGINT, nullable=False)
     user_id: Mapped[int] = mapped_column(BIGINT, nullable=False)
     topic_id: Mapped[int] = mapped_column(INTEGER, nullable=False)
     created_at: Mapped[datetime] = mapped_column(
@@ -81,18 +98,111 @@ class Topic(Base):
     )
 
     @classmethod
-    def find_by_user_id(cls, user_id: int):
-        return select(cls).where(Topic.user_id == user_id)
+    def find_by_user_id(cls, bot_id: int, user_id: int):
+        return select(cls).where(Topic.bot_id == bot_id, Topic.user_id == user_id)
 
 
     @classmethod
-    def find_by_topic_id(cls, topic_id: int):
+    def find_by_topic_id(cls, bot_id: int, topic_id: int):
         return (
             select(cls)
-            .where(cls.topic_id == topic_id)
+            .where(cls.bot_id == bot_id, cls.topic_id == topic_id)
             .order_by(desc(cls.created_at))
             .limit(1)
         )
 
     def __repr__(self):
         return f"Topic #{self.topic_id} for user {self.user_id}"
+
+
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+
+    id: Mapped[UUID] = mapped_column(Uuid(as_uuid=True), primary_key=True, default=uuid4)
+    # Sent to users of this bot only
+    bot_id: Mapped[int] = mapped_column(BIGINT, nullable=False)
+    # Message in forum chat which is copied to all users
+    message_id: Mapped[int] = mapped_column(BIGINT, nullable=False)
+    # Message in forum chat which shows progress
+    status_message_id: Mapped[int] = mapped_column(BIGINT, nullable=False)
+    total: Mapped[int] = mapped_column(INTEGER, nullable=False)
+    sent: Mapped[int] = mapped_column(INTEGER, nullable=False, default=0)
+    failed: Mapped[int] = mapped_column(INTEGER, nullable=False, default=0)
+    # Users are processed in order of their ids, so this is enough to resume after restart
+    last_user_id: Mapped[int | None] = mapped_column(BIGINT, nullable=True)
+    finished: Mapped[bool] = mapped_column(BOOLEAN, nullable=False, default=False)
+    created_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+
+    def __repr__(self):
+        return f"Broadcast {self.id} of message {self.message_id}"
+
+
+class BroadcastFailure(Base):
+    __tablename__ = "broadcast_failures"
+
+    id: Mapped[UUID] = mapped_column(Uuid(as_uuid=True), primary_key=True, default=uuid4)
+    broadcast_id: Mapped[UUID] = mapped_column(
+        Uuid(as_uuid=True),
+        ForeignKey("broadcasts.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    user_id: Mapped[int] = mapped_column(BIGINT, nullable=False)
+    error: Mapped[str] = mapped_column(TEXT, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+
+
+class UserStats(Base):
+    __tablename__ = "user_stats"
+    __table_args__ = (
+        Index("ix_user_stats_bot_id_messages_from_user", "bot_id", "messages_from_user"),
+    )
+
+    # Stats and bans of every bot are separate, so bot id is part of their primary keys
+    bot_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    messages_from_user: Mapped[int] = mapped_column(BIGINT, nullable=False, default=0)
+    messages_to_user: Mapped[int] = mapped_column(BIGINT, nullable=False, default=0)
+    first_seen: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=False)
+    last_activity: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=False)
+
+
+class DailyStats(Base):
+    __tablename__ = "daily_stats"
+
+    bot_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    day: Mapped[date] = mapped_column(DATE, primary_key=True)
+    active_users: Mapped[int] = mapped_column(INTEGER, nullable=False, default=0)
+    messages_from_users: Mapped[int] = mapped_column(BIGINT, nullable=False, default=0)
+    messages_to_users: Mapped[int] = mapped_column(BIGINT, nullable=False, default=0)
+
+
+class HourlyStats(Base):
+    __tablename__ = "hourly_stats"
+
+    bot_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    hour: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), primary_key=True)
+    messages_from_users: Mapped[int] = mapped_column(BIGINT, nullable=False, default=0)
+    messages_to_users: Mapped[int] = mapped_column(BIGINT, nullable=False, default=0)
+
+
+class BannedUser(Base):
+    __tablename__ = "banned_users"
+
+    bot_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    # Topic where user was banned
+    topic_id: Mapped[int] = mapped_column(INTEGER, nullable=False)
+    banned_by: Mapped[int] = mapped_column(BIGINT, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
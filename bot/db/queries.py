@@ -0,0 +1,93 @@
+from typing import NamedTuple
+
+from sqlalchemy import bindparam, desc, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.db.models import MessageConnection, Topic
+
+# Lookups made for almost every update. Statements are built once and reused,
+# so SQLAlchemy compiles each of them only once, and psycopg can prepare them on server side.
+# They are executed on session's connection, bypassing ORM: only needed columns are fetched
+# as plain tuples, without creating mapped objects.
+
+messages = MessageConnection.__table__
+topics = Topic.__table__
+
+pair_columns = (
+    messages.c.from_chat_id,
+    messages.c.from_message_id,
+    messages.c.to_chat_id,
+    messages.c.to_message_id,
+)
+
+# One original message can have several copies (e.g. media and its caption),
+# in this case the first copy is the main one.
+pair_by_origin_query = (
+    select(*pair_columns)
+    .where(messages.c.bot_id == bindparam("bot_id"))
+    .where(messages.c.from_chat_id == bindparam("chat_id"))
+    .where(messages.c.from_message_id == bindparam("message_id"))
+    .order_by(messages.c.to_message_id)
+    .limit(1)
+)
+
+pair_by_copy_query = (
+    select(*pair_columns)
+    .where(messages.c.bot_id == bindparam("bot_id"))
+    .where(messages.c.to_chat_id == bindparam("chat_id"))
+    .where(messages.c.to_message_id == bindparam("message_id"))
+    .order_by(messages.c.to_message_id)
+    .limit(1)
+)
+
+topic_by_user_query = (
+    select(topics.c.topic_id)
+    .where(topics.c.bot_id == bindparam("bot_id"))
+    .where(topics.c.user_id == bindparam("user_id"))
+)
+
+user_by_topic_query = (
+    select(topics.c.user_id)
+    .where(topics.c.bot_id == bindparam("bot_id"))
+    .where(topics.c.topic_id == bindparam("topic_id"))
+    .order_by(desc(topics.c.created_at))
+    .limit(1)
+)
+
+
+class StoredPair(NamedTuple):
+    from_chat_id: int
+    from_message_id: int
+    to_chat_id: int
+    to_message_id: int
+
+    def as_dict(self) -> dict:
+        return self._asdict()
+
+
+async def find_pair(
+        session: AsyncSession,
+        bot_id: int,
+        chat_id: int,
+        message_id: int,
+        originated_from_user: bool,
+) -> StoredPair | None:
+    query = pair_by_origin_query if originated_from_user else pair_by_copy_query
+    connection = await session.connection()
+    result = await connection.execute(query, {"bot_id": bot_id, "chat_id": chat_id, "message_id": message_id})
+    row = result.first()
+    if row is None:
+        return None
+    return StoredPair(*row)
+
+
+async def find_topic_id(session: AsyncSession, bot_id: int, user_id: int) -> int | None:
+    connection = await session.connection()
+    result = await connection.execute(topic_by_user_query, {"bot_id": bot_id, "user_id": user_id})
+    return result.scalar_one_or_none()
+
+
+async def find_user_id(session: AsyncSession, bot_id: int, topic_id: int) -> int | None:
+    connection = await session.connection()
+    result = await connection.execute(user_by_topic_query, {"bot_id": bot_id, "topic_id": topic_id})
+    return result.scalar_one_or_none()
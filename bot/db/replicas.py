@@ -0,0 +1,164 @@
+import asyncio
+import itertools
+from time import monotonic
+from typing import Any, Awaitable, Callable, TypeVar
+
+import structlog
+from sqlalchemy import text
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import DbConfig
+from bot.db.queries import StoredPair, find_pair, find_topic_id, find_user_id
+from bot.metrics import registry
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+replica_lookups_counter = registry.counter(
+    "replica_lookups_total",
+    "Lookups made on read replicas",
+)
+replica_misses_counter = registry.counter(
+    "replica_lookup_misses_total",
+    "Lookups which found nothing on replica and were repeated on primary",
+)
+replica_ejections_counter = registry.counter(
+    "replica_ejections_total",
+    "Times a replica was taken out of rotation because of errors or replication lag",
+)
+
+# Errors of the server or connection, not of the query itself
+CONNECTION_ERRORS = (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)
+
+# Replay timestamp is not updated while primary has no writes, so lag is only counted
+# when replica has received changes which are not applied yet
+replication_lag_query = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+T = TypeVar("T")
+
+
+class Replica:
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        self.session_pool = async_sessionmaker(engine, expire_on_commit=False)
+        self.ejected_until = 0.0
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+
+class ReplicaPool:
+    """
+    Read replicas used for lookups, picked in turn. A replica is taken out of rotation
+    for a while when a query on it fails or its replication lag is too high.
+    """
+
+    def __init__(self, db_config: DbConfig, engines: list[AsyncEngine]):
+        self.config = db_config
+        self.replicas = [
+            Replica(f"{engine.url.host}:{engine.url.port or 5432}", engine)
+            for engine in engines
+        ]
+        self.turns = itertools.cycle(self.replicas)
+        self.health_check_task: asyncio.Task | None = None
+
+    def pick(self) -> Replica | None:
+        now = monotonic()
+        for _ in range(len(self.replicas)):
+            replica = next(self.turns)
+            if replica.is_healthy(now):
+                return replica
+        return None
+
+    def eject(self, replica: Replica, reason: str, **details: Any):
+        if replica.is_healthy(monotonic()):
+            replica_ejections_counter.inc()
+            logger.warning("Replica is taken out of rotation", replica=replica.name, reason=reason, **details)
+        replica.ejected_until = monotonic() + self.config.replica_ejection_time
+
+    async def start(self):
+        self.health_check_task = asyncio.create_task(self.check_health())
+
+    async def stop(self):
+        if self.health_check_task is not None:
+            self.health_check_task.cancel()
+            await asyncio.gather(self.health_check_task, return_exceptions=True)
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    async def check_health(self):
+        while True:
+            for replica in self.replicas:
+                try:
+                    async with replica.engine.connect() as connection:
+                        lag = await connection.scalar(replication_lag_query)
+                except CONNECTION_ERRORS:
+                    self.eject(replica, "health check failed")
+                    continue
+                if lag is not None and lag > self.config.replica_max_lag:
+                    self.eject(replica, "replication lag is too high", lag=float(lag))
+            await asyncio.sleep(self.config.replica_health_check_interval)
+
+
+class ReadSession:
+    """
+    Read-only lookups of one update. They are made on a replica, when there are any, and one
+    replica session is used for all lookups of the update. Writes always use primary session.
+
+    Anything written by this bot may not have reached replica yet (e.g. topic created by
+    the previous message of the same user, or a pair which is being edited right now),
+    so lookup which finds nothing on replica is repeated on primary. This way replication lag
+    can only make lookups slower, but never makes the bot create a second topic for a user
+    or lose a pair to edit.
+    """
+
+    def __init__(self, primary: AsyncSession, bot_id: int, replicas: ReplicaPool | None = None):
+        self.primary = primary
+        self.bot_id = bot_id
+        self.replicas = replicas
+        self.replica: Replica | None = None
+        self.session: AsyncSession | None = None
+
+    async def find_pair(self, chat_id: int, message_id: int, originated_from_user: bool) -> StoredPair | None:
+        return await self.lookup(find_pair, self.bot_id, chat_id, message_id, originated_from_user)
+
+    async def find_topic_id(self, user_id: int) -> int | None:
+        return await self.lookup(find_topic_id, self.bot_id, user_id)
+
+    async def find_user_id(self, topic_id: int) -> int | None:
+        return await self.lookup(find_user_id, self.bot_id, topic_id)
+
+    async def lookup(self, query: Callable[..., Awaitable[T | None]], *args: Any) -> T | None:
+        session = self.get_replica_session()
+        if session is not None:
+            replica_lookups_counter.inc()
+            try:
+                result = await query(session, *args)
+            except CONNECTION_ERRORS:
+                self.replicas.eject(self.replica, "query failed")
+                await self.close()
+            else:
+                if result is not None:
+                    return result
+                replica_misses_counter.inc()
+        return await query(self.primary, *args)
+
+    def get_replica_session(self) -> AsyncSession | None:
+        if self.session is None and self.replicas is not None:
+            self.replica = self.replicas.pick()
+            if self.replica is not None:
+                self.session = self.replica.session_pool()
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            session, self.session = self.session, None
+            try:
+                await session.close()
+            except CONNECTION_ERRORS:
+                pass
@@ -0,0 +1,177 @@
+import asyncio
+from dataclasses import dataclass
+from functools import partial
+from time import monotonic, perf_counter
+from typing import Any
+
+import structlog
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import SlowQueriesConfig
+from bot.db.backends import get_backend
+from bot.metrics import registry
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+slow_queries_counter = registry.counter(
+    "db_slow_queries_total",
+    "Statements executed longer than slow query threshold",
+)
+
+# Slow queries waiting for their plan, above this number they are logged without it
+EXPLAIN_QUEUE_SIZE = 100
+
+
+@dataclass(slots=True)
+class StatementStats:
+    calls: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+
+@dataclass(slots=True)
+class SlowQuery:
+    engine: AsyncEngine
+    statement: str
+    parameters: Any
+    duration: float
+
+
+class SlowQueryRecorder:
+    """
+    Times every statement executed on instrumented engines: lookups, inserts of pairs and topics,
+    stats upserts. Statements slower than threshold are logged with their parameters and plan,
+    and a summary of statements with the highest total time is logged periodically, so that
+    e.g. a missing index shows up even when each single lookup is still fast.
+    """
+
+    def __init__(self, slow_queries_config: SlowQueriesConfig):
+        self.config = slow_queries_config
+        self.statements: dict[str, StatementStats] = dict()
+        self.explained_at: dict[str, float] = dict()
+        self.explain_queue: asyncio.Queue[SlowQuery] = asyncio.Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+        self.tasks: list[asyncio.Task] = list()
+
+    def instrument_engine(self, engine: AsyncEngine):
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", partial(self.after_cursor_execute, engine))
+
+    @staticmethod
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        context._query_started = perf_counter()
+
+    def after_cursor_execute(self, engine, connection, cursor, statement, parameters, context, executemany):
+        duration = perf_counter() - context._query_started
+        # Plans requested by recorder itself are not counted
+        if context.execution_options.get("slow_query_explain"):
+            return
+
+        stats = self.statements.get(statement)
+        if stats is None and len(self.statements) < self.config.max_statements:
+            stats = self.statements[statement] = StatementStats()
+        if stats is not None:
+            stats.calls += 1
+            stats.total += duration
+            stats.max = max(stats.max, duration)
+
+        if duration < self.config.threshold:
+            return
+        slow_queries_counter.inc()
+        if executemany:
+            # Batch inserts are not explained, and their parameters are too long for logs
+            logger.warning("Slow query", statement=statement, rows=len(parameters), duration=round(duration, 4))
+            return
+        if self.should_explain(statement):
+            try:
+                self.explain_queue.put_nowait(SlowQuery(engine, statement, parameters, duration))
+                return
+            except asyncio.QueueFull:
+                pass
+        logger.warning("Slow query", statement=statement, parameters=parameters, duration=round(duration, 4))
+
+    def should_explain(self, statement: str) -> bool:
+        if not self.config.explain:
+            return False
+        now = monotonic()
+        if now < self.explained_at.get(statement, 0) + self.config.explain_interval:
+            return False
+        if len(self.explained_at) >= self.config.max_statements:
+            self.explained_at.clear()
+        self.explained_at[statement] = now
+        return True
+
+    async def start(self):
+        self.tasks.append(asyncio.create_task(self.log_summaries()))
+        if self.config.explain:
+            self.tasks.append(asyncio.create_task(self.explain_slow_queries()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+
+    async def explain_slow_queries(self):
+        while True:
+            query = await self.explain_queue.get()
+            plan = await self.explain(query)
+            await logger.awarning(
+                "Slow query",
+                statement=query.statement,
+                parameters=query.parameters,
+                duration=round(query.duration, 4),
+                plan=plan,
+            )
+
+    async def explain(self, query: SlowQuery) -> str:
+        error = None
+        prefixes = get_backend(query.engine.dialect.name).explain_prefixes
+        if not query.statement.lstrip().upper().startswith("SELECT"):
+            # Writes (e.g. stats upserts) are only planned, so that explaining them doesn't take row locks
+            prefixes = prefixes[-1:]
+        for prefix in prefixes:
+            try:
+                # Transaction is never committed, so nothing executed by EXPLAIN ANALYZE is kept
+                async with query.engine.connect() as connection:
+                    result = await connection.exec_driver_sql(
+                        prefix + query.statement,
+                        query.parameters,
+                        execution_options={"slow_query_explain": True},
+                    )
+                    rows = result.all()
+            except DBAPIError as ex:
+                error = ex.orig
+                continue
+            # Plan is in the last column: the only one in PostgreSQL, "detail" in SQLite.
+            # SQLite has no plan for simple inserts
+            return "\n".join(str(row[-1]) for row in rows) or "no plan"
+        return f"EXPLAIN failed: {error!r}"
+
+    async def log_summaries(self):
+        while True:
+            await asyncio.sleep(self.config.summary_interval)
+            await self.log_summary()
+
+    async def log_summary(self):
+        statements, self.statements = self.statements, dict()
+        top = sorted(statements.items(), key=lambda item: item[1].total, reverse=True)[:self.config.summary_size]
+        if not top:
+            return
+        await logger.ainfo(
+            "Statements with the highest total time",
+            interval=self.config.summary_interval,
+            statements=[
+                {
+                    "statement": statement,
+                    "calls": stats.calls,
+                    "total": round(stats.total, 4),
+                    "mean": round(stats.total / stats.calls, 6),
+                    "max": round(stats.max, 4),
+                }
+                for statement, stats in top
+            ],
+        )
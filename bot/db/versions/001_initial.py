@@ -17,14 +17,21 @@ depends_on = None
 
 
 def upgrade() -> None:
+    # Released for PostgreSQL only, where it stays exactly as it was.
+    # Other databases (SQLite) get portable equivalents of UUID type and now()
+    if op.get_bind().dialect.name == "postgresql":
+        uuid_type, now = sa.UUID, sa.text('now()')
+    else:
+        uuid_type, now = sa.Uuid, sa.func.now()
+
     # ### commands auto generated by Alembic - please adjust! ###
     op.create_table('messages',
-    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('id', uuid_type(), nullable=False),
     sa.Column('from_chat_id', sa.BIGINT(), nullable=False),
     sa.Column('from_message_id', sa.BIGINT(), nullable=False),
     sa.Column('to_chat_id', sa.BIGINT(), nullable=False),
     sa.Column('to_message_id', sa.BIGINT(), nullable=False),
-    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=now, nullable=False),
     sa.PrimaryKeyConstraint('id'),
     sa.UniqueConstraint(
             'from_chat_id', 'from_message_id',
@@ -33,10 +40,10 @@ def upgrade() -> None:
         )
     )
     op.create_table('topics',
-    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('id', uuid_type(), nullable=False),
     sa.Column('user_id', sa.BIGINT(), nullable=False),
     sa.Column('topic_id', sa.INTEGER(), nullable=False),
-    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=now, nullable=False),
     sa.PrimaryKeyConstraint('id'),
     sa.UniqueConstraint('user_id', 'topic_id', name='unique_topics_pairs')
     )
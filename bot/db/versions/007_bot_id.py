@@ -0,0 +1,99 @@
+"""Added bot id to messages, topics and broadcasts, so that several bots can share one database
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-19 05:00:00.000000
+
+"""
+from aiogram.utils.token import extract_bot_id
+from alembic import op
+import sqlalchemy as sa
+
+from bot.config_reader import BotConfig, get_config
+
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+tables = ('messages', 'topics', 'broadcasts')
+
+
+def get_existing_bot_id() -> int | None:
+    # Rows saved before this revision belong to the bot from [bot] section
+    try:
+        bot_config: BotConfig = get_config(model=BotConfig, root_key="bot")
+    except ValueError:
+        return None
+    return extract_bot_id(bot_config.token.get_secret_value())
+
+
+def upgrade() -> None:
+    # Checked before any changes, because SQLite doesn't roll back schema changes of a failed migration
+    bot_id = get_existing_bot_id()
+    if bot_id is None:
+        connection = op.get_bind()
+        for table in tables:
+            if connection.execute(sa.text(f"SELECT 1 FROM {table} LIMIT 1")).first() is not None:
+                error = f"Table {table} has rows, but there is no [bot] section to take their bot id from"
+                raise ValueError(error)
+
+    for table in tables:
+        op.add_column(table, sa.Column('bot_id', sa.BIGINT(), nullable=True))
+        if bot_id is not None:
+            op.execute(sa.text(f"UPDATE {table} SET bot_id = :bot_id").bindparams(bot_id=bot_id))
+
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.alter_column('bot_id', existing_type=sa.BIGINT(), nullable=False)
+        batch_op.drop_constraint('unique_messages_ids_combinations', type_='unique')
+        batch_op.create_unique_constraint(
+            'unique_messages_ids_combinations',
+            ['bot_id', 'from_chat_id', 'from_message_id', 'to_chat_id', 'to_message_id'],
+        )
+        batch_op.drop_index('ix_messages_to_chat_id_to_message_id')
+        batch_op.create_index(
+            'ix_messages_bot_id_to_chat_id_to_message_id', ['bot_id', 'to_chat_id', 'to_message_id'], unique=False,
+        )
+        batch_op.drop_index('ix_messages_created_at')
+        batch_op.create_index('ix_messages_bot_id_created_at', ['bot_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('topics') as batch_op:
+        batch_op.alter_column('bot_id', existing_type=sa.BIGINT(), nullable=False)
+        batch_op.drop_constraint('unique_topics_pairs', type_='unique')
+        batch_op.create_unique_constraint('unique_topics_pairs', ['bot_id', 'user_id', 'topic_id'])
+        batch_op.drop_index('ix_topics_topic_id_created_at')
+        batch_op.create_index(
+            'ix_topics_bot_id_topic_id_created_at', ['bot_id', 'topic_id', 'created_at'], unique=False,
+        )
+
+    with op.batch_alter_table('broadcasts') as batch_op:
+        batch_op.alter_column('bot_id', existing_type=sa.BIGINT(), nullable=False)
+
+
+def downgrade() -> None:
+    # Only works while database has rows of a single bot, otherwise old unique constraints are violated
+    with op.batch_alter_table('broadcasts') as batch_op:
+        batch_op.drop_column('bot_id')
+
+    with op.batch_alter_table('topics') as batch_op:
+        batch_op.drop_index('ix_topics_bot_id_topic_id_created_at')
+        batch_op.create_index('ix_topics_topic_id_created_at', ['topic_id', 'created_at'], unique=False)
+        batch_op.drop_constraint('unique_topics_pairs', type_='unique')
+        batch_op.create_unique_constraint('unique_topics_pairs', ['user_id', 'topic_id'])
+        batch_op.drop_column('bot_id')
+
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_index('ix_messages_bot_id_created_at')
+        batch_op.create_index('ix_messages_created_at', ['created_at'], unique=False)
+        batch_op.drop_index('ix_messages_bot_id_to_chat_id_to_message_id')
+        batch_op.create_index(
+            'ix_messages_to_chat_id_to_message_id', ['to_chat_id', 'to_message_id'], unique=False,
+        )
+        batch_op.drop_constraint('unique_messages_ids_combinations', type_='unique')
+        batch_op.create_unique_constraint(
+            'unique_messages_ids_combinations',
+            ['from_chat_id', 'from_message_id', 'to_chat_id', 'to_message_id'],
+        )
+        batch_op.drop_column('bot_id')
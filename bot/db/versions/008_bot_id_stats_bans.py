@@ -0,0 +1,87 @@
+"""Added bot id to stats and banned users, so that bots sharing one database don't see each other's
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-19 06:00:00.000000
+
+"""
+import warnings
+
+from aiogram.utils.token import extract_bot_id
+from alembic import op
+import sqlalchemy as sa
+
+from bot.config_reader import BotConfig, get_config
+
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+# Table and its primary key without bot id
+primary_keys = {
+    'user_stats': ['user_id'],
+    'daily_stats': ['day'],
+    'hourly_stats': ['hour'],
+    'banned_users': ['user_id'],
+}
+
+
+def get_existing_bot_id() -> int | None:
+    # Rows saved before this revision belong to the bot from [bot] section
+    try:
+        bot_config: BotConfig = get_config(model=BotConfig, root_key="bot")
+    except ValueError:
+        return None
+    return extract_bot_id(bot_config.token.get_secret_value())
+
+
+def replace_primary_key(table: str, columns: list[str]):
+    # Primary keys were created without explicit names, PostgreSQL names them "<table>_pkey".
+    # SQLite table is recreated, and its unnamed key is replaced by the new one. Columns of the copy
+    # still have primary key flags of the old key, which SQLAlchemy warns about and then overrides
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message=".*as primary_key=True, not matching locally specified columns")
+        with op.batch_alter_table(table) as batch_op:
+            if op.get_bind().dialect.name == "postgresql":
+                batch_op.drop_constraint(f'{table}_pkey', type_='primary')
+            batch_op.create_primary_key(f'{table}_pkey', columns)
+
+
+def upgrade() -> None:
+    # Checked before any changes, because SQLite doesn't roll back schema changes of a failed migration
+    bot_id = get_existing_bot_id()
+    if bot_id is None:
+        connection = op.get_bind()
+        for table in primary_keys:
+            if connection.execute(sa.text(f"SELECT 1 FROM {table} LIMIT 1")).first() is not None:
+                error = f"Table {table} has rows, but there is no [bot] section to take their bot id from"
+                raise ValueError(error)
+
+    for table in primary_keys:
+        op.add_column(table, sa.Column('bot_id', sa.BIGINT(), nullable=True))
+        if bot_id is not None:
+            op.execute(sa.text(f"UPDATE {table} SET bot_id = :bot_id").bindparams(bot_id=bot_id))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('bot_id', existing_type=sa.BIGINT(), nullable=False)
+        replace_primary_key(table, ['bot_id', *primary_keys[table]])
+
+    with op.batch_alter_table('user_stats') as batch_op:
+        batch_op.drop_index('ix_user_stats_messages_from_user')
+        batch_op.create_index(
+            'ix_user_stats_bot_id_messages_from_user', ['bot_id', 'messages_from_user'], unique=False,
+        )
+
+
+def downgrade() -> None:
+    # Only works while database has rows of a single bot, otherwise old primary keys are violated
+    with op.batch_alter_table('user_stats') as batch_op:
+        batch_op.drop_index('ix_user_stats_bot_id_messages_from_user')
+        batch_op.create_index('ix_user_stats_messages_from_user', ['messages_from_user'], unique=False)
+
+    for table, columns in primary_keys.items():
+        replace_primary_key(table, columns)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('bot_id')
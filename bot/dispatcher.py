@@ -0,0 +1,307 @@
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from cachetools import TTLCache
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from bot.config_reader import (
+    get_config, get_optional_config,
+    BotConfig, DbConfig, CacheConfig, ContentConfig, BroadcastConfig, StatsConfig, ProfilerConfig,
+    EventLoopConfig, SlowQueriesConfig, TracingConfig, WarmUpConfig, BanListConfig, FloodConfig, TenantConfig,
+    PairFileConfig, RelayBatchConfig,
+)
+from bot.ban_list import BanList, RedisBanListSync
+from bot.broadcaster import Broadcaster
+from bot.db.backends import create_engine
+from bot.db.queries import StoredPair
+from bot.db.replicas import ReplicaPool
+from bot.db.slow_queries import SlowQueryRecorder
+from bot.event_loop import LoopLagMonitor
+from bot.flood_control import LoadShedder
+from bot.fluent_loader import get_fluent_localization
+from bot.handlers import get_routers
+from bot.media_resender import MediaResender
+from bot.middlewares import BanListMiddleware, DbSessionMiddleware
+from bot.pair_file import PairFile
+from bot.profiler import Profiler, ProfilerMiddleware
+from bot.recent_pairs import RecentPairsIndex
+from bot.relay_batcher import RelayBatcher
+from bot.stats import StatsAggregator
+from bot.topics_index import TopicsIndex
+from bot.tracing import (
+    TracedAsyncSession, TraceExporter, Tracer, TracingMiddleware, TracingRequestMiddleware, instrument_router,
+)
+from bot.warm_up import RoutingWarmUp
+
+
+@dataclass
+class SharedResources:
+    """
+    Everything which doesn't depend on a bot: database engines and sessions, tracing, profiling,
+    ban list sync and pair file. A single bot creates them for its own dispatcher, while in multi-tenant
+    mode dispatchers of all bots share them, so that one connection pool serves all of them.
+    """
+
+    engine: AsyncEngine
+    session_pool: async_sessionmaker
+    replicas: ReplicaPool | None
+    tracer: Tracer | None
+    profiler: Profiler
+    ban_list_sync: RedisBanListSync | None
+    pair_file: PairFile | None
+    # Receives pairs saved by this process, to be written to pair file
+    on_pairs_created: Callable[[int, list[StoredPair]], None] | None
+    # Called in order before the first update is handled and after the last one
+    startup: list[Callable[[], Awaitable]]
+    shutdown: list[Callable[[], Awaitable]]
+
+    async def start(self):
+        for callback in self.startup:
+            await callback()
+
+    async def stop(self):
+        for callback in self.shutdown:
+            await callback()
+
+
+async def create_shared_resources(
+        http_session: BaseSession,
+        on_pairs_created: Callable[[int, list[StoredPair]], None] | None = None,
+) -> SharedResources:
+    startup: list[Callable[[], Awaitable]] = list()
+    shutdown: list[Callable[[], Awaitable]] = list()
+
+    db_config: DbConfig = get_config(model=DbConfig, root_key="db")
+    tracing_config: TracingConfig = get_optional_config(model=TracingConfig, root_key="tracing")
+    tracer = None
+    if tracing_config.enabled:
+        exporter = TraceExporter(tracing_config)
+        tracer = Tracer(tracing_config, exporter)
+        startup.append(exporter.start)
+        shutdown.append(exporter.stop)
+        http_session.middleware(TracingRequestMiddleware())
+
+    engine = create_engine(db_config)
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT 1"))
+    engines = [engine]
+
+    replicas = None
+    if db_config.replica_dsns:
+        # Unavailable replicas don't prevent start, they are just left out until they recover
+        replicas = ReplicaPool(db_config, [
+            create_engine(db_config, dsn)
+            for dsn in db_config.replica_dsns
+        ])
+        engines.extend(replica.engine for replica in replicas.replicas)
+        startup.append(replicas.start)
+        shutdown.append(replicas.stop)
+
+    slow_queries_config: SlowQueriesConfig = get_optional_config(model=SlowQueriesConfig, root_key="slow_queries")
+    if slow_queries_config.enabled:
+        slow_query_recorder = SlowQueryRecorder(slow_queries_config)
+        for instrumented_engine in engines:
+            slow_query_recorder.instrument_engine(instrumented_engine)
+        startup.append(slow_query_recorder.start)
+        shutdown.append(slow_query_recorder.stop)
+
+    loop_config: EventLoopConfig = get_optional_config(model=EventLoopConfig, root_key="event_loop")
+    loop_monitor = LoopLagMonitor(loop_config)
+    startup.append(loop_monitor.start)
+    shutdown.append(loop_monitor.stop)
+
+    if tracer is not None:
+        for instrumented_engine in engines:
+            tracer.instrument_engine(instrumented_engine)
+
+    profiler_config: ProfilerConfig = get_optional_config(model=ProfilerConfig, root_key="profiler")
+    profiler = Profiler(profiler_config)
+    startup.append(profiler.install_signal_handler)
+    shutdown.append(profiler.stop)
+
+    # One Redis connection for ban lists of all bots
+    ban_list_config: BanListConfig = get_optional_config(model=BanListConfig, root_key="ban_list")
+    ban_list_sync = None
+    if ban_list_config.redis_url is not None:
+        ban_list_sync = RedisBanListSync(ban_list_config.redis_url, ban_list_config.channel)
+        startup.append(ban_list_sync.start)
+        shutdown.append(ban_list_sync.stop)
+
+    Sessionmaker = async_sessionmaker(
+        engine,
+        expire_on_commit=False,
+        class_=AsyncSession if tracer is None else TracedAsyncSession,
+    )
+
+    pair_file_config: PairFileConfig = get_optional_config(model=PairFileConfig, root_key="pair_file")
+    pair_file = None
+    if not pair_file_config.enabled:
+        on_pairs_created = None
+    elif on_pairs_created is None:
+        # The only process of this host which saves pairs, so it writes them itself
+        pair_file = PairFile.create(pair_file_config.path, pair_file_config.capacity)
+        on_pairs_created = pair_file.add_many
+        shutdown.append(pair_file.stop)
+    else:
+        # Worker process, pairs are written by supervisor, which has already created the file
+        pair_file = PairFile.open_readonly(pair_file_config.path)
+        shutdown.append(pair_file.stop)
+
+    return SharedResources(
+        engine=engine,
+        session_pool=Sessionmaker,
+        replicas=replicas,
+        tracer=tracer,
+        profiler=profiler,
+        ban_list_sync=ban_list_sync,
+        pair_file=pair_file,
+        on_pairs_created=on_pairs_created,
+        startup=startup,
+        shutdown=shutdown,
+    )
+
+
+async def create_dispatcher(
+        bot: Bot,
+        is_primary: bool = True,
+        on_topic_created: Callable[[int], None] | None = None,
+        on_pairs_created: Callable[[int, list[StoredPair]], None] | None = None,
+        tenant: TenantConfig | None = None,
+        resources: SharedResources | None = None,
+) -> Dispatcher:
+    """
+    Creates dispatcher of a bot with its own routers and caches. Database engine and other shared
+    objects are created too, unless they are passed in, as in multi-tenant mode.
+    In multi-process mode every worker has its own dispatcher, and only the primary one
+    resumes unfinished broadcasts.
+    """
+    if tenant is None:
+        bot_config: BotConfig = get_config(model=BotConfig, root_key="bot")
+        supergroup_id = bot_config.supergroup_id
+        l10n = get_fluent_localization()
+    else:
+        supergroup_id = tenant.supergroup_id
+        l10n = get_fluent_localization(tenant.locale)
+    cache_config: CacheConfig = get_optional_config(model=CacheConfig, root_key="cache")
+
+    dp = Dispatcher(
+        l10n=l10n,
+        # File ids are different for every bot, so these caches can't be shared
+        media_resender=MediaResender(cache_size=cache_config.file_ids_size),
+    )
+
+    owns_resources = resources is None
+    if owns_resources:
+        resources = await create_shared_resources(bot.session, on_pairs_created=on_pairs_created)
+        dp.startup.register(resources.start)
+
+    if resources.tracer is not None:
+        # Goes first, so that spans of all other middlewares are inside root span of update
+        dp.update.outer_middleware(TracingMiddleware(resources.tracer))
+
+    # Goes first after tracing, so that the whole handling of update is measured
+    dp["profiler"] = resources.profiler
+    dp.update.outer_middleware(ProfilerMiddleware(resources.profiler))
+
+    # Goes before session middleware, so that updates of banned users don't cost any queries.
+    # Bans are made by operators of one bot and only apply to it
+    ban_list_config: BanListConfig = get_optional_config(model=BanListConfig, root_key="ban_list")
+    ban_list = BanList(session_pool=resources.session_pool, ban_list_config=ban_list_config, bot_id=bot.id)
+    dp["ban_list"] = ban_list
+    dp.startup.register(ban_list.load)
+    ban_list_sync = resources.ban_list_sync
+    if ban_list_sync is not None:
+        # Not a partial, since startup callbacks get workflow data by argument names, and ban_list is one of them
+        async def add_to_ban_list_sync():
+            await ban_list_sync.add(ban_list)
+
+        dp.startup.register(add_to_ban_list_sync)
+    dp.update.outer_middleware(BanListMiddleware(ban_list))
+
+    dp.update.outer_middleware(DbSessionMiddleware(resources.session_pool, replicas=resources.replicas))
+
+    broadcast_config: BroadcastConfig = get_optional_config(model=BroadcastConfig, root_key="broadcast")
+    broadcaster = Broadcaster(
+        bot=bot,
+        session_pool=resources.session_pool,
+        forum_chat_id=supergroup_id,
+        l10n=l10n,
+        broadcast_config=broadcast_config,
+    )
+    dp["broadcaster"] = broadcaster
+    if is_primary:
+        dp.startup.register(broadcaster.resume_unfinished)
+    dp.shutdown.register(broadcaster.stop)
+
+    stats_config: StatsConfig = get_optional_config(model=StatsConfig, root_key="stats")
+    dp["stats_config"] = stats_config
+    stats = StatsAggregator(session_pool=resources.session_pool, stats_config=stats_config, bot_id=bot.id)
+    dp.startup.register(stats.start)
+    dp.shutdown.register(stats.stop)
+
+    # Topics without users (e.g. created manually by operators). Shared between middlewares,
+    # so that newly created topic is immediately removed from here.
+    unroutable_topics = TTLCache(
+        maxsize=cache_config.unroutable_topics_size,
+        ttl=cache_config.unroutable_topics_ttl,
+    )
+    dp["unroutable_topics"] = unroutable_topics
+
+    flood_config: FloodConfig = get_optional_config(model=FloodConfig, root_key="flood")
+    load_shedder = LoadShedder(
+        flood_config=flood_config,
+        dispatcher=dp,
+        pool=resources.engine.pool,
+        http_session=bot.session,
+    )
+    dp["load_shedder"] = load_shedder
+    dp.shutdown.register(load_shedder.stop)
+
+    relay_batch_config: RelayBatchConfig = get_optional_config(model=RelayBatchConfig, root_key="relay_batch")
+    if relay_batch_config.enabled:
+        dp["relay_batcher"] = RelayBatcher(relay_batch_config)
+
+    # Shared by routing middlewares, and filled on startup when warm-up is enabled
+    pairs_index = RecentPairsIndex(
+        maxsize=cache_config.recent_pairs_size,
+        ttl=cache_config.recent_pairs_window,
+    )
+    topics_index = TopicsIndex(maxsize=cache_config.topics_size)
+    warm_up_config: WarmUpConfig = get_optional_config(model=WarmUpConfig, root_key="warm_up")
+    if warm_up_config.enabled:
+        warm_up = RoutingWarmUp(
+            session_pool=resources.session_pool,
+            warm_up_config=warm_up_config,
+            bot_id=bot.id,
+            pairs_index=pairs_index,
+            topics_index=topics_index,
+        )
+        dp["warm_up"] = warm_up
+        dp.startup.register(warm_up.start)
+        dp.shutdown.register(warm_up.stop)
+
+    content_config: ContentConfig = get_optional_config(model=ContentConfig, root_key="content")
+    dp.include_routers(*get_routers(
+        supergroup_id=supergroup_id,
+        cache_config=cache_config,
+        content_config=content_config,
+        stats=stats,
+        unroutable_topics=unroutable_topics,
+        on_topic_created=on_topic_created,
+        flood_config=flood_config,
+        load_shedder=load_shedder,
+        pairs_index=pairs_index,
+        topics_index=topics_index,
+        pair_file=resources.pair_file,
+        on_pairs_created=resources.on_pairs_created,
+    ))
+    if resources.tracer is not None:
+        # Wraps middlewares of all routers, so it must go after all of them are registered
+        instrument_router(dp)
+    if owns_resources:
+        # Goes last, so that database is still available while dispatcher's own objects are stopped
+        dp.shutdown.register(resources.stop)
+    return dp
@@ -0,0 +1,94 @@
+import asyncio
+from collections import deque
+from statistics import quantiles
+from time import monotonic, perf_counter
+from typing import Any, Callable, Coroutine
+
+import structlog
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import EventLoopConfig
+from bot.metrics import registry
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+lag_summary = registry.summary(
+    "event_loop_lag_seconds",
+    "How late event loop wakes up a sleeping task, over recent measurements",
+)
+
+REPORTED_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def get_loop_factory(loop_config: EventLoopConfig) -> Callable[[], asyncio.AbstractEventLoop] | None:
+    if not loop_config.use_uvloop:
+        return None
+    try:
+        import uvloop
+    except ImportError:
+        logger.warning("uvloop is not installed, using default event loop")
+        return None
+    return uvloop.new_event_loop
+
+
+def run(coroutine: Coroutine[Any, Any, Any], loop_config: EventLoopConfig):
+    # Same as asyncio.run(), but with event loop chosen in config
+    with asyncio.Runner(loop_factory=get_loop_factory(loop_config)) as runner:
+        return runner.run(coroutine)
+
+
+async def measure_loop_lag(interval: float, on_sample: Callable[[float], None]):
+    # Sleeps for fixed interval and reports how much later than expected it woke up
+    while True:
+        started = perf_counter()
+        await asyncio.sleep(interval)
+        on_sample(max(perf_counter() - started - interval, 0.0))
+
+
+class LoopLagMonitor:
+    """
+    Continuously measures event loop lag, which shows how long ready tasks
+    wait for their turn because of blocking code or too much work in one loop.
+    Percentiles over recent measurements are periodically logged and exported as metric.
+    """
+
+    def __init__(self, loop_config: EventLoopConfig):
+        self.config = loop_config
+        self.lags: deque[float] = deque(maxlen=loop_config.lag_window)
+        self.last_report = monotonic()
+        self.task: asyncio.Task | None = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await logger.ainfo("Using event loop", loop=f"{type(loop).__module__}.{type(loop).__name__}")
+        self.task = asyncio.create_task(measure_loop_lag(self.config.lag_interval, self.observe))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    def observe(self, lag: float):
+        self.lags.append(lag)
+        lag_summary.observe(lag)
+        now = monotonic()
+        if now - self.last_report >= self.config.report_interval:
+            self.last_report = now
+            self.report()
+
+    def percentiles(self) -> dict[float, float]:
+        if len(self.lags) < 2:
+            return dict()
+        cut_points = quantiles(self.lags, n=100)
+        return {quantile: cut_points[round(quantile * 100) - 1] for quantile in REPORTED_QUANTILES}
+
+    def report(self):
+        percentiles = self.percentiles()
+        if not percentiles:
+            return
+        lag_summary.set_quantiles(percentiles)
+        details = {f"p{round(quantile * 100)}_ms": round(value * 1000, 2) for quantile, value in percentiles.items()}
+        if percentiles[0.99] > self.config.lag_warning_threshold:
+            logger.warning("Event loop lag is high", **details)
+        else:
+            logger.info("Event loop lag", **details)
@@ -1,7 +0,0 @@
-from .allowed_types import ForwardableTypesFilter
-from .service_messages import ServiceMessagesFilter
-
-__all__ = [
-    "ForwardableTypesFilter",
-    "ServiceMessagesFilter",
-]
\ No newline at end of file
@@ -0,0 +1,136 @@
+import asyncio
+from time import monotonic
+from typing import Awaitable, Callable, Coroutine, Hashable
+
+import structlog
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from sqlalchemy.pool import Pool, QueuePool
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import FloodConfig
+from bot.http_session import TunedAiohttpSession
+from bot.metrics import registry
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+deferred_edits_counter = registry.counter(
+    "deferred_edits_total",
+    "Edits of user messages postponed because of high load",
+)
+deferred_intros_counter = registry.counter(
+    "deferred_user_info_messages_total",
+    "User info messages in new topics postponed because of high load",
+)
+shed_counter = registry.counter(
+    "shed_deferred_work_total",
+    "Postponed edits and user info messages dropped because too much work was waiting",
+)
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at", "notified_at")
+
+    def __init__(self, burst: int):
+        self.tokens = float(burst)
+        self.updated_at = monotonic()
+        self.notified_at: float | None = None
+
+    def take(self, rate: float, burst: int) -> bool:
+        now = monotonic()
+        self.tokens = min(self.tokens + (now - self.updated_at) * rate, burst)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class LoadShedder:
+    """
+    Detects when the bot is saturated (database pool or Bot API connections are nearly all in use)
+    and postpones low-priority work until load goes down: edits are fed to dispatcher again later,
+    user info messages of new topics are sent later. New messages are never postponed.
+    """
+
+    def __init__(
+            self,
+            flood_config: FloodConfig,
+            dispatcher: Dispatcher,
+            pool: Pool,
+            http_session: TunedAiohttpSession,
+    ):
+        self.config = flood_config
+        self.dispatcher = dispatcher
+        self.pool = pool
+        self.http_session = http_session
+        # Pools without fixed size (e.g. NullPool) are never considered saturated
+        self.db_capacity: int | None = None
+        if isinstance(pool, QueuePool):
+            self.db_capacity = pool.size() + max(pool._max_overflow, 0)
+        self.tasks: set[asyncio.Task] = set()
+        # Only the latest edit of every message is kept, so that an older edit never overwrites a newer one
+        self.pending_edits: dict[Hashable, Update] = dict()
+
+    def is_overloaded(self) -> bool:
+        threshold = self.config.shedding_threshold
+        if self.db_capacity is not None and self.pool.checkedout() >= self.db_capacity * threshold:
+            return True
+        # Connections held by long polling are not available for other requests
+        capacity = self.http_session.connection_limit - self.http_session.polling
+        if capacity <= 0:
+            # Misconfigured limit, which would keep deferred work waiting forever
+            return False
+        return self.http_session.in_flight >= capacity * threshold
+
+    def has_pending_edit(self, key: Hashable) -> bool:
+        return key in self.pending_edits
+
+    def defer_edit(self, bot: Bot, key: Hashable, update: Update):
+        if key in self.pending_edits:
+            self.pending_edits[key] = update
+            return
+        if self.schedule(self.refeed_edit(bot, key)):
+            self.pending_edits[key] = update
+            deferred_edits_counter.inc()
+
+    def defer(self, work: Callable[[], Awaitable]):
+        if self.schedule(self.run_deferred(work)):
+            deferred_intros_counter.inc()
+
+    def schedule(self, coroutine: Coroutine) -> bool:
+        if len(self.tasks) >= self.config.max_deferred:
+            coroutine.close()
+            shed_counter.inc()
+            return False
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
+
+    async def wait_for_capacity(self):
+        while self.is_overloaded():
+            await asyncio.sleep(self.config.defer_interval)
+
+    async def refeed_edit(self, bot: Bot, key: Hashable):
+        await self.wait_for_capacity()
+        update = self.pending_edits.pop(key)
+        try:
+            # Rate limit was already applied to this edit
+            await self.dispatcher.feed_update(bot, update, deferred=True)
+        except Exception:
+            await logger.aexception("Failed to handle deferred edit", update_id=update.update_id)
+
+    async def run_deferred(self, work: Callable[[], Awaitable]):
+        await self.wait_for_capacity()
+        try:
+            await work()
+        except Exception:
+            await logger.aexception("Failed to run deferred work")
+
+    async def stop(self):
+        if self.tasks:
+            await logger.awarning("Dropping deferred work on shutdown", count=len(self.tasks))
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
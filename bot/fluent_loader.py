@@ -1,9 +1,12 @@
+from functools import lru_cache
 from pathlib import Path
 
 from fluent.runtime import FluentLocalization, FluentResourceLoader
 
 
-def get_fluent_localization() -> FluentLocalization:
+@lru_cache
+def get_fluent_localization(locale: str = "current") -> FluentLocalization:
+    # Bots with the same locale share one instance with already parsed strings
     locale_dir = Path(__file__).parent.joinpath("locale", "{locale}")
     loader = FluentResourceLoader(str(locale_dir.absolute()))
-    return FluentLocalization(["current"], ["strings.ftl"], loader)
+    return FluentLocalization([locale], ["strings.ftl"], loader)
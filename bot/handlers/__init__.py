@@ -1,36 +1,101 @@
+from typing import Callable
+
 from aiogram import F, Router
 from aiogram.enums import ChatType
+from cachetools import TTLCache
 
 from . import (
     pm_commands, pm_talk,
     group_commands, group_talk
 )
 
-from bot.middlewares import TopicFinderUserToGroup, GroupToUserMiddleware, FindPairToEditMiddleware
+from bot.config_reader import CacheConfig, ContentConfig, FloodConfig
+from bot.content_routing import ContentRouter
+from bot.db.queries import StoredPair
+from bot.flood_control import LoadShedder
+from bot.middlewares import (
+    TopicFinderUserToGroup, GroupToUserMiddleware, FindPairToEditMiddleware, FloodControlMiddleware,
+)
+from bot.pair_file import PairFile
+from bot.recent_pairs import RecentPairsIndex
+from bot.stats import StatsAggregator
+from bot.topics_index import TopicsIndex
 
 
 def get_routers(
         supergroup_id: int,
+        cache_config: CacheConfig,
+        content_config: ContentConfig,
+        stats: StatsAggregator,
+        unroutable_topics: TTLCache,
+        on_topic_created: Callable[[int], None] | None = None,
+        flood_config: FloodConfig | None = None,
+        load_shedder: LoadShedder | None = None,
+        pairs_index: RecentPairsIndex | None = None,
+        topics_index: TopicsIndex | None = None,
+        pair_file: PairFile | None = None,
+        on_pairs_created: Callable[[int, list[StoredPair]], None] | None = None,
 ) -> list[Router]:
+    # Routers are created anew on every call, so that one process can serve several bots,
+    # each with its own dispatcher, forum chat and caches.
+
+    # Every message is classified once, before handlers' filters, and the result is passed to handlers
+    content_router = ContentRouter(content_config)
+
+    # Recently created message pairs, used for both new messages and edits in both directions.
+    # Passed from outside when they are filled on startup
+    if pairs_index is None:
+        pairs_index = RecentPairsIndex(
+            maxsize=cache_config.recent_pairs_size,
+            ttl=cache_config.recent_pairs_window,
+        )
+    if topics_index is None:
+        topics_index = TopicsIndex(maxsize=cache_config.topics_size)
+
     pm_router = Router()
     pm_router.message.filter(F.chat.type == ChatType.PRIVATE)
     pm_router.edited_message.filter(F.chat.type == ChatType.PRIVATE)
+    pm_talk_router = pm_talk.create_router()
     pm_router.include_routers(
-        pm_commands.router,
-        pm_talk.router
+        pm_commands.create_router(),
+        pm_talk_router
     )
-    pm_talk.router.message.middleware(TopicFinderUserToGroup(forum_chat_id=supergroup_id))
-    pm_talk.router.edited_message.middleware(FindPairToEditMiddleware())
+    pm_talk_router.message.filter(content_router)
+    # Goes before other middlewares, so that dropped and postponed updates don't cost any queries
+    if load_shedder is not None:
+        flood_control = FloodControlMiddleware(flood_config=flood_config or FloodConfig(), load_shedder=load_shedder)
+        pm_talk_router.message.middleware(flood_control)
+        pm_talk_router.edited_message.middleware(flood_control)
+    pm_talk_router.message.middleware(TopicFinderUserToGroup(
+        forum_chat_id=supergroup_id,
+        unroutable_topics=unroutable_topics,
+        pairs_index=pairs_index,
+        topics_index=topics_index,
+        stats=stats,
+        on_topic_created=on_topic_created,
+        pair_file=pair_file,
+        on_pairs_created=on_pairs_created,
+    ))
+    pm_talk_router.edited_message.middleware(FindPairToEditMiddleware(pairs_index=pairs_index, pair_file=pair_file))
 
     group_router = Router()
     group_router.message.filter(F.chat.id == supergroup_id)
     group_router.edited_message.filter(F.chat.id == supergroup_id)
+    group_talk_router = group_talk.create_router()
     group_router.include_routers(
-        group_commands.router,
-        group_talk.router
+        group_commands.create_router(),
+        group_talk_router
     )
-    group_talk.router.message.middleware(GroupToUserMiddleware())
-    group_talk.router.edited_message.middleware(FindPairToEditMiddleware())
+    group_talk_router.message.filter(content_router)
+    group_talk_router.message.middleware(GroupToUserMiddleware(
+        unroutable_topics=unroutable_topics,
+        pairs_index=pairs_index,
+        topics_index=topics_index,
+        stats=stats,
+        pair_file=pair_file,
+        on_pairs_created=on_pairs_created,
+    ))
+    group_talk_router.edited_message.middleware(FindPairToEditMiddleware(pairs_index=pairs_index, pair_file=pair_file))
 
 
     return [
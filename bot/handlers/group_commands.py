@@ -1,3 +1,188 @@
-from aiogram import Router
+from aiogram import Bot, Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message
+from fluent.runtime import FluentLocalization
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-router = Router()
+from bot.ban_list import BanList
+from bot.broadcaster import Broadcaster
+from bot.config_reader import StatsConfig
+from bot.db.models import BannedUser, DailyStats, HourlyStats, UserStats
+from bot.db.queries import find_user_id
+from bot.profiler import Profiler
+
+
+
+async def cmd_broadcast(
+        message: Message,
+        l10n: FluentLocalization,
+        broadcaster: Broadcaster,
+):
+    # Broadcast is started by replying to the message which should be sent.
+    # Must be done in General topic, since in other topics messages belong to users.
+    if message.is_topic_message or message.reply_to_message is None:
+        await message.reply(l10n.format_value("broadcast-usage"))
+        return
+
+    status_message = await message.reply(l10n.format_value("broadcast-started"))
+    await broadcaster.start(
+        message_id=message.reply_to_message.message_id,
+        status_message_id=status_message.message_id,
+    )
+
+
+async def cmd_stats(
+        message: Message,
+        bot: Bot,
+        l10n: FluentLocalization,
+        session: AsyncSession,
+        stats_config: StatsConfig,
+):
+    # Everything is read from pre-aggregated tables, so this is cheap regardless of messages count
+    top_users = await session.scalars(
+        select(UserStats)
+        .where(UserStats.bot_id == bot.id)
+        .order_by(UserStats.messages_from_user.desc())
+        .limit(stats_config.top_users)
+    )
+    days = await session.scalars(
+        select(DailyStats)
+        .where(DailyStats.bot_id == bot.id)
+        .order_by(DailyStats.day.desc())
+        .limit(7)
+    )
+    hours = await session.scalars(
+        select(HourlyStats)
+        .where(HourlyStats.bot_id == bot.id)
+        .order_by(HourlyStats.hour.desc())
+        .limit(24)
+    )
+    top_users, days, hours = top_users.all(), days.all(), hours.all()
+    if not top_users:
+        await message.reply(l10n.format_value("stats-empty"))
+        return
+
+    lines = [l10n.format_value("stats-top-users")]
+    for user in top_users:
+        lines.append(l10n.format_value("stats-top-user-line", {
+            "user_id": str(user.user_id),
+            "from_user": user.messages_from_user,
+            "to_user": user.messages_to_user,
+        }))
+    lines.append("")
+    lines.append(l10n.format_value("stats-daily"))
+    for day in days:
+        lines.append(l10n.format_value("stats-daily-line", {
+            "day": day.day.isoformat(),
+            "users": day.active_users,
+            "from_users": day.messages_from_users,
+            "to_users": day.messages_to_users,
+        }))
+    lines.append("")
+    lines.append(l10n.format_value("stats-hourly"))
+    for hour in hours:
+        lines.append(l10n.format_value("stats-hourly-line", {
+            "hour": hour.hour.strftime("%Y-%m-%d %H:00"),
+            "from_users": hour.messages_from_users,
+            "to_users": hour.messages_to_users,
+        }))
+    await message.reply("\n".join(lines))
+
+
+async def cmd_profile(
+        message: Message,
+        command: CommandObject,
+        l10n: FluentLocalization,
+        profiler: Profiler,
+):
+    # Optional argument is duration in seconds, e.g. "/profile 60"
+    duration = None
+    if command.args is not None and command.args.strip().isdigit():
+        duration = int(command.args.strip())
+
+    profiling_session = profiler.start(duration=duration)
+    if profiling_session is None:
+        await message.reply(l10n.format_value("profile-already-running"))
+        return
+
+    await message.reply(l10n.format_value(
+        "profile-started",
+        {"seconds": profiling_session.duration},
+    ))
+    try:
+        path = await profiling_session.wait()
+    except Exception:
+        await message.reply(l10n.format_value("profile-failed"))
+        return
+    await message.reply(l10n.format_value(
+        "profile-finished",
+        {
+            "updates": len(profiling_session.updates),
+            "samples": profiling_session.samples,
+            "path": str(path),
+        },
+    ))
+
+
+async def cmd_ban(
+        message: Message,
+        bot: Bot,
+        l10n: FluentLocalization,
+        session: AsyncSession,
+        ban_list: BanList,
+):
+    # Sent inside user's topic, so that user is known without arguments
+    if not message.is_topic_message:
+        await message.reply(l10n.format_value("ban-usage"))
+        return
+    user_id = await find_user_id(session, bot.id, message.message_thread_id)
+    if user_id is None:
+        await message.reply(l10n.format_value("error-no-user-found-for-topic"))
+        return
+
+    if await session.get(BannedUser, (bot.id, user_id)) is None:
+        session.add(BannedUser(
+            bot_id=bot.id,
+            user_id=user_id,
+            topic_id=message.message_thread_id,
+            banned_by=message.from_user.id,
+        ))
+        await session.commit()
+    ban_list.ban(user_id)
+    await message.reply(l10n.format_value("ban-done"))
+
+
+async def cmd_unban(
+        message: Message,
+        bot: Bot,
+        l10n: FluentLocalization,
+        session: AsyncSession,
+        ban_list: BanList,
+):
+    if not message.is_topic_message:
+        await message.reply(l10n.format_value("ban-usage"))
+        return
+    user_id = await find_user_id(session, bot.id, message.message_thread_id)
+    if user_id is None:
+        await message.reply(l10n.format_value("error-no-user-found-for-topic"))
+        return
+
+    banned_user = await session.get(BannedUser, (bot.id, user_id))
+    if banned_user is None:
+        await message.reply(l10n.format_value("unban-not-banned"))
+        return
+    await session.delete(banned_user)
+    await session.commit()
+    ban_list.unban(user_id)
+    await message.reply(l10n.format_value("unban-done"))
+
+
+def create_router() -> Router:
+    router = Router()
+    router.message.register(cmd_broadcast, Command("broadcast"))
+    router.message.register(cmd_stats, Command("stats"))
+    router.message.register(cmd_profile, Command("profile"))
+    router.message.register(cmd_ban, Command("ban"))
+    router.message.register(cmd_unban, Command("unban"))
+    return router
@@ -1,29 +1,33 @@
 import structlog
 from aiogram import Bot, F, Router
-from aiogram.exceptions import TelegramAPIError
-from aiogram.types import (
-    Message, MessageId, ReplyParameters,
-    InputMediaAnimation, InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo,
-)
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.types import Message, MessageId, ReplyParameters
 from fluent.runtime import FluentLocalization
 from structlog.types import FilteringBoundLogger
 
-from bot.filters import ForwardableTypesFilter, ServiceMessagesFilter
+from bot.content_routing import ContentAction, ContentRoute, build_input_media
 from bot.handlers_feedback import MessageConnectionFeedback
+from bot.media_resender import MediaResender
 
-router = Router()
 logger: FilteringBoundLogger = structlog.get_logger()
 
 
-@router.message(ForwardableTypesFilter())
-async def any_forwardable_message(
+# Service messages are dropped by router-level filter, so only forwardable
+# and non-forwardable types get here. Check is made in handler to avoid extra filter calls.
+async def any_message(
         message: Message,
+        bot: Bot,
         l10n: FluentLocalization,
+        content: ContentRoute,
+        media_resender: MediaResender,
         user_id: int | None = None,
         error: str | None = None,
         reply_to_message_id: int | None = None,
-        caption_length: int | None = None,
 ):
+    if content.action is ContentAction.REJECT:
+        await message.reply(l10n.format_value("error-non-forwardable-type"))
+        return
+
     if error is not None:
         await message.answer(error)
         return
@@ -31,7 +35,8 @@ async def any_forwardable_message(
     # If message has caption, and it's too long, then we cannot copy it.
     # Actually, we should be able to copy it, but since it's forum topic, we cannot.
     # See https://github.com/tdlib/telegram-bot-api/issues/334#issuecomment-1311709507
-    if caption_length is not None and caption_length > 1023:
+    # Most media can be sent again with caption as a separate message, but not all.
+    if content.caption_too_long and not media_resender.can_resend(content.content_type):
         await message.reply(l10n.format_value("error-caption-too-long"))
         return
 
@@ -43,39 +48,59 @@ async def any_forwardable_message(
             allow_sending_without_reply=True,
         )
 
+    if not content.caption_too_long:
+        try:
+            result: MessageId = await message.copy_to(
+                chat_id=user_id,
+                reply_parameters=reply_parameters,
+            )
+            return MessageConnectionFeedback(
+                from_chat_id=message.chat.id,
+                from_message_id=message.message_id,
+                to_chat_id=user_id,
+                to_message_id=result.message_id,
+                message_date=message.date,
+            )
+        except TelegramBadRequest as ex:
+            if not media_resender.can_resend(content.content_type):
+                reason = "Failed to send message from forum group to private chat"
+                await logger.aexception(reason)
+                await message.reply(f"{reason}, because {ex.__class__.__name__}: {str(ex)}")
+                return
+            await logger.awarning("Failed to copy message from forum group to private chat, resending media")
+        except TelegramAPIError as ex:
+            reason = "Failed to send message from forum group to private chat"
+            await logger.aexception(reason)
+            await message.reply(f"{reason}, because {ex.__class__.__name__}: {str(ex)}")
+            return
+
     try:
-        result: MessageId = await message.copy_to(
+        sent_messages = await media_resender.resend(
+            bot=bot,
+            message=message,
+            content_type=content.content_type,
             chat_id=user_id,
             reply_parameters=reply_parameters,
         )
-        return MessageConnectionFeedback(
-            from_chat_id=message.chat.id,
-            from_message_id=message.message_id,
-            to_chat_id=user_id,
-            to_message_id=result.message_id,
-        )
     except TelegramAPIError as ex:
-        reason = "Failed to send message from forum group to private chat"
+        reason = "Failed to resend media from forum group to private chat"
         await logger.aexception(reason)
         await message.reply(f"{reason}, because {ex.__class__.__name__}: {str(ex)}")
+        return
 
-
-@router.message(ServiceMessagesFilter())
-async def any_service_message(
-        message: Message,
-):
-    return
-
-
-@router.message()
-async def any_non_forwardable_message(
-        message: Message,
-        l10n: FluentLocalization,
-):
-    await message.reply(l10n.format_value("error-non-forwardable-type"))
+    # Both media and caption messages are linked to the original one
+    return [
+        MessageConnectionFeedback(
+            from_chat_id=message.chat.id,
+            from_message_id=message.message_id,
+            to_chat_id=user_id,
+            to_message_id=sent_message.message_id,
+            message_date=message.date,
+        )
+        for sent_message in sent_messages
+    ]
 
 
-@router.edited_message(F.text)
 async def edited_text_message(
         message: Message,
         bot: Bot,
@@ -98,7 +123,6 @@ async def edited_text_message(
         await logger.aexception(error)
 
 
-@router.edited_message()  # All other types of editable media
 async def edited_media_message(
         message: Message,
         bot: Bot,
@@ -110,23 +134,10 @@ async def edited_media_message(
         await message.answer(error)
         return
 
-    if message.animation:
-        new_media = InputMediaAnimation(media=message.animation.file_id)
-    elif message.audio:
-        new_media = InputMediaAudio(media=message.audio.file_id)
-    elif message.document:
-        new_media = InputMediaDocument(media=message.document.file_id)
-    elif message.photo:
-        new_media = InputMediaPhoto(media=message.photo[-1].file_id)
-    elif message.video:
-        new_media = InputMediaVideo(media=message.video.file_id)
-    else:
+    new_media = build_input_media(message)
+    if new_media is None:
         return
 
-    if message.caption:
-        new_media.caption = message.caption
-        new_media.caption_entities = message.caption_entities
-
     try:
         await bot.edit_message_media(
             chat_id=edit_chat_id,
@@ -135,4 +146,13 @@ async def edited_media_message(
         )
     except TelegramAPIError:
         error = "Failed to edit media message on user side"
-        await logger.aexception(error)
\ No newline at end of file
+        await logger.aexception(error)
+
+
+def create_router() -> Router:
+    router = Router()
+    router.message.register(any_message)
+    router.edited_message.register(edited_text_message, F.text)
+    # All other types of editable media
+    router.edited_message.register(edited_media_message)
+    return router
@@ -3,12 +3,16 @@ from aiogram.filters import CommandStart
 from aiogram.types import Message
 from fluent.runtime import FluentLocalization
 
-router = Router()
 
 
-@router.message(CommandStart())
 async def cmd_start(
         message: Message,
         l10n: FluentLocalization,
 ):
     await message.answer(l10n.format_value("user-start"))
+
+
+def create_router() -> Router:
+    router = Router()
+    router.message.register(cmd_start, CommandStart())
+    return router
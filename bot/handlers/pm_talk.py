@@ -1,17 +1,16 @@
 import structlog
 from aiogram import Bot, F, Router
-from aiogram.exceptions import TelegramAPIError
-from aiogram.types import (
-    Message, MessageId, ReplyParameters, User,
-    InputMediaAnimation, InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo,
-)
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.types import Message, MessageId, ReplyParameters, User
 from fluent.runtime import FluentLocalization
 from structlog.types import FilteringBoundLogger
 
-from bot.filters import ForwardableTypesFilter, ServiceMessagesFilter
+from bot.content_routing import ContentAction, ContentRoute, build_input_media
+from bot.flood_control import LoadShedder
 from bot.handlers_feedback import MessageConnectionFeedback
+from bot.media_resender import MediaResender
+from bot.relay_batcher import RelayBatcher
 
-router = Router()
 logger: FilteringBoundLogger = structlog.get_logger()
 
 
@@ -36,18 +35,26 @@ def get_user_data(
     }
 
 
-@router.message(ForwardableTypesFilter())
-async def any_forwardable_message(
+# Service messages are dropped by router-level filter, so only forwardable
+# and non-forwardable types get here. Check is made in handler to avoid extra filter calls.
+async def any_message(
         message: Message,
         bot: Bot,
         forum_chat_id: int,
         l10n: FluentLocalization,
+        content: ContentRoute,
+        media_resender: MediaResender,
         topic_id: int | None = None,
         new_topic_created: bool | None = None,
         error: str | None = None,
         reply_to_message_id: int | None = None,
-        caption_length: int | None = None,
+        load_shedder: LoadShedder | None = None,
+        relay_batcher: RelayBatcher | None = None,
 ):
+    if content.action is ContentAction.REJECT:
+        await message.reply(l10n.format_value("error-non-forwardable-type"))
+        return
+
     if error is not None:
         await message.answer(error)
         return
@@ -55,7 +62,8 @@ async def any_forwardable_message(
     # If message has caption, and it's too long, then we cannot copy it.
     # Actually, we should be able to copy it, but since it's forum topic, we cannot.
     # See https://github.com/tdlib/telegram-bot-api/issues/334#issuecomment-1311709507
-    if caption_length is not None and caption_length > 1023:
+    # Most media can be sent again with caption as a separate message, but not all.
+    if content.caption_too_long and not media_resender.can_resend(content.content_type):
         await message.reply(l10n.format_value("error-caption-too-long"))
         return
 
@@ -69,15 +77,47 @@ async def any_forwardable_message(
                 "premium": user_info["premium"],
                 "language": user_info["language"],
             })
-        try:
-            await bot.send_message(
-                chat_id=forum_chat_id,
-                message_thread_id=topic_id,
-                text=user_info_text
-            )
-        except TelegramAPIError:
-            reason = "Failed to send intro info message from forum group to private chat"
-            await logger.aexception(reason)
+
+        async def send_user_info():
+            try:
+                await bot.send_message(
+                    chat_id=forum_chat_id,
+                    message_thread_id=topic_id,
+                    text=user_info_text
+                )
+            except TelegramAPIError:
+                reason = "Failed to send intro info message from forum group to private chat"
+                await logger.aexception(reason)
+
+        # Under high load, user's message is delivered first, and info about user comes later
+        if load_shedder is not None and load_shedder.is_overloaded():
+            load_shedder.defer(send_user_info)
+        else:
+            await send_user_info()
+
+    # Batch is copied without reply parameters and after user info, so only other messages can join it
+    if relay_batcher is not None and not new_topic_created and reply_to_message_id is None \
+            and relay_batcher.can_batch(content):
+        return await relay_batcher.relay(
+            bot=bot,
+            message=message,
+            content=content,
+            forum_chat_id=forum_chat_id,
+            topic_id=topic_id,
+            copy_one=lambda batched_message, batched_content: copy_message(
+                message=batched_message,
+                bot=bot,
+                forum_chat_id=forum_chat_id,
+                topic_id=topic_id,
+                l10n=l10n,
+                content=batched_content,
+                media_resender=media_resender,
+            ),
+        )
+
+    # Other messages go after the messages which user sent before and which are still waiting in batch
+    if relay_batcher is not None:
+        await relay_batcher.flush(message.chat.id)
 
     # If message is reply to another message, set parameters
     reply_parameters = None
@@ -87,40 +127,83 @@ async def any_forwardable_message(
             allow_sending_without_reply=True,
         )
 
+    return await copy_message(
+        message=message,
+        bot=bot,
+        forum_chat_id=forum_chat_id,
+        topic_id=topic_id,
+        l10n=l10n,
+        content=content,
+        media_resender=media_resender,
+        reply_parameters=reply_parameters,
+    )
+
+
+async def copy_message(
+        message: Message,
+        bot: Bot,
+        forum_chat_id: int,
+        topic_id: int | None,
+        l10n: FluentLocalization,
+        content: ContentRoute,
+        media_resender: MediaResender,
+        reply_parameters: ReplyParameters | None = None,
+) -> MessageConnectionFeedback | list[MessageConnectionFeedback] | None:
+    if not content.caption_too_long:
+        try:
+            result: MessageId = await message.copy_to(
+                chat_id=forum_chat_id,
+                message_thread_id=topic_id,
+                reply_parameters=reply_parameters,
+            )
+            return MessageConnectionFeedback(
+                from_chat_id=message.chat.id,
+                from_message_id=message.message_id,
+                to_chat_id=forum_chat_id,
+                to_message_id=result.message_id,
+                message_date=message.date,
+            )
+        except TelegramBadRequest:
+            if not media_resender.can_resend(content.content_type):
+                reason = "Failed to send message from private chat to forum group"
+                await logger.aexception(reason)
+                await message.reply(l10n.format_value("error-from-pm-to-group"))
+                return
+            await logger.awarning("Failed to copy message from private chat to forum group, resending media")
+        except TelegramAPIError:
+            reason = "Failed to send message from private chat to forum group"
+            await logger.aexception(reason)
+            await message.reply(l10n.format_value("error-from-pm-to-group"))
+            return
+
     try:
-        result: MessageId = await message.copy_to(
+        sent_messages = await media_resender.resend(
+            bot=bot,
+            message=message,
+            content_type=content.content_type,
             chat_id=forum_chat_id,
             message_thread_id=topic_id,
             reply_parameters=reply_parameters,
         )
-        return MessageConnectionFeedback(
-            from_chat_id=message.chat.id,
-            from_message_id=message.message_id,
-            to_chat_id=forum_chat_id,
-            to_message_id=result.message_id,
-        )
     except TelegramAPIError:
-        reason = "Failed to send message from private chat to forum group"
+        reason = "Failed to resend media from private chat to forum group"
         await logger.aexception(reason)
         await message.reply(l10n.format_value("error-from-pm-to-group"))
+        return
 
-
-@router.message(ServiceMessagesFilter())
-async def any_service_message(
-        message: Message,
-):
-    return
-
-
-@router.message()
-async def any_non_forwardable_message(
-        message: Message,
-        l10n: FluentLocalization,
-):
-    await message.reply(l10n.format_value("error-non-forwardable-type"))
+    # Both media and caption messages are linked to the original one
+    return [
+        MessageConnectionFeedback(
+            from_chat_id=message.chat.id,
+            from_message_id=message.message_id,
+            to_chat_id=forum_chat_id,
+            to_message_id=sent_message.message_id,
+            message_date=message.date,
+        )
+        for sent_message in sent_messages
+    ]
 
 
-@router.edited_message(F.text)
 async def edited_text_message(
         message: Message,
         bot: Bot,
@@ -143,7 +226,6 @@ async def edited_text_message(
         await logger.aexception(error)
 
 
-@router.edited_message()  # All other types of editable media
 async def edited_media_message(
         message: Message,
         bot: Bot,
@@ -155,23 +237,10 @@ async def edited_media_message(
         await message.answer(error)
         return
 
-    if message.animation:
-        new_media = InputMediaAnimation(media=message.animation.file_id)
-    elif message.audio:
-        new_media = InputMediaAudio(media=message.audio.file_id)
-    elif message.document:
-        new_media = InputMediaDocument(media=message.document.file_id)
-    elif message.photo:
-        new_media = InputMediaPhoto(media=message.photo[-1].file_id)
-    elif message.video:
-        new_media = InputMediaVideo(media=message.video.file_id)
-    else:
+    new_media = build_input_media(message)
+    if new_media is None:
         return
 
-    if message.caption:
-        new_media.caption = message.caption
-        new_media.caption_entities = message.caption_entities
-
     try:
         await bot.edit_message_media(
             chat_id=edit_chat_id,
@@ -180,4 +249,13 @@ async def edited_media_message(
         )
     except TelegramAPIError:
         error = "Failed to edit media message on group side"
-        await logger.aexception(error)
\ No newline at end of file
+        await logger.aexception(error)
+
+
+def create_router() -> Router:
+    router = Router()
+    router.message.register(any_message)
+    router.edited_message.register(edited_text_message, F.text)
+    # All other types of editable media
+    router.edited_message.register(edited_media_message)
+    return router
@@ -1,11 +1,29 @@
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from time import monotonic
 
-from pydantic import BaseModel
 
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
 
-class MessageConnectionFeedback(BaseModel):
+
+@dataclass(slots=True, kw_only=True)
+class MessageConnectionFeedback:
+    # Created by handlers for every relayed message, so kept as light as possible
     from_chat_id: int
     from_message_id: int
     to_chat_id: int
     to_message_id: int
-    created_at: datetime = datetime.now(timezone.utc)
+    # Date of original message, as set by Telegram (has only 1-second precision)
+    message_date: datetime | None = None
+    # Moment when copy was sent, both for database and for latency measurements
+    created_at: datetime = field(default_factory=utc_now)
+    created_monotonic: float = field(default_factory=monotonic)
+
+    def as_dict(self) -> dict:
+        return {
+            "from_chat_id": self.from_chat_id,
+            "from_message_id": self.from_message_id,
+            "to_chat_id": self.to_chat_id,
+            "to_message_id": self.to_message_id,
+        }
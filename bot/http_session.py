@@ -0,0 +1,72 @@
+from typing import Any, Optional
+
+import orjson
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from bot.config_reader import BotConfig, HttpConfig, MultiTenantConfig
+
+
+def get_api_server(bot_config: BotConfig | MultiTenantConfig) -> TelegramAPIServer:
+    if bot_config.api_url is None:
+        return PRODUCTION
+    return TelegramAPIServer.from_base(bot_config.api_url, is_local=bot_config.api_is_local)
+
+
+def orjson_dumps(value: Any) -> str:
+    # aiogram puts encoded values into form fields, so it expects str, not bytes
+    return orjson.dumps(value).decode()
+
+
+class TunedAiohttpSession(AiohttpSession):
+    """
+    aiohttp session for Bot API with configurable connection pool, keep-alive,
+    DNS cache, per-method timeouts and faster JSON codec.
+    One session can be shared between several bots.
+    """
+
+    def __init__(self, http_config: HttpConfig, **kwargs: Any):
+        if http_config.fast_json:
+            kwargs.setdefault("json_loads", orjson.loads)
+            kwargs.setdefault("json_dumps", orjson_dumps)
+        super().__init__(
+            limit=http_config.connection_limit,
+            timeout=http_config.timeout,
+            **kwargs,
+        )
+        self._connector_init.update(
+            keepalive_timeout=http_config.keepalive_timeout,
+            ttl_dns_cache=http_config.dns_cache_ttl,
+        )
+        self.method_timeouts = http_config.method_timeouts
+        self.connection_limit = http_config.connection_limit
+        # Requests which are sent or waiting for a free connection, except long polling
+        self.in_flight = 0
+        # Long polling requests, each of them holds a connection while waiting for updates.
+        # When the session is shared by several bots, there is one for every bot
+        self.polling = 0
+
+    async def make_request(
+            self,
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+            timeout: Optional[int] = None,
+    ) -> TelegramType:
+        # Explicit timeout (e.g. for getUpdates long polling) always wins
+        if timeout is None:
+            timeout = self.method_timeouts.get(method.__api_method__)
+        polling = isinstance(method, GetUpdates)
+        if polling:
+            self.polling += 1
+        else:
+            self.in_flight += 1
+        try:
+            return await super().make_request(bot, method, timeout)
+        finally:
+            if polling:
+                self.polling -= 1
+            else:
+                self.in_flight -= 1
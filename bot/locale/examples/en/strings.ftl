@@ -24,6 +24,9 @@ yes =
 error-caption-too-long =
     The caption of this message is too long. Please try again with shorter caption.
 
+error-too-many-messages =
+    You are sending messages too fast, some of them were not delivered. Please slow down and send them again.
+
 error-from-pm-to-group =
     Failed to deliver your message. Please try again later.
 
@@ -38,3 +41,64 @@ error-no-user-found-for-topic =
 
 error-failed-to-create-topic =
     Could not create topic
+
+broadcast-usage =
+    To start a broadcast, reply with /broadcast to the message you want to send. This must be done in General topic.
+
+broadcast-started =
+    Broadcast started…
+
+broadcast-progress =
+    Broadcast in progress.
+    Sent: {$sent}, failed: {$failed}, total: {$total}
+    Speed: {$speed} messages per second, approximately {$eta} min left
+
+broadcast-finished =
+    Broadcast finished.
+    Sent: {$sent}, failed: {$failed}
+
+stats-empty =
+    No activity yet.
+
+stats-top-users =
+    Top users by messages:
+
+stats-top-user-line =
+    {$user_id}: {$from_user} from user, {$to_user} to user
+
+stats-daily =
+    Active users per day:
+
+stats-daily-line =
+    {$day}: {$users} users, {$from_users} from users, {$to_users} to users
+
+stats-hourly =
+    Messages per hour (UTC):
+
+stats-hourly-line =
+    {$hour}: {$from_users} from users, {$to_users} to users
+
+profile-started =
+    Profiling for {$seconds} s…
+
+profile-already-running =
+    Profiler is already running.
+
+profile-finished =
+    Profiling finished: {$updates} updates, {$samples} samples.
+    Results are saved to {$path}
+
+profile-failed =
+    Failed to save profile, see logs for details.
+
+ban-usage =
+    Send this command in the topic of the user.
+
+ban-done =
+    User is banned, their messages will be ignored.
+
+unban-done =
+    User is unbanned.
+
+unban-not-banned =
+    User is not banned.
@@ -24,6 +24,9 @@ yes =
 error-caption-too-long =
     Подпись к этому сообщению слишком длинная. Пожалуйста, уменьши длину подписи и попробуй ещё раз.
 
+error-too-many-messages =
+    Ты отправляешь сообщения слишком быстро, и некоторые из них не были доставлены. Пожалуйста, помедленнее, и отправь их ещё раз.
+
 error-from-pm-to-group =
     Не удалось отправить твоё сообщение. Пожалуйста, попробуй ещё раз позднее.
 
@@ -38,3 +41,64 @@ error-no-user-found-for-topic =
 
 error-failed-to-create-topic =
     Не удалось создать топик
+
+broadcast-usage =
+    Чтобы начать рассылку, ответь командой /broadcast на сообщение, которое нужно разослать. Это нужно делать в топике General.
+
+broadcast-started =
+    Рассылка началась…
+
+broadcast-progress =
+    Рассылка идёт.
+    Отправлено: {$sent}, ошибок: {$failed}, всего: {$total}
+    Скорость: {$speed} сообщений в секунду, осталось примерно {$eta} мин.
+
+broadcast-finished =
+    Рассылка завершена.
+    Отправлено: {$sent}, ошибок: {$failed}
+
+stats-empty =
+    Активности пока не было.
+
+stats-top-users =
+    Самые активные пользователи:
+
+stats-top-user-line =
+    {$user_id}: {$from_user} от пользователя, {$to_user} пользователю
+
+stats-daily =
+    Активные пользователи по дням:
+
+stats-daily-line =
+    {$day}: {$users} польз., {$from_users} от пользователей, {$to_users} пользователям
+
+stats-hourly =
+    Сообщения по часам (UTC):
+
+stats-hourly-line =
+    {$hour}: {$from_users} от пользователей, {$to_users} пользователям
+
+profile-started =
+    Профилирование на {$seconds} с…
+
+profile-already-running =
+    Профилировщик уже запущен.
+
+profile-finished =
+    Профилирование завершено: {$updates} апдейтов, {$samples} сэмплов.
+    Результаты сохранены в {$path}
+
+profile-failed =
+    Не удалось сохранить профиль, подробности в логах.
+
+ban-usage =
+    Отправьте эту команду в топике пользователя.
+
+ban-done =
+    Пользователь заблокирован, его сообщения будут игнорироваться.
+
+unban-done =
+    Пользователь разблокирован.
+
+unban-not-banned =
+    Пользователь не заблокирован.
@@ -34,7 +34,8 @@ def get_processors(log_config: LogConfig) -> list:
         result.update(**data)
         return dumps(result, default=str)
 
-    processors = list()
+    # Values bound for the current update (e.g. trace id) are added to every line
+    processors = [structlog.contextvars.merge_contextvars]
     if log_config.show_datetime is True:
         processors.append(structlog.processors.TimeStamper(
             fmt=log_config.datetime_format,
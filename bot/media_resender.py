@@ -0,0 +1,94 @@
+from typing import Any, Awaitable, Callable
+
+import structlog
+from aiogram import Bot
+from aiogram.enums import ContentType
+from aiogram.types import Message, ReplyParameters
+from cachetools import LRUCache
+from structlog.types import FilteringBoundLogger
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+# How to get file object from message, depending on its content type
+MEDIA_GETTERS: dict[str, Callable[[Message], Any]] = {
+    ContentType.ANIMATION: lambda message: message.animation,
+    ContentType.AUDIO: lambda message: message.audio,
+    ContentType.DOCUMENT: lambda message: message.document,
+    ContentType.PHOTO: lambda message: message.photo[-1],
+    ContentType.STICKER: lambda message: message.sticker,
+    ContentType.VIDEO: lambda message: message.video,
+    ContentType.VIDEO_NOTE: lambda message: message.video_note,
+    ContentType.VOICE: lambda message: message.voice,
+}
+
+# How to send file by its file_id, depending on content type
+MEDIA_SENDERS: dict[str, Callable[..., Awaitable[Message]]] = {
+    ContentType.ANIMATION: lambda bot, file_id, **kwargs: bot.send_animation(animation=file_id, **kwargs),
+    ContentType.AUDIO: lambda bot, file_id, **kwargs: bot.send_audio(audio=file_id, **kwargs),
+    ContentType.DOCUMENT: lambda bot, file_id, **kwargs: bot.send_document(document=file_id, **kwargs),
+    ContentType.PHOTO: lambda bot, file_id, **kwargs: bot.send_photo(photo=file_id, **kwargs),
+    ContentType.STICKER: lambda bot, file_id, **kwargs: bot.send_sticker(sticker=file_id, **kwargs),
+    ContentType.VIDEO: lambda bot, file_id, **kwargs: bot.send_video(video=file_id, **kwargs),
+    ContentType.VIDEO_NOTE: lambda bot, file_id, **kwargs: bot.send_video_note(video_note=file_id, **kwargs),
+    ContentType.VOICE: lambda bot, file_id, **kwargs: bot.send_voice(voice=file_id, **kwargs),
+}
+
+
+class MediaResender:
+    """
+    Fallback for messages which cannot be copied as is (e.g. caption is too long for forum topic).
+    Media is sent again by file_id without caption, and caption follows as a separate text message.
+
+    Keeps LRU map of (destination chat id, file_unique_id) -> file_id, taken from already sent messages,
+    so that repeated media (stickers, common documents) is always sent by known good file_id.
+    """
+
+    def __init__(self, cache_size: int):
+        self.file_ids = LRUCache(maxsize=cache_size)
+
+    @staticmethod
+    def can_resend(content_type: str) -> bool:
+        return content_type in MEDIA_SENDERS
+
+    async def resend(
+            self,
+            bot: Bot,
+            message: Message,
+            content_type: str,
+            chat_id: int,
+            message_thread_id: int | None = None,
+            reply_parameters: ReplyParameters | None = None,
+    ) -> list[Message]:
+        media = MEDIA_GETTERS[content_type](message)
+        cache_key = (chat_id, media.file_unique_id)
+        file_id = self.file_ids.get(cache_key, media.file_id)
+
+        sent_media: Message = await MEDIA_SENDERS[content_type](
+            bot,
+            file_id,
+            chat_id=chat_id,
+            message_thread_id=message_thread_id,
+            reply_parameters=reply_parameters,
+        )
+        self.file_ids[cache_key] = MEDIA_GETTERS[content_type](sent_media).file_id
+        await logger.adebug(
+            "Resent media without caption",
+            content_type=content_type,
+            chat_id=chat_id,
+            message_id=sent_media.message_id,
+        )
+
+        result = [sent_media]
+        if message.caption:
+            sent_caption: Message = await bot.send_message(
+                chat_id=chat_id,
+                message_thread_id=message_thread_id,
+                text=message.caption,
+                entities=message.caption_entities,
+                reply_parameters=ReplyParameters(
+                    message_id=sent_media.message_id,
+                    allow_sending_without_reply=True,
+                ),
+            )
+            result.append(sent_caption)
+        return result
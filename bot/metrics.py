@@ -0,0 +1,164 @@
+from bisect import bisect_left
+from typing import Callable
+
+import structlog
+from aiohttp import web
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import MetricsConfig
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}",
+        ]
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # Last item is for "+Inf" bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram"):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class Summary:
+    """
+    Quantiles over a recent window of values. Unlike histogram, quantiles are calculated
+    by the owner of the metric and only set here.
+    """
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.quantiles: dict[float, float] = dict()
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+
+    def set_quantiles(self, quantiles: dict[float, float]):
+        self.quantiles = quantiles
+
+    def merge(self, other: "Summary"):
+        # Quantiles of several processes cannot be combined exactly, so the worst one is taken
+        for quantile, value in other.quantiles.items():
+            self.quantiles[quantile] = max(self.quantiles.get(quantile, value), value)
+        self.sum += other.sum
+        self.count += other.count
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} summary",
+        ]
+        for quantile, value in sorted(self.quantiles.items()):
+            lines.append(f'{self.name}{{quantile="{quantile}"}} {value}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: dict[str, Counter | Histogram | Summary] = dict()
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, documentation)
+        return self.metrics[name]
+
+    def histogram(self, name: str, documentation: str, buckets: tuple[float, ...]) -> Histogram:
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, documentation, buckets)
+        return self.metrics[name]
+
+    def summary(self, name: str, documentation: str) -> Summary:
+        if name not in self.metrics:
+            self.metrics[name] = Summary(name, documentation)
+        return self.metrics[name]
+
+    def merge(self, other: "MetricsRegistry"):
+        # Used to sum up metrics of several worker processes
+        for metric in other.metrics.values():
+            if isinstance(metric, Counter):
+                self.counter(metric.name, metric.documentation).inc(metric.value)
+            elif isinstance(metric, Summary):
+                self.summary(metric.name, metric.documentation).merge(metric)
+            else:
+                self.histogram(metric.name, metric.documentation, metric.buckets).merge(metric)
+
+    def render(self) -> str:
+        lines = list()
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry. Metrics are plain counters, since everything runs in a single event loop.
+# In multi-process mode, workers send their registries to supervisor, which serves the sum of them.
+registry = MetricsRegistry()
+
+
+async def start_metrics_server(
+        metrics_config: MetricsConfig,
+        render: Callable[[], str] = registry.render,
+) -> web.AppRunner:
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=metrics_config.host, port=metrics_config.port)
+    await site.start()
+    await logger.ainfo(
+        "Started metrics server",
+        host=metrics_config.host,
+        port=metrics_config.port,
+    )
+    return runner
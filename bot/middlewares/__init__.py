@@ -1,4 +1,6 @@
 from .session import DbSessionMiddleware
+from .ban_list import BanListMiddleware
+from .flood_control import FloodControlMiddleware
 from .connection_manager import ConnectionMiddleware
 from .user_to_topic_manager import TopicFinderUserToGroup
 from .topic_to_user_manager import GroupToUserMiddleware
@@ -7,6 +9,8 @@ from .find_pair_upon_edit import FindPairToEditMiddleware
 
 __all__ = [
     "DbSessionMiddleware",
+    "BanListMiddleware",
+    "FloodControlMiddleware",
     "ConnectionMiddleware",  # not used directly
     "TopicFinderUserToGroup",
     "GroupToUserMiddleware",
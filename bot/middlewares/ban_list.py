@@ -0,0 +1,45 @@
+from typing import Callable, Awaitable, Dict, Any
+
+import structlog
+from aiogram import BaseMiddleware
+from aiogram.enums import ChatType
+from aiogram.types import TelegramObject, Chat, User
+from structlog.types import FilteringBoundLogger
+
+from bot.ban_list import BanList
+from bot.metrics import registry
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+dropped_counter = registry.counter(
+    "banned_updates_dropped_total",
+    "Updates from banned users, dropped before any database query",
+)
+
+
+class BanListMiddleware(BaseMiddleware):
+    """
+    Drops updates of banned users in private chats. Must be registered before DbSessionMiddleware,
+    so that no database session is opened for them.
+    """
+
+    def __init__(self, ban_list: BanList):
+        super().__init__()
+        self.ban_list = ban_list
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        chat: Chat | None = data.get("event_chat")
+        user: User | None = data.get("event_from_user")
+        if chat is None or chat.type != ChatType.PRIVATE or user is None:
+            return await handler(event, data)
+        # Membership check is done in memory for almost every user
+        if self.ban_list.might_be_banned(user.id) and await self.ban_list.is_banned(user.id):
+            dropped_counter.inc()
+            await logger.adebug("Dropped update from banned user", user_id=user.id)
+            return None
+        return await handler(event, data)
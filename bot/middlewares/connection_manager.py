@@ -1,3 +1,4 @@
+from time import monotonic
 from typing import Callable, Awaitable, Dict, Any
 
 import structlog
@@ -7,12 +8,49 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from structlog.types import FilteringBoundLogger
 
 from bot.db.models import MessageConnection
+from bot.db.queries import StoredPair
+from bot.db.replicas import ReadSession
 from bot.handlers_feedback import MessageConnectionFeedback
+from bot.metrics import registry
+from bot.pair_file import PairFile
+from bot.recent_pairs import RecentPairsIndex
+from bot.stats import StatsAggregator
 
 logger: FilteringBoundLogger = structlog.get_logger()
 
+latency_buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+copy_latency_histogram = registry.histogram(
+    "relay_copy_latency_seconds",
+    "Time from original message date (as set by Telegram) to copy being sent",
+    latency_buckets,
+)
+commit_latency_histogram = registry.histogram(
+    "relay_commit_latency_seconds",
+    "Time from copy being sent to messages pair being saved to database",
+    latency_buckets,
+)
+total_latency_histogram = registry.histogram(
+    "relay_total_latency_seconds",
+    "Time from original message date (as set by Telegram) to messages pair being saved to database",
+    latency_buckets,
+)
+
 
 class ConnectionMiddleware(BaseMiddleware):
+    def __init__(
+            self,
+            pairs_index: RecentPairsIndex,
+            stats: StatsAggregator | None = None,
+            pair_file: PairFile | None = None,
+            on_pairs_created: Callable[[int, list[StoredPair]], None] | None = None,
+    ):
+        self.pairs_index = pairs_index
+        self.stats = stats
+        # Pairs of this and other processes of the host, which survive restarts.
+        # Saved pairs are passed to its writer, which may be in another process
+        self.pair_file = pair_file
+        self.on_pairs_created = on_pairs_created
+
     async def __call__(
             self,
             handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
@@ -21,40 +59,109 @@ class ConnectionMiddleware(BaseMiddleware):
     ) -> Any:
         raise NotImplementedError()
 
-    @staticmethod
-    async def create_new_message_connection(
-            message_connection: MessageConnectionFeedback,
+    async def save_handler_result(
+            self,
+            result: Any,
             session: AsyncSession,
+            bot_id: int,
     ):
-        new_obj = MessageConnection(
-            from_chat_id=message_connection.from_chat_id,
-            from_message_id=message_connection.from_message_id,
-            to_chat_id=message_connection.to_chat_id,
-            to_message_id=message_connection.to_message_id,
-        )
-        session.add(new_obj)
+        # Handlers return either a single pair or a list of them, if message was split
+        # or several messages were relayed at once. Empty list means pairs are saved by another update
+        if isinstance(result, MessageConnectionFeedback):
+            await self.create_new_message_connections([result], session=session, bot_id=bot_id)
+        elif isinstance(result, list) and result:
+            await self.create_new_message_connections(result, session=session, bot_id=bot_id)
+
+    async def create_new_message_connections(
+            self,
+            message_connections: list[MessageConnectionFeedback],
+            session: AsyncSession,
+            bot_id: int,
+    ):
+        # One message can be relayed as several ones (e.g. media and its caption),
+        # and several messages can be relayed at once, so all pairs are saved in one transaction.
+        new_objects = [
+            MessageConnection(
+                bot_id=bot_id,
+                from_chat_id=message_connection.from_chat_id,
+                from_message_id=message_connection.from_message_id,
+                to_chat_id=message_connection.to_chat_id,
+                to_message_id=message_connection.to_message_id,
+                created_at=message_connection.created_at,
+            )
+            for message_connection in message_connections
+        ]
+        session.add_all(new_objects)
         try:
             await session.commit()
+            for message_connection in message_connections:
+                self.pairs_index.add(message_connection)
+                self.observe_relay_latency(message_connection)
+            if self.on_pairs_created is not None:
+                self.on_pairs_created(bot_id, [
+                    StoredPair(
+                        message_connection.from_chat_id,
+                        message_connection.from_message_id,
+                        message_connection.to_chat_id,
+                        message_connection.to_message_id,
+                    )
+                    for message_connection in message_connections
+                ])
+            # Split message is still one message for its author, and its pairs go one after another
+            if self.stats is not None:
+                previous = None
+                for message_connection in message_connections:
+                    if previous is None or message_connection.from_message_id != previous.from_message_id:
+                        self.stats.record(message_connection)
+                    previous = message_connection
             await logger.adebug(
-                f"Successfully saved messages pair to database",
-                details=new_obj.as_dict(),
+                f"Successfully saved messages pairs to database",
+                details=[new_obj.as_dict() for new_obj in new_objects],
             )
         except:
-            await logger.aexception("Failed to save messages pair to database")
-
+            await logger.aexception("Failed to save messages pairs to database")
 
     @staticmethod
+    def observe_relay_latency(message_connection: MessageConnectionFeedback):
+        commit_latency = monotonic() - message_connection.created_monotonic
+        commit_latency_histogram.observe(commit_latency)
+        if message_connection.message_date is not None:
+            copy_latency = (message_connection.created_at - message_connection.message_date).total_seconds()
+            copy_latency_histogram.observe(copy_latency)
+            total_latency_histogram.observe(copy_latency + commit_latency)
+
+
+    def find_recent_pair(
+            self,
+            bot_id: int,
+            chat_id: int,
+            message_id: int,
+            originated_from_user: bool,
+    ) -> StoredPair | MessageConnectionFeedback | None:
+        pair = self.pairs_index.find(chat_id, message_id, originated_from_user)
+        if pair is None and self.pair_file is not None:
+            pair = self.pair_file.find(bot_id, chat_id, message_id, originated_from_user)
+        return pair
+
     async def find_message_pair(
+            self,
             message: Message,
-            session: AsyncSession,
-    ) -> MessageConnection | None:
-        query = MessageConnection.find_pair_message(
+            read_session: ReadSession,
+    ) -> StoredPair | MessageConnectionFeedback | None:
+        pair = self.find_recent_pair(
+            read_session.bot_id,
+            message.chat.id,
+            message.message_id,
+            originated_from_user=True,
+        )
+        if pair is not None:
+            return pair
+
+        pair = await read_session.find_pair(
             message.chat.id,
             message.message_id,
             originated_from_user=True,
         )
-        search_result = await session.execute(query)
-        pair = search_result.scalar_one_or_none()
         if pair is not None:
             await logger.adebug(
                 "Found pair message",
@@ -64,19 +171,27 @@ class ConnectionMiddleware(BaseMiddleware):
         return None
 
 
-    @staticmethod
     async def find_replied_message_pair(
+            self,
             reply_message: Message,
-            session: AsyncSession,
-    ) -> MessageConnection | None:
+            read_session: ReadSession,
+    ) -> int | None:
+        # If replied message was sent by bot, then it is a copy, otherwise it's an original.
         is_reply_to_user_message = not reply_message.from_user.is_bot
-        query = MessageConnection.find_pair_message(
+
+        # Most replies are made to recent messages, so try indexes first
+        reply_pair = self.find_recent_pair(
+            read_session.bot_id,
             reply_message.chat.id,
             reply_message.message_id,
             is_reply_to_user_message,
         )
-        search_result = await session.execute(query)
-        reply_pair = search_result.scalar_one_or_none()
+        if reply_pair is None:
+            reply_pair = await read_session.find_pair(
+                reply_message.chat.id,
+                reply_message.message_id,
+                is_reply_to_user_message,
+            )
         if reply_pair is not None:
             await logger.adebug(
                 "Found reply message",
@@ -3,9 +3,9 @@ from typing import Callable, Awaitable, Dict, Any
 import structlog
 from aiogram.types import TelegramObject, Message
 from fluent.runtime import FluentLocalization
-from sqlalchemy.ext.asyncio import AsyncSession
 from structlog.types import FilteringBoundLogger
 
+from bot.db.replicas import ReadSession
 from bot.middlewares import ConnectionMiddleware
 
 logger: FilteringBoundLogger = structlog.get_logger()
@@ -18,12 +18,12 @@ class FindPairToEditMiddleware(ConnectionMiddleware):
             event: Message,
             data: Dict[str, Any],
     ) -> Any:
-        session: AsyncSession = data["session"]
+        read_session: ReadSession = data["read_session"]
         l10n: FluentLocalization = data["l10n"]
 
         pair = await self.find_message_pair(
             message=event,
-            session=session,
+            read_session=read_session,
         )
         if pair is None:
             data["error"] = l10n.format_value("error-cannot-find-pair-to-edit")
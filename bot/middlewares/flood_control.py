@@ -0,0 +1,78 @@
+from typing import Callable, Awaitable, Dict, Any
+
+import structlog
+from aiogram import BaseMiddleware, Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import TelegramObject, Message, Update
+from cachetools import TTLCache
+from fluent.runtime import FluentLocalization
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import FloodConfig
+from bot.flood_control import LoadShedder, TokenBucket
+from bot.metrics import registry
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+flood_counter = registry.counter(
+    "flood_messages_shed_total",
+    "Messages and edits from users dropped for exceeding their rate limit",
+)
+
+
+class FloodControlMiddleware(BaseMiddleware):
+    """
+    Limits messages and edits of every user with a token bucket, so that one user cannot use up
+    forum's send limit. Messages above the limit are dropped, and user is asked to slow down.
+    Under high load, edits are postponed by load shedder instead of being handled right away.
+    Must be registered before middlewares which query database.
+    """
+
+    def __init__(self, flood_config: FloodConfig, load_shedder: LoadShedder):
+        super().__init__()
+        self.config = flood_config
+        self.load_shedder = load_shedder
+        self.buckets: TTLCache[int, TokenBucket] = TTLCache(
+            maxsize=flood_config.buckets_size,
+            ttl=flood_config.buckets_ttl,
+        )
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: Message,
+            data: Dict[str, Any],
+    ) -> Any:
+        if data.get("deferred"):
+            return await handler(event, data)
+
+        bucket = self.buckets.get(event.chat.id)
+        if bucket is None:
+            bucket = self.buckets[event.chat.id] = TokenBucket(self.config.burst)
+        if not bucket.take(self.config.rate, self.config.burst):
+            flood_counter.inc()
+            if event.edit_date is None:
+                await self.notify(event, bucket, data["l10n"])
+            return None
+
+        if event.edit_date is not None:
+            key = (event.chat.id, event.message_id)
+            # Edit of the same message may already be waiting, and must not be overtaken
+            if self.load_shedder.has_pending_edit(key) or self.load_shedder.is_overloaded():
+                bot: Bot = data["bot"]
+                update: Update = data["event_update"]
+                self.load_shedder.defer_edit(bot, key, update)
+                return None
+
+        return await handler(event, data)
+
+    async def notify(self, message: Message, bucket: TokenBucket, l10n: FluentLocalization):
+        now = bucket.updated_at
+        if bucket.notified_at is not None and now - bucket.notified_at < self.config.notice_interval:
+            return
+        bucket.notified_at = now
+        await logger.ainfo("User is sending messages too fast", user_id=message.chat.id)
+        try:
+            await message.answer(l10n.format_value("error-too-many-messages"))
+        except TelegramAPIError:
+            await logger.aexception("Failed to send slow down notice")
@@ -1,14 +1,17 @@
 from typing import Callable, Awaitable, Dict, Any
 
-from aiogram import BaseMiddleware
+from aiogram import BaseMiddleware, Bot
 from aiogram.types import TelegramObject
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
+from bot.db.replicas import ReadSession, ReplicaPool
+
 
 class DbSessionMiddleware(BaseMiddleware):
-    def __init__(self, session_pool: async_sessionmaker):
+    def __init__(self, session_pool: async_sessionmaker, replicas: ReplicaPool | None = None):
         super().__init__()
         self.session_pool = session_pool
+        self.replicas = replicas
 
     async def __call__(
             self,
@@ -18,4 +21,11 @@ class DbSessionMiddleware(BaseMiddleware):
     ) -> Any:
         async with self.session_pool() as session:
             data["session"] = session
-            return await handler(event, data)
+            # Replica connection is only taken on first lookup
+            bot: Bot = data["bot"]
+            read_session = ReadSession(session, bot.id, self.replicas)
+            data["read_session"] = read_session
+            try:
+                return await handler(event, data)
+            finally:
+                await read_session.close()
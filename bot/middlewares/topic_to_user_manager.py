@@ -2,50 +2,93 @@ from typing import Callable, Awaitable, Dict, Any
 
 import structlog
 from aiogram.types import TelegramObject, Message
+from cachetools import TTLCache
 from fluent.runtime import FluentLocalization
 from sqlalchemy.ext.asyncio import AsyncSession
 from structlog.types import FilteringBoundLogger
 
-from bot.db.models import Topic
-from bot.handlers_feedback import MessageConnectionFeedback
+from bot.content_routing import ContentAction, ContentRoute
+from bot.db.queries import StoredPair
+from bot.db.replicas import ReadSession
 from bot.middlewares import ConnectionMiddleware
+from bot.pair_file import PairFile
+from bot.recent_pairs import RecentPairsIndex
+from bot.stats import StatsAggregator
+from bot.topics_index import TopicsIndex
 
 logger: FilteringBoundLogger = structlog.get_logger()
 
 
 class GroupToUserMiddleware(ConnectionMiddleware):
+    def __init__(
+            self,
+            unroutable_topics: TTLCache,
+            pairs_index: RecentPairsIndex,
+            topics_index: TopicsIndex,
+            stats: StatsAggregator,
+            pair_file: PairFile | None = None,
+            on_pairs_created: Callable[[int, list[StoredPair]], None] | None = None,
+    ):
+        super().__init__(
+            pairs_index=pairs_index,
+            stats=stats,
+            pair_file=pair_file,
+            on_pairs_created=on_pairs_created,
+        )
+        # Shared with TopicFinderUserToGroup, which removes topics from here upon creation
+        self.unroutable_topics = unroutable_topics
+        self.topics_index = topics_index
+
     async def __call__(
             self,
             handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
             event: Message,
             data: Dict[str, Any],
     ) -> Any:
+        # Messages from General topic never belong to any user,
+        # so there is nothing to look for in database.
+        if not event.is_topic_message:
+            return None
+
+        topic_id = event.message_thread_id
+        # This topic was already checked recently and has no user,
+        # so the error was already shown. Skip it silently.
+        if topic_id in self.unroutable_topics:
+            await logger.adebug(f"Skipping message in unroutable topic {topic_id}")
+            return None
+
+        # Message will be rejected anyway, so there is no need to find user for it
+        content: ContentRoute = data["content"]
+        if content.action is ContentAction.REJECT:
+            return await handler(event, data)
+
         session: AsyncSession = data["session"]
+        read_session: ReadSession = data["read_session"]
         l10n: FluentLocalization = data["l10n"]
 
-        result = await session.execute(Topic.find_by_topic_id(event.message_thread_id))
-        topic = result.scalar_one_or_none()
+        user_id = self.topics_index.find_user_id(topic_id)
+        if user_id is None:
+            user_id = await read_session.find_user_id(topic_id)
+            if user_id is not None:
+                self.topics_index.add(user_id, topic_id)
 
-        if not topic:
-            await logger.aerror(f"No user found for topic {event.message_thread_id}")
+        if user_id is None:
+            await logger.aerror(f"No user found for topic {topic_id}")
+            self.unroutable_topics[topic_id] = True
             data["error"] = l10n.format_value("error-no-user-found-for-topic")
-        else:
-            await logger.adebug(f"Found user for topic {topic.topic_id}: {topic.user_id}")
-            data["user_id"] = topic.user_id
+            # No need to look for replied message, since there is nowhere to send it
+            return await handler(event, data)
+
+        await logger.adebug(f"Found user for topic {topic_id}: {user_id}")
+        data["user_id"] = user_id
 
         # If it is a reply to some other message, try to find it.
         if (reply := event.reply_to_message) is not None:
             data["reply_to_message_id"] = await self.find_replied_message_pair(
                 reply_message=reply,
-                session=session,
+                read_session=read_session,
             )
 
         result = await handler(event, data)
-
-        if isinstance(result, MessageConnectionFeedback):
-            await self.create_new_message_connection(
-                message_connection=result,
-                session=session,
-            )
-
+        await self.save_handler_result(result, session=session, bot_id=data["bot"].id)
         return result
@@ -4,13 +4,20 @@ import structlog
 from aiogram import Bot
 from aiogram.exceptions import TelegramAPIError
 from aiogram.types import ForumTopic, TelegramObject, Message, User
+from cachetools import TTLCache
 from fluent.runtime import FluentLocalization
 from sqlalchemy.ext.asyncio import AsyncSession
 from structlog.types import FilteringBoundLogger
 
+from bot.content_routing import ContentAction, ContentRoute
 from bot.db.models import Topic
-from bot.handlers_feedback import MessageConnectionFeedback
+from bot.db.queries import StoredPair
+from bot.db.replicas import ReadSession
 from bot.middlewares import ConnectionMiddleware
+from bot.pair_file import PairFile
+from bot.recent_pairs import RecentPairsIndex
+from bot.stats import StatsAggregator
+from bot.topics_index import TopicsIndex
 
 logger: FilteringBoundLogger = structlog.get_logger()
 
@@ -19,8 +26,26 @@ class TopicFinderUserToGroup(ConnectionMiddleware):
     def __init__(
             self,
             forum_chat_id: int,
+            unroutable_topics: TTLCache,
+            pairs_index: RecentPairsIndex,
+            topics_index: TopicsIndex,
+            stats: StatsAggregator,
+            on_topic_created: Callable[[int], None] | None = None,
+            pair_file: PairFile | None = None,
+            on_pairs_created: Callable[[int, list[StoredPair]], None] | None = None,
     ):
+        super().__init__(
+            pairs_index=pairs_index,
+            stats=stats,
+            pair_file=pair_file,
+            on_pairs_created=on_pairs_created,
+        )
         self.forum_chat_id = forum_chat_id
+        self.unroutable_topics = unroutable_topics
+        self.topics_index = topics_index
+        # In multi-process mode, messages from this topic may be handled by another process,
+        # which has to forget about this topic too
+        self.on_topic_created = on_topic_created
 
     async def __call__(
             self,
@@ -28,16 +53,26 @@ class TopicFinderUserToGroup(ConnectionMiddleware):
             event: Message,
             data: Dict[str, Any],
     ) -> Any:
+        data["forum_chat_id"] = self.forum_chat_id
+
+        # Message will be rejected anyway, so there is no need to find or create topic for it
+        content: ContentRoute = data["content"]
+        if content.action is ContentAction.REJECT:
+            return await handler(event, data)
+
         session: AsyncSession = data["session"]
+        read_session: ReadSession = data["read_session"]
         l10n: FluentLocalization = data["l10n"]
 
         user: User = event.from_user
-        data["forum_chat_id"] = self.forum_chat_id
 
-        result = await session.execute(Topic.find_by_user_id(user.id))
-        topic = result.scalar_one_or_none()
+        topic_id = self.topics_index.find_topic_id(user.id)
+        if topic_id is None:
+            topic_id = await read_session.find_topic_id(user.id)
+            if topic_id is not None:
+                self.topics_index.add(user.id, topic_id)
 
-        if not topic:
+        if topic_id is None:
             await logger.adebug(f"No topic found for user {user.id}")
             bot: Bot = data["bot"]
             created_topic: ForumTopic | None = await self.create_topic(
@@ -51,24 +86,18 @@ class TopicFinderUserToGroup(ConnectionMiddleware):
                 data["topic_id"] = created_topic.message_thread_id
                 data["new_topic_created"] = True
         else:
-            await logger.adebug(f"Found topic for user {user.id}: {topic.topic_id}")
-            data["topic_id"] = topic.topic_id
+            await logger.adebug(f"Found topic for user {user.id}: {topic_id}")
+            data["topic_id"] = topic_id
 
         # If it is a reply to some other message, try to find it.
         if (reply := event.reply_to_message) is not None:
             data["reply_to_message_id"] = await self.find_replied_message_pair(
                 reply_message=reply,
-                session=session,
+                read_session=read_session,
             )
 
         result = await handler(event, data)
-
-        if isinstance(result, MessageConnectionFeedback):
-            await self.create_new_message_connection(
-                message_connection=result,
-                session=session,
-            )
-
+        await self.save_handler_result(result, session=session, bot_id=data["bot"].id)
         return result
 
     async def create_topic(
@@ -100,12 +129,18 @@ class TopicFinderUserToGroup(ConnectionMiddleware):
         if new_topic is not None:
             try:
                 new_topic_in_db = Topic(
+                    bot_id=bot.id,
                     user_id=user.id,
                     topic_id=new_topic.message_thread_id,
                 )
                 session.add(new_topic_in_db)
 
                 await session.commit()
+                self.topics_index.add(user.id, new_topic.message_thread_id)
+                # In case someone has already written to this topic before it got saved
+                self.unroutable_topics.pop(new_topic.message_thread_id, None)
+                if self.on_topic_created is not None:
+                    self.on_topic_created(new_topic.message_thread_id)
                 await logger.adebug(
                     f"Successfully saved topic to database",
                     topic_id=new_topic.message_thread_id,
@@ -0,0 +1,254 @@
+import mmap
+import os
+import struct
+from typing import Iterable
+
+import structlog
+from structlog.types import FilteringBoundLogger
+
+from bot.db.queries import StoredPair
+from bot.metrics import registry
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+hits_counter = registry.counter(
+    "pair_file_hits_total",
+    "Message pair lookups answered from memory-mapped pair file",
+)
+misses_counter = registry.counter(
+    "pair_file_misses_total",
+    "Message pair lookups which were not found in memory-mapped pair file",
+)
+
+MAGIC = b"FBPAIRS1"
+# Magic, capacity (records in ring), size of each hash table (slots), sequence number of the next record.
+# File is only shared between processes of one host, so native byte order is used everywhere
+HEADER = struct.Struct("=8sIIQ")
+HEADER_SIZE = 64
+# Generation, bot id, from chat id, from message id, to chat id, to message id, generation again
+RECORD = struct.Struct("=IqqqqqI")
+GENERATION = struct.Struct("=I")
+BODY = struct.Struct("=qqqqq")
+BODY_OFFSET = GENERATION.size
+GENERATION_END_OFFSET = GENERATION.size + BODY.size
+# Readers give up after this many slots and go to database, e.g. while the writer moves slots
+MAX_PROBES = 64
+ORIGIN, COPY = 0, 1
+
+UINT64 = 0xFFFFFFFFFFFFFFFF
+
+
+def get_home_slot(bot_id: int, chat_id: int, message_id: int, mask: int) -> int:
+    # Explicit hash instead of built-in one, so that the file stays valid after Python upgrade
+    h = (bot_id * 0x9E3779B97F4A7C15 + chat_id * 0xC2B2AE3D27D4EB4F + message_id) & UINT64
+    h = ((h ^ (h >> 32)) * 0xD6E8FEB86659FD93) & UINT64
+    return (h ^ (h >> 32)) & mask
+
+
+def get_table_size(capacity: int) -> int:
+    # Power of two with load factor of at most 0.5, so that probe sequences stay short
+    return 1 << (capacity * 2 - 1).bit_length()
+
+
+def get_file_size(capacity: int, table_size: int) -> int:
+    return HEADER_SIZE + capacity * RECORD.size + 2 * table_size * 4
+
+
+class PairFile:
+    """
+    Message pairs of recent messages in a memory-mapped file, so that lookups for replies and edits
+    don't go to database, even right after restart.
+
+    Pairs are fixed-size records in a ring: when it's full, every new pair overwrites the oldest one.
+    Two hash tables (by original message and by copy) with open addressing and linear probing
+    hold positions of records in ring. Entries of an overwritten record are removed with backward shift,
+    so tables never fill up with deleted entries.
+
+    There is one writer per host (the bot process itself, or supervisor in multi-process mode),
+    while workers map the same file read-only. Readers don't take locks, records work as a seqlock:
+    writer updates the leading generation, then the pair, then the trailing generation,
+    while readers go the opposite way. A record is only trusted when its key matches and generation
+    at both of its ends is the same, anything else is a miss, and lookup goes to database as usual.
+    """
+
+    def __init__(self, path: str, writable: bool):
+        self.path = path
+        self.writable = writable
+        self.file = open(path, "r+b" if writable else "rb")
+        header = self.file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            header = bytes(HEADER.size)
+        magic, self.capacity, table_size, self.head = HEADER.unpack(header)
+        if magic != MAGIC or os.fstat(self.file.fileno()).st_size != get_file_size(self.capacity, table_size):
+            self.file.close()
+            error = f"{path} is not a pair file"
+            raise ValueError(error)
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self.mask = table_size - 1
+        self.records_offset = HEADER_SIZE
+        tables_offset = HEADER_SIZE + self.capacity * RECORD.size
+        view = memoryview(self.mmap)
+        self.tables = (
+            view[tables_offset:tables_offset + table_size * 4].cast("I"),
+            view[tables_offset + table_size * 4:].cast("I"),
+        )
+        view.release()
+
+    @classmethod
+    def create(cls, path: str, capacity: int) -> "PairFile":
+        # Pairs saved before restart are kept, unless capacity was changed
+        if os.path.exists(path):
+            try:
+                pair_file = cls(path, writable=True)
+            except (ValueError, OSError):
+                logger.warning("Pair file is damaged, creating a new one", path=path)
+            else:
+                if pair_file.capacity == capacity:
+                    return pair_file
+                pair_file.close()
+                logger.info("Pair file capacity has changed, creating a new one", path=path, capacity=capacity)
+
+        # Readers of the old file keep their mapping until they reopen it
+        table_size = get_table_size(capacity)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as file:
+            file.truncate(get_file_size(capacity, table_size))
+            file.write(HEADER.pack(MAGIC, capacity, table_size, 0))
+        os.replace(temp_path, path)
+        return cls(path, writable=True)
+
+    @classmethod
+    def open_readonly(cls, path: str) -> "PairFile":
+        return cls(path, writable=False)
+
+    def find(
+            self,
+            bot_id: int,
+            chat_id: int,
+            message_id: int,
+            originated_from_user: bool,
+    ) -> StoredPair | None:
+        table_index = ORIGIN if originated_from_user else COPY
+        table = self.tables[table_index]
+        slot = get_home_slot(bot_id, chat_id, message_id, self.mask)
+        for _ in range(MAX_PROBES):
+            value = table[slot]
+            if value == 0:
+                break
+            record = self.read_record(value - 1)
+            if record is not None and self.get_key(record, table_index) == (bot_id, chat_id, message_id):
+                hits_counter.inc()
+                return StoredPair(*record[1:])
+            slot = (slot + 1) & self.mask
+        misses_counter.inc()
+        return None
+
+    def read_record(self, position: int) -> tuple[int, int, int, int, int] | None:
+        # In reverse order of writing: if the leading generation is still the same after the pair
+        # was read, writer hasn't started to overwrite it, and the trailing one tells it had finished before
+        offset = self.records_offset + position * RECORD.size
+        (generation_end,) = GENERATION.unpack_from(self.mmap, offset + GENERATION_END_OFFSET)
+        record = BODY.unpack_from(self.mmap, offset + BODY_OFFSET)
+        (generation,) = GENERATION.unpack_from(self.mmap, offset)
+        # Generations differ while the record is being overwritten
+        if generation == 0 or generation != generation_end:
+            return None
+        return record
+
+    def write_record(self, position: int, generation: int, record: tuple[int, int, int, int, int]):
+        offset = self.records_offset + position * RECORD.size
+        GENERATION.pack_into(self.mmap, offset, generation)
+        BODY.pack_into(self.mmap, offset + BODY_OFFSET, *record)
+        GENERATION.pack_into(self.mmap, offset + GENERATION_END_OFFSET, generation)
+
+    @staticmethod
+    def get_key(record: tuple[int, int, int, int, int], table_index: int) -> tuple[int, int, int]:
+        bot_id, from_chat_id, from_message_id, to_chat_id, to_message_id = record
+        if table_index == ORIGIN:
+            return bot_id, from_chat_id, from_message_id
+        return bot_id, to_chat_id, to_message_id
+
+    def add_many(self, bot_id: int, pairs: Iterable[StoredPair]):
+        for pair in pairs:
+            self.add(bot_id, pair)
+
+    def add(self, bot_id: int, pair: StoredPair):
+        position = self.head % self.capacity
+        if self.head >= self.capacity:
+            self.evict(position)
+        # Generation is never 0, so that empty records are never valid
+        generation = self.head % 0xFFFFFFFF + 1
+        self.head += 1
+        record = (bot_id, *pair)
+        self.write_record(position, generation, record)
+
+        # One original message can have several copies (e.g. media and its caption),
+        # in this case the first copy is the main one
+        slot = self.find_slot(ORIGIN, record)
+        existing = self.tables[ORIGIN][slot]
+        main_copy = self.read_record(existing - 1) if existing else None
+        if main_copy is None or pair.to_message_id < main_copy[4]:
+            self.tables[ORIGIN][slot] = position + 1
+        slot = self.find_slot(COPY, record)
+        self.tables[COPY][slot] = position + 1
+        HEADER.pack_into(self.mmap, 0, MAGIC, self.capacity, self.mask + 1, self.head)
+
+    def find_slot(self, table_index: int, record: tuple[int, int, int, int, int]) -> int:
+        # Slot with the same key, or the first empty one. There is always an empty one,
+        # since tables are at least twice as large as ring
+        table = self.tables[table_index]
+        key = self.get_key(record, table_index)
+        slot = get_home_slot(*key, self.mask)
+        while True:
+            value = table[slot]
+            if value == 0:
+                return slot
+            existing = self.read_record(value - 1)
+            if existing is not None and self.get_key(existing, table_index) == key:
+                return slot
+            slot = (slot + 1) & self.mask
+
+    def evict(self, position: int):
+        record = self.read_record(position)
+        if record is None:
+            return
+        for table_index in (ORIGIN, COPY):
+            table = self.tables[table_index]
+            slot = get_home_slot(*self.get_key(record, table_index), self.mask)
+            while table[slot] != 0:
+                if table[slot] == position + 1:
+                    self.delete(table_index, slot)
+                    break
+                slot = (slot + 1) & self.mask
+
+    def delete(self, table_index: int, slot: int):
+        # Backward shift: entries after the deleted one are moved back, unless they would
+        # be moved before their home slot, so that every entry stays reachable from its home slot
+        table = self.tables[table_index]
+        current = slot
+        while True:
+            current = (current + 1) & self.mask
+            value = table[current]
+            if value == 0:
+                break
+            record = self.read_record(value - 1)
+            if record is None:
+                # Left by a writer which crashed in the middle of adding a pair
+                continue
+            home = get_home_slot(*self.get_key(record, table_index), self.mask)
+            # Distance from home to current position must not be shorter than from home to the free slot
+            if (current - home) & self.mask >= (current - slot) & self.mask:
+                table[slot] = value
+                slot = current
+        table[slot] = 0
+
+    def close(self):
+        for table in self.tables:
+            table.release()
+        if self.writable:
+            self.mmap.flush()
+        self.mmap.close()
+        self.file.close()
+
+    async def stop(self):
+        self.close()
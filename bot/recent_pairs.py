@@ -0,0 +1,54 @@
+from cachetools import TTLCache
+
+from bot.db.queries import StoredPair
+from bot.handlers_feedback import MessageConnectionFeedback
+from bot.metrics import registry
+
+hits_counter = registry.counter(
+    "recent_pairs_hits_total",
+    "Message pair lookups answered from in-memory index",
+)
+misses_counter = registry.counter(
+    "recent_pairs_misses_total",
+    "Message pair lookups which had to go to database",
+)
+
+
+class RecentPairsIndex:
+    """
+    In-memory index of recently created message pairs.
+    Every pair is stored twice: by original message ids (chat and message, where it came from)
+    and by copy ids (chat and message, where the bot copied it to),
+    so lookups in both directions avoid database.
+    Besides pairs created by this process, it's filled with pairs loaded from database on startup.
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.by_origin = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.by_copy = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def add(self, pair: MessageConnectionFeedback | StoredPair):
+        # One original message can have several copies (e.g. media and its caption),
+        # in this case the first copy is the main one. Pairs loaded on startup come in any order.
+        origin_key = (pair.from_chat_id, pair.from_message_id)
+        main_copy = self.by_origin.get(origin_key)
+        if main_copy is None or pair.to_message_id < main_copy.to_message_id:
+            self.by_origin[origin_key] = pair
+        self.by_copy[(pair.to_chat_id, pair.to_message_id)] = pair
+
+    def find(
+            self,
+            chat_id: int,
+            message_id: int,
+            originated_from_user: bool,
+    ) -> MessageConnectionFeedback | StoredPair | None:
+        if originated_from_user:
+            pair = self.by_origin.get((chat_id, message_id))
+        else:
+            pair = self.by_copy.get((chat_id, message_id))
+
+        if pair is None:
+            misses_counter.inc()
+        else:
+            hits_counter.inc()
+        return pair
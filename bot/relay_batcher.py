@@ -0,0 +1,203 @@
+import asyncio
+from typing import Awaitable, Callable
+
+import structlog
+from aiogram import Bot
+from aiogram.enums import ContentType
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Message
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import RelayBatchConfig
+from bot.content_routing import ContentRoute
+from bot.handlers_feedback import MessageConnectionFeedback
+from bot.metrics import registry
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+batches_counter = registry.counter(
+    "relay_batches_total",
+    "Batches of user messages copied to forum topic with one Bot API call",
+)
+batched_messages_counter = registry.counter(
+    "relay_batched_messages_total",
+    "User messages copied to forum topic as a part of batch",
+)
+failed_batches_counter = registry.counter(
+    "relay_failed_batches_total",
+    "Batches of user messages which could not be copied at once and were copied one by one",
+)
+
+# copyMessages skips these (quiz polls only sometimes), and then copies can't be matched with originals
+NOT_BATCHED_TYPES = frozenset({
+    ContentType.PAID_MEDIA,
+    ContentType.POLL,
+    ContentType.INVOICE,
+    ContentType.GIVEAWAY,
+    ContentType.GIVEAWAY_WINNERS,
+})
+
+CopyResult = MessageConnectionFeedback | list[MessageConnectionFeedback] | None
+CopyOne = Callable[[Message, ContentRoute], Awaitable[CopyResult]]
+
+
+class PendingBatch:
+    __slots__ = ("topic_id", "entries", "full", "relayed")
+
+    def __init__(self, topic_id: int, message: Message, content: ContentRoute):
+        self.topic_id = topic_id
+        self.entries = [(message, content)]
+        self.full = asyncio.Event()
+        # Set when messages were copied: True by the first one, False if each of them has to be copied on its own
+        self.relayed: asyncio.Future[bool] = asyncio.get_running_loop().create_future()
+
+
+class RelayBatcher:
+    """
+    Collects messages which one user sends in quick succession and copies them to forum topic
+    with a single copyMessages call, so that a burst of messages costs one Bot API call
+    and one database transaction instead of one for each. Albums also stay albums this way.
+
+    The first message of a batch waits for the window (or until batch is full), copies all
+    messages of the batch ordered by message id and returns pairs of all of them, to be saved
+    by routing middleware as usual. Other messages of the batch return nothing.
+    If batch can't be copied at once, or has only one message, the first message copies them
+    one by one in the same order. Messages which can't be batched are copied after
+    the pending batch of their user, see flush().
+    """
+
+    def __init__(self, config: RelayBatchConfig):
+        self.window = config.window
+        self.max_size = config.max_size
+        # Batches which are still collecting messages, by user id
+        self.batches: dict[int, PendingBatch] = dict()
+        # The last batch of every user which is being copied, so that the next one goes after it
+        self.sending: dict[int, asyncio.Future[bool]] = dict()
+
+    @staticmethod
+    def can_batch(content: ContentRoute) -> bool:
+        return content.content_type not in NOT_BATCHED_TYPES and not content.caption_too_long
+
+    async def relay(
+            self,
+            bot: Bot,
+            message: Message,
+            content: ContentRoute,
+            forum_chat_id: int,
+            topic_id: int,
+            copy_one: CopyOne,
+    ) -> CopyResult:
+        user_id = message.chat.id
+        batch = self.batches.get(user_id)
+        if batch is not None:
+            batch.entries.append((message, content))
+            if len(batch.entries) >= self.max_size:
+                del self.batches[user_id]
+                batch.full.set()
+            # Waiting on the future directly would cancel it together with this handler
+            await asyncio.wait([batch.relayed])
+            if batch.relayed.result():
+                return list()
+            return await copy_one(message, content)
+
+        batch = PendingBatch(topic_id, message, content)
+        self.batches[user_id] = batch
+        previous = self.sending.get(user_id)
+        self.sending[user_id] = batch.relayed
+        try:
+            try:
+                await asyncio.wait_for(batch.full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            if self.batches.get(user_id) is batch:
+                del self.batches[user_id]
+            if previous is not None:
+                await asyncio.wait([previous])
+            if len(batch.entries) == 1:
+                message_connections = await copy_one(message, content)
+                batch.relayed.set_result(True)
+                return message_connections
+
+            # Updates are handled concurrently, so messages may have joined batch in any order
+            batch.entries.sort(key=lambda entry: entry[0].message_id)
+            message_connections = await self.copy(bot, batch, user_id, forum_chat_id)
+            if message_connections is None:
+                failed_batches_counter.inc()
+                message_connections = await self.copy_one_by_one(batch, copy_one)
+            batch.relayed.set_result(True)
+            return message_connections
+        finally:
+            if not batch.relayed.done():
+                batch.relayed.set_result(False)
+            if self.sending.get(user_id) is batch.relayed:
+                del self.sending[user_id]
+
+    async def flush(self, user_id: int):
+        """
+        Closes pending batch of user and waits until it's copied, so that a message
+        which can't be batched doesn't go before earlier messages of the same user
+        """
+        batch = self.batches.pop(user_id, None)
+        if batch is not None:
+            batch.full.set()
+        sending = self.sending.get(user_id)
+        if sending is not None:
+            await asyncio.wait([sending])
+
+    @staticmethod
+    async def copy(
+            bot: Bot,
+            batch: PendingBatch,
+            user_id: int,
+            forum_chat_id: int,
+    ) -> list[MessageConnectionFeedback] | None:
+        messages = [message for message, _ in batch.entries]
+        try:
+            copies = await bot.copy_messages(
+                chat_id=forum_chat_id,
+                from_chat_id=user_id,
+                message_ids=[message.message_id for message in messages],
+                message_thread_id=batch.topic_id,
+            )
+        except TelegramAPIError:
+            await logger.awarning(
+                "Failed to copy batch of messages from private chat to forum group, copying them one by one",
+                exc_info=True,
+                messages=len(messages),
+            )
+            return None
+
+        if len(copies) != len(messages):
+            # Bot API skips messages which can't be copied, so it's unknown which copy belongs to which message.
+            # Copying them again shows some of them twice, but makes every one of them answerable
+            await logger.aerror(
+                "Not all messages of batch were copied, copying them one by one",
+                messages=len(messages),
+                copies=len(copies),
+            )
+            return None
+
+        batches_counter.inc()
+        batched_messages_counter.inc(len(messages))
+        return [
+            MessageConnectionFeedback(
+                from_chat_id=user_id,
+                from_message_id=message.message_id,
+                to_chat_id=forum_chat_id,
+                to_message_id=copy.message_id,
+                message_date=message.date,
+            )
+            for message, copy in zip(messages, copies)
+        ]
+
+    @staticmethod
+    async def copy_one_by_one(batch: PendingBatch, copy_one: CopyOne) -> list[MessageConnectionFeedback]:
+        # Sequentially from one handler, so that copies keep the order of originals
+        message_connections: list[MessageConnectionFeedback] = list()
+        for message, content in batch.entries:
+            result = await copy_one(message, content)
+            if isinstance(result, MessageConnectionFeedback):
+                message_connections.append(result)
+            elif result:
+                message_connections.extend(result)
+        return message_connections
@@ -0,0 +1,235 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+
+import structlog
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import StatsConfig
+from bot.db.backends import get_backend
+from bot.db.models import DailyStats, HourlyStats, UserStats
+from bot.handlers_feedback import MessageConnectionFeedback
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+
+@dataclass(slots=True)
+class PendingUserActivity:
+    messages_from_user: int
+    messages_to_user: int
+    first_seen: datetime
+    last_activity: datetime
+
+
+class StatsAggregator:
+    """
+    Accumulates activity counters of one bot in memory and periodically adds them to aggregate tables
+    (per user, per day and per hour) in one transaction, so reading stats never needs
+    to count rows in messages table.
+    """
+
+    def __init__(
+            self,
+            session_pool: async_sessionmaker,
+            stats_config: StatsConfig,
+            bot_id: int,
+    ):
+        self.session_pool = session_pool
+        self.config = stats_config
+        self.bot_id = bot_id
+        self.users: dict[int, PendingUserActivity] = dict()
+        # [messages from users, messages to users] for every hour
+        self.hours: dict[datetime, list[int]] = dict()
+        # Same for every day, and which users were active on that day
+        self.days: dict[date, list[int]] = dict()
+        self.active_days: dict[date, set[int]] = dict()
+        self.pending = 0
+        self.flush_requested = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def record(self, message_connection: MessageConnectionFeedback):
+        # Private chat id is the same as user id and is always positive,
+        # while forum chat id is always negative.
+        # Days and hours are in UTC, same as created_at.
+        from_user = message_connection.from_chat_id > 0
+        if from_user:
+            user_id = message_connection.from_chat_id
+        else:
+            user_id = message_connection.to_chat_id
+        moment = message_connection.created_at
+
+        activity = self.users.get(user_id)
+        if activity is None:
+            activity = PendingUserActivity(0, 0, moment, moment)
+            self.users[user_id] = activity
+        activity.last_activity = moment
+        hour_counters = self.hours.setdefault(moment.replace(minute=0, second=0, microsecond=0), [0, 0])
+        day_counters = self.days.setdefault(moment.date(), [0, 0])
+        if from_user:
+            activity.messages_from_user += 1
+            hour_counters[0] += 1
+            day_counters[0] += 1
+        else:
+            activity.messages_to_user += 1
+            hour_counters[1] += 1
+            day_counters[1] += 1
+        self.active_days.setdefault(moment.date(), set()).add(user_id)
+
+        self.pending += 1
+        if self.pending >= self.config.flush_size:
+            self.flush_requested.set()
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await self.flush()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), timeout=self.config.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            await self.flush()
+
+    async def flush(self):
+        if self.pending == 0:
+            return
+        users, hours, days, active_days = self.users, self.hours, self.days, self.active_days
+        self.users, self.hours, self.days, self.active_days = dict(), dict(), dict(), dict()
+        pending, self.pending = self.pending, 0
+
+        try:
+            async with self.session_pool() as session:
+                # Must be done before updating last activity of users
+                daily_counters = await self.count_daily(session, days, active_days)
+                await self.save_users(session, users)
+                await self.save_days(session, daily_counters)
+                await self.save_hours(session, hours)
+                await session.commit()
+            await logger.adebug("Saved activity stats", users=len(users), hours=len(hours))
+        except asyncio.CancelledError:
+            # Stopped in the middle of flush, these counters are saved by the final one
+            self.restore(users, hours, days, active_days, pending)
+            raise
+        except Exception:
+            self.restore(users, hours, days, active_days, pending)
+            await logger.aexception("Failed to save activity stats, will retry with the next flush")
+
+    def restore(
+            self,
+            users: dict[int, PendingUserActivity],
+            hours: dict[datetime, list[int]],
+            days: dict[date, list[int]],
+            active_days: dict[date, set[int]],
+            pending: int,
+    ):
+        # Counters which failed to be saved are merged with those recorded since then
+        for user_id, activity in users.items():
+            newer = self.users.get(user_id)
+            if newer is None:
+                self.users[user_id] = activity
+            else:
+                newer.messages_from_user += activity.messages_from_user
+                newer.messages_to_user += activity.messages_to_user
+                newer.first_seen = activity.first_seen
+        for counters, saved_counters in ((self.hours, hours), (self.days, days)):
+            for key, values in saved_counters.items():
+                current = counters.setdefault(key, [0, 0])
+                current[0] += values[0]
+                current[1] += values[1]
+        for day, user_ids in active_days.items():
+            self.active_days.setdefault(day, set()).update(user_ids)
+        self.pending += pending
+
+    async def count_daily(
+            self,
+            session: AsyncSession,
+            days: dict[date, list[int]],
+            active_days: dict[date, set[int]],
+    ) -> dict[date, list[int]]:
+        # [active users, messages from users, messages to users] for every day
+        daily_counters: dict[date, list[int]] = dict()
+        for day, user_ids in active_days.items():
+            # Users whose last saved activity is on this day were already counted as active
+            day_start = datetime.combine(day, time(), tzinfo=timezone.utc)
+            already_active = await session.scalars(
+                select(UserStats.user_id)
+                .where(UserStats.bot_id == self.bot_id, UserStats.user_id.in_(user_ids))
+                .where(UserStats.last_activity >= day_start)
+                .where(UserStats.last_activity < day_start + timedelta(days=1))
+            )
+            daily_counters[day] = [len(user_ids - set(already_active.all())), *days[day]]
+        return daily_counters
+
+    async def save_users(self, session: AsyncSession, users: dict[int, PendingUserActivity]):
+        backend = get_backend(session.bind.dialect.name)
+        query = backend.insert(UserStats).values([
+            {
+                "bot_id": self.bot_id,
+                "user_id": user_id,
+                "messages_from_user": activity.messages_from_user,
+                "messages_to_user": activity.messages_to_user,
+                "first_seen": activity.first_seen,
+                "last_activity": activity.last_activity,
+            }
+            for user_id, activity in users.items()
+        ])
+        query = query.on_conflict_do_update(
+            index_elements=[UserStats.bot_id, UserStats.user_id],
+            set_={
+                "messages_from_user": UserStats.messages_from_user + query.excluded.messages_from_user,
+                "messages_to_user": UserStats.messages_to_user + query.excluded.messages_to_user,
+                "last_activity": backend.greatest(UserStats.last_activity, query.excluded.last_activity),
+            },
+        )
+        await session.execute(query)
+
+    async def save_days(self, session: AsyncSession, daily_counters: dict[date, list[int]]):
+        backend = get_backend(session.bind.dialect.name)
+        query = backend.insert(DailyStats).values([
+            {
+                "bot_id": self.bot_id,
+                "day": day,
+                "active_users": counters[0],
+                "messages_from_users": counters[1],
+                "messages_to_users": counters[2],
+            }
+            for day, counters in daily_counters.items()
+        ])
+        query = query.on_conflict_do_update(
+            index_elements=[DailyStats.bot_id, DailyStats.day],
+            set_={
+                "active_users": DailyStats.active_users + query.excluded.active_users,
+                "messages_from_users": DailyStats.messages_from_users + query.excluded.messages_from_users,
+                "messages_to_users": DailyStats.messages_to_users + query.excluded.messages_to_users,
+            },
+        )
+        await session.execute(query)
+
+    async def save_hours(self, session: AsyncSession, hours: dict[datetime, list[int]]):
+        backend = get_backend(session.bind.dialect.name)
+        query = backend.insert(HourlyStats).values([
+            {
+                "bot_id": self.bot_id,
+                "hour": hour,
+                "messages_from_users": counters[0],
+                "messages_to_users": counters[1],
+            }
+            for hour, counters in hours.items()
+        ])
+        query = query.on_conflict_do_update(
+            index_elements=[HourlyStats.bot_id, HourlyStats.hour],
+            set_={
+                "messages_from_users": HourlyStats.messages_from_users + query.excluded.messages_from_users,
+                "messages_to_users": HourlyStats.messages_to_users + query.excluded.messages_to_users,
+            },
+        )
+        await session.execute(query)
@@ -0,0 +1,64 @@
+import asyncio
+import signal
+
+import structlog
+from aiogram import Bot, Dispatcher
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import get_optional_config, HttpConfig, MultiTenantConfig
+from bot.dispatcher import create_dispatcher, create_shared_resources
+from bot.http_session import TunedAiohttpSession, get_api_server
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+
+async def run_tenants(multi_tenant_config: MultiTenantConfig):
+    """
+    Serves several bots in one process. Every bot has its own dispatcher with its own routers,
+    forum chat, localization and caches, while database engine with its connection pool,
+    HTTP session for Bot API and everything else which doesn't depend on a bot are shared.
+    Rows of different bots are told apart by bot id, so all of them can use the same database.
+    """
+    http_config: HttpConfig = get_optional_config(model=HttpConfig, root_key="http")
+    if http_config.connection_limit <= len(multi_tenant_config.bots):
+        # Each bot holds one connection for long polling, and others are needed to send messages
+        error = (
+            f"HTTP connection limit ({http_config.connection_limit}) must be greater than "
+            f"the number of bots ({len(multi_tenant_config.bots)})"
+        )
+        raise ValueError(error)
+    http_session = TunedAiohttpSession(http_config, api=get_api_server(multi_tenant_config))
+    bots = [
+        Bot(tenant.token.get_secret_value(), session=http_session)
+        for tenant in multi_tenant_config.bots
+    ]
+
+    resources = await create_shared_resources(http_session)
+    dispatchers: list[Dispatcher] = list()
+    for bot, tenant in zip(bots, multi_tenant_config.bots):
+        dispatchers.append(await create_dispatcher(bot, tenant=tenant, resources=resources))
+
+    await resources.start()
+    try:
+        polling = [
+            asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+            for bot, dp in zip(bots, dispatchers)
+        ]
+        # Dispatchers can only handle signals one at a time, so all of them are stopped from here
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stopping.set)
+
+        await logger.ainfo("Starting polling...", bots=[bot.id for bot in bots])
+        stopping_task = asyncio.create_task(stopping.wait())
+        await asyncio.wait([*polling, stopping_task], return_when=asyncio.FIRST_COMPLETED)
+        stopping_task.cancel()
+        # If polling of one bot has failed, the others are stopped too
+        await asyncio.gather(*(dp.stop_polling() for dp in dispatchers), return_exceptions=True)
+        await asyncio.gather(*polling)
+    finally:
+        try:
+            await resources.stop()
+        finally:
+            await http_session.close()
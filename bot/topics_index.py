@@ -0,0 +1,51 @@
+from cachetools import LRUCache
+
+from bot.metrics import registry
+
+hits_counter = registry.counter(
+    "topics_index_hits_total",
+    "Topic and user lookups answered from in-memory index",
+)
+misses_counter = registry.counter(
+    "topics_index_misses_total",
+    "Topic and user lookups which had to go to database",
+)
+
+
+class TopicsIndex:
+    """
+    In-memory index of links between users and their topics, in both directions.
+    Only found links are kept: a link never changes once topic is created, while a user
+    without topic will have one after the first message. Filled by lookups, by created topics
+    and by warm-up on startup, least recently used links are evicted.
+    """
+
+    def __init__(self, maxsize: int):
+        self.by_user = LRUCache(maxsize=maxsize)
+        self.by_topic = LRUCache(maxsize=maxsize)
+
+    def add(self, user_id: int, topic_id: int):
+        self.by_user[user_id] = topic_id
+        self.by_topic[topic_id] = user_id
+
+    def add_loaded(self, user_id: int, topic_id: int):
+        # Links loaded on startup come from the newest to the oldest and must not replace newer ones,
+        # including those which were added by lookups while loading
+        if user_id not in self.by_user:
+            self.by_user[user_id] = topic_id
+        if topic_id not in self.by_topic:
+            self.by_topic[topic_id] = user_id
+
+    def find_topic_id(self, user_id: int) -> int | None:
+        return self.count(self.by_user.get(user_id))
+
+    def find_user_id(self, topic_id: int) -> int | None:
+        return self.count(self.by_topic.get(topic_id))
+
+    @staticmethod
+    def count(found: int | None) -> int | None:
+        if found is None:
+            misses_counter.inc()
+        else:
+            hits_counter.inc()
+        return found
@@ -0,0 +1,360 @@
+import asyncio
+import json
+import os
+import random
+import secrets
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from time import time_ns
+from typing import Any, Awaitable, Callable, Dict, Iterator
+
+import structlog
+from aiogram import BaseMiddleware, Bot, Router
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.dispatcher.middlewares.manager import MiddlewareManager
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+from aiohttp import ClientError, ClientSession
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import TracingConfig
+from bot.metrics import registry
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+kept_traces_counter = registry.counter(
+    "traces_kept_total",
+    "Traces of updates which were slow, failed or sampled at random, and were exported",
+)
+
+current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+
+class SpanKind(IntEnum):
+    # Same values as in OTLP
+    INTERNAL = 1
+    SERVER = 2
+    CLIENT = 3
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans", "finished")
+
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans: list[Span] = list()
+        self.finished = False
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "error")
+
+    def __init__(self, trace: Trace, parent_id: str | None, name: str, kind: SpanKind, attributes: dict):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time_ns()
+        self.end: int | None = None
+        self.attributes = attributes
+        self.error: str | None = None
+        trace.spans.append(self)
+
+    def finish(self, error: BaseException | None = None):
+        self.end = time_ns()
+        if error is not None:
+            self.error = repr(error)
+
+
+def start_span(name: str, kind: SpanKind = SpanKind.INTERNAL, **attributes: Any) -> Span | None:
+    # Spans are only recorded inside root span of an update
+    parent = current_span.get()
+    if parent is None or parent.trace.finished:
+        return None
+    return Span(parent.trace, parent.span_id, name, kind, attributes)
+
+
+@contextmanager
+def span(name: str, kind: SpanKind = SpanKind.INTERNAL, **attributes: Any) -> Iterator[Span | None]:
+    child = start_span(name, kind, **attributes)
+    if child is None:
+        yield None
+        return
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException as ex:
+        child.finish(ex)
+        raise
+    else:
+        child.finish()
+    finally:
+        current_span.reset(token)
+
+
+def encode_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def encode_span(span: Span) -> dict:
+    # OTLP JSON encoding: ids are hex strings, times are nanoseconds as strings
+    encoded = {
+        "traceId": span.trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": int(span.kind),
+        "startTimeUnixNano": str(span.start),
+        "endTimeUnixNano": str(span.end or span.start),
+        "attributes": [{"key": key, "value": encode_value(value)} for key, value in span.attributes.items()],
+    }
+    if span.parent_id is not None:
+        encoded["parentSpanId"] = span.parent_id
+    if span.error is not None:
+        encoded["status"] = {"code": 2, "message": span.error}
+    return encoded
+
+
+class TraceExporter:
+    """
+    Writes kept traces to a file and/or sends them to OpenTelemetry collector (OTLP/HTTP with JSON),
+    in batches from a background task, so that handling of updates never waits for it.
+    """
+
+    def __init__(self, tracing_config: TracingConfig):
+        self.config = tracing_config
+        self.resource = {
+            "attributes": [
+                {"key": "service.name", "value": {"stringValue": tracing_config.service_name}},
+                {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            ],
+        }
+        self.pending: list[dict] = list()
+        self.task: asyncio.Task | None = None
+        self.http: ClientSession | None = None
+
+    def export(self, trace: Trace):
+        self.pending.append({
+            "resourceSpans": [{
+                "resource": self.resource,
+                "scopeSpans": [{
+                    "scope": {"name": "bot.tracing"},
+                    "spans": [encode_span(span) for span in trace.spans],
+                }],
+            }],
+        })
+
+    async def start(self):
+        if self.config.otlp_endpoint is not None:
+            self.http = ClientSession()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await self.flush()
+        if self.http is not None:
+            await self.http.close()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.config.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, list()
+        if self.config.output_file:
+            try:
+                await asyncio.to_thread(self.write, batch)
+            except OSError:
+                await logger.aexception("Failed to write traces", path=self.config.output_file)
+        if self.http is not None:
+            # All traces of a batch are sent in one request
+            payload = {"resourceSpans": [item for trace in batch for item in trace["resourceSpans"]]}
+            try:
+                async with self.http.post(self.config.otlp_endpoint, json=payload) as response:
+                    if response.status >= 400:
+                        await logger.aerror("Collector rejected traces", status=response.status)
+            except (ClientError, asyncio.TimeoutError):
+                await logger.aexception("Failed to send traces", endpoint=self.config.otlp_endpoint)
+
+    def write(self, batch: list[dict]):
+        # One write per batch in append mode, so that lines of several worker processes don't mix
+        data = "".join(json.dumps(trace, separators=(",", ":")) + "\n" for trace in batch)
+        with open(self.config.output_file, "a") as file:
+            file.write(data)
+
+
+class Tracer:
+    """
+    Records spans of every update: the update itself, middlewares, handlers, database queries
+    and commits, Bot API calls. Spans are only created inside a root span, which is started
+    for every update, and are passed between them with context variable.
+    Which traces to keep is decided when the whole update is handled (tail sampling):
+    only slow ones, failed ones and a random share of others are exported.
+    """
+
+    def __init__(self, tracing_config: TracingConfig, exporter: TraceExporter):
+        self.config = tracing_config
+        self.exporter = exporter
+
+    @contextmanager
+    def root_span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        trace = Trace()
+        span = Span(trace, None, name, SpanKind.SERVER, attributes)
+        token = current_span.set(span)
+        try:
+            with structlog.contextvars.bound_contextvars(trace_id=trace.trace_id):
+                yield span
+        except BaseException as ex:
+            span.finish(ex)
+            raise
+        else:
+            span.finish()
+        finally:
+            current_span.reset(token)
+            trace.finished = True
+            self.sample(trace, span)
+
+    def sample(self, trace: Trace, root: Span):
+        duration = (root.end - root.start) / 1e9
+        failed = any(span.error is not None for span in trace.spans)
+        if duration >= self.config.slow_threshold or failed or random.random() < self.config.sample_rate:
+            kept_traces_counter.inc()
+            self.exporter.export(trace)
+
+    def instrument_engine(self, engine: AsyncEngine):
+        # Cursor events are used, so that Core statements executed on session's connection are seen too
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", self.after_cursor_execute)
+        event.listen(sync_engine, "handle_error", self.handle_error)
+
+    def before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        span = start_span(
+            "db query",
+            SpanKind.CLIENT,
+            **{
+                "db.system": connection.dialect.name,
+                "db.statement": statement[:self.config.max_statement_length],
+            },
+        )
+        if context is not None:
+            context._tracing_span = span
+
+    @staticmethod
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        span = getattr(context, "_tracing_span", None)
+        if span is not None:
+            span.finish()
+
+    @staticmethod
+    def handle_error(exception_context):
+        span = getattr(exception_context.execution_context, "_tracing_span", None)
+        if span is not None:
+            span.finish(exception_context.original_exception)
+
+
+def instrument_router(router: Router):
+    # Every middleware (including those of nested routers) gets its own span,
+    # and handler gets a span with its name
+    for nested_router in router.chain_tail:
+        for event_name, observer in nested_router.observers.items():
+            wrap_middlewares(observer.outer_middleware)
+            wrap_middlewares(observer.middleware)
+            # Handler of updates only passes them to routers, which is already covered by spans of their middlewares
+            if event_name != "update" and observer.handlers:
+                observer.middleware.register(HandlerTracingMiddleware(observer.handlers))
+
+
+def wrap_middlewares(manager: MiddlewareManager):
+    middlewares = list(manager)
+    for middleware in middlewares:
+        manager.unregister(middleware)
+    for middleware in middlewares:
+        if not isinstance(middleware, TracingMiddleware):
+            middleware = MiddlewareSpan(middleware)
+        manager.register(middleware)
+
+
+class TracingMiddleware(BaseMiddleware):
+    # Starts root span of update, must be registered as outer update middleware before all others
+    def __init__(self, tracer: Tracer):
+        super().__init__()
+        self.tracer = tracer
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any],
+    ) -> Any:
+        with self.tracer.root_span(f"update {event.event_type}", update_id=event.update_id):
+            return await handler(event, data)
+
+
+class MiddlewareSpan:
+    def __init__(self, middleware: Callable):
+        self.middleware = middleware
+        self.name = f"middleware {type(middleware).__name__}"
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        with span(self.name):
+            return await self.middleware(handler, event, data)
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    # Inner middlewares of a router are also applied to handlers of its nested routers,
+    # so span is only started for handlers of its own router, after all other middlewares
+    def __init__(self, handlers: list[HandlerObject]):
+        super().__init__()
+        self.handlers = handlers
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        handler_object: HandlerObject | None = data.get("handler")
+        if handler_object is None or not any(handler_object is own for own in self.handlers):
+            return await handler(event, data)
+        with span(f"handler {handler_object.callback.__qualname__}"):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        with span(f"bot api {method.__api_method__}", SpanKind.CLIENT):
+            return await make_request(bot, method)
+
+
+class TracedAsyncSession(AsyncSession):
+    # Queries are traced with engine events, but commit waits for server and is worth its own span
+    async def commit(self) -> None:
+        with span("db commit", SpanKind.CLIENT):
+            await super().commit()
@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+
+import structlog
+from sqlalchemy import or_, select, union
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import WarmUpConfig
+from bot.db.queries import StoredPair, messages, pair_columns, topics
+from bot.recent_pairs import RecentPairsIndex
+from bot.topics_index import TopicsIndex
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+
+class RoutingWarmUp:
+    """
+    Loads topics and message pairs of recently active users into in-memory indexes on startup,
+    so that the first message of every active user after restart doesn't wait for database
+    (this also brings the same rows into cache of database server).
+
+    Runs in background while the bot already handles updates. Until it's ready, lookups
+    simply miss the indexes and go to database as usual. Only as many rows as indexes can hold
+    are loaded, the newest ones.
+    """
+
+    def __init__(
+            self,
+            session_pool: async_sessionmaker,
+            warm_up_config: WarmUpConfig,
+            bot_id: int,
+            pairs_index: RecentPairsIndex,
+            topics_index: TopicsIndex,
+    ):
+        self.session_pool = session_pool
+        self.bot_id = bot_id
+        self.config = warm_up_config
+        self.pairs_index = pairs_index
+        self.topics_index = topics_index
+        self.ready = False
+        self.task: asyncio.Task | None = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def run(self):
+        started = monotonic()
+        since = datetime.now(timezone.utc) - timedelta(seconds=self.config.window)
+        try:
+            pairs = await self.load_pairs(since)
+            topics_count = await self.load_topics(since)
+        except Exception:
+            await logger.aexception("Warm-up failed, lookups will go to database")
+            return
+        self.ready = True
+        await logger.ainfo(
+            "Warm-up finished",
+            pairs=pairs,
+            topics=topics_count,
+            duration=round(monotonic() - started, 2),
+        )
+
+    async def load_pairs(self, since: datetime) -> int:
+        # Pairs added by handled updates in the meantime are newer and must not be evicted
+        limit = max(self.pairs_index.by_copy.maxsize - len(self.pairs_index.by_copy), 0)
+        query = (
+            select(*pair_columns)
+            .where(messages.c.bot_id == self.bot_id, messages.c.created_at >= since)
+            .order_by(messages.c.created_at.desc())
+            .limit(limit)
+            .execution_options(yield_per=self.config.batch_size)
+        )
+        loaded = 0
+        async with self.session_pool() as session:
+            connection = await session.connection()
+            rows = await connection.stream(query)
+            async for batch in rows.partitions():
+                for row in batch:
+                    self.pairs_index.add(StoredPair(*row))
+                loaded += len(batch)
+        return loaded
+
+    async def load_topics(self, since: datetime) -> int:
+        # Users who wrote or were answered within window, plus those whose topics were created then.
+        # Private chat id is the same as user id and is always positive, forum chat id is negative
+        recent_messages = (messages.c.bot_id == self.bot_id, messages.c.created_at >= since)
+        active_users = union(
+            select(messages.c.from_chat_id).where(*recent_messages, messages.c.from_chat_id > 0),
+            select(messages.c.to_chat_id).where(*recent_messages, messages.c.to_chat_id > 0),
+        ).subquery()
+        query = (
+            select(topics.c.user_id, topics.c.topic_id)
+            .where(topics.c.bot_id == self.bot_id)
+            .where(or_(
+                topics.c.created_at >= since,
+                topics.c.user_id.in_(select(active_users.c.from_chat_id)),
+            ))
+            .order_by(topics.c.created_at.desc())
+            .limit(max(self.topics_index.by_user.maxsize - len(self.topics_index.by_user), 0))
+            .execution_options(yield_per=self.config.batch_size)
+        )
+        loaded = 0
+        async with self.session_pool() as session:
+            connection = await session.connection()
+            rows = await connection.stream(query)
+            async for batch in rows.partitions():
+                for user_id, topic_id in batch:
+                    self.topics_index.add_loaded(user_id, topic_id)
+                loaded += len(batch)
+        return loaded
@@ -0,0 +1,461 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+from collections import deque
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from multiprocessing.reduction import ForkingPickler
+from typing import Any
+
+import structlog
+from aiogram import Bot, Dispatcher
+from aiohttp import ClientError, ClientSession, ClientTimeout
+from structlog.types import FilteringBoundLogger
+
+from bot.config_reader import (
+    get_config, get_optional_config,
+    BotConfig, EventLoopConfig, HttpConfig, LogConfig, MetricsConfig, PairFileConfig,
+)
+from bot.db.queries import StoredPair
+from bot.dispatcher import create_dispatcher
+from bot.event_loop import run
+from bot.http_session import TunedAiohttpSession, get_api_server
+from bot.logs import get_structlog_config
+from bot.metrics import MetricsRegistry, registry, start_metrics_server
+from bot.pair_file import PairFile
+
+logger: FilteringBoundLogger = structlog.get_logger()
+
+updates_counter = registry.counter(
+    "supervisor_updates_total",
+    "Updates received by supervisor and handed off to workers",
+)
+dropped_commands_counter = registry.counter(
+    "pipe_dropped_commands_total",
+    "Commands between supervisor and workers dropped because the other side was too far behind",
+)
+
+POLLING_TIMEOUT = 30
+METRICS_INTERVAL = 5
+SHUTDOWN_TIMEOUT = 30
+# Commands waiting to be written to one pipe, above it supervisor stops getting updates and metrics are dropped
+MAX_QUEUED_COMMANDS = 1000
+# Commands which may be lost: metrics are sent again anyway, and pairs missing in pair file are found in database
+DROPPABLE_COMMANDS = {"metrics", "pairs_created"}
+
+
+def get_topic_worker_index(topic_id: int, workers: int) -> int:
+    return topic_id % workers
+
+
+def get_worker_index(raw_update: dict, workers: int) -> int:
+    """
+    Picks worker for an update, so that all updates of one private chat (i.e. one user)
+    and all updates of one forum topic are always handled by the same process.
+    This keeps topic creation for a user in one process and the order of updates the same
+    as in single-process mode.
+    """
+    message = raw_update.get("message") or raw_update.get("edited_message")
+    if message is None:
+        return 0
+    if message["chat"]["type"] == "private":
+        return message["chat"]["id"] % workers
+    if message.get("is_topic_message"):
+        return get_topic_worker_index(message["message_thread_id"], workers)
+    # General topic, where commands like /broadcast are sent. Broadcasts are run by primary worker.
+    return 0
+
+
+class PipeSender:
+    """
+    Writes commands to one end of a pipe without blocking event loop. What doesn't fit into the pipe
+    is queued and written when it becomes writable again. With blocking writes, supervisor and a worker
+    could both wait for each other to read, and neither of them would.
+
+    Framing is the same as in Connection.send(), so the other side reads with Connection.recv() as usual.
+    Metrics carry the whole registry, so only the latest queued report is kept. When the queue is full,
+    metrics and pairs are dropped, other commands are always queued.
+    """
+
+    def __init__(self, connection: Connection, peer: str):
+        self.peer = peer
+        # Pipe is a socket pair. Writes are non-blocking with a flag, so reads of the same socket stay blocking
+        self.socket = socket.socket(fileno=os.dup(connection.fileno()))
+        self.queue: deque[tuple[str, memoryview]] = deque()
+        # Bytes of the first queued command which are already written
+        self.offset = 0
+        self.writing = False
+        self.broken = False
+        self.drained = asyncio.Event()
+        self.drained.set()
+
+    @property
+    def full(self) -> bool:
+        return len(self.queue) >= MAX_QUEUED_COMMANDS
+
+    def send(self, command: str, payload: Any = None):
+        if self.broken:
+            return
+        if command in DROPPABLE_COMMANDS and self.full:
+            dropped_commands_counter.inc()
+            return
+        if command == "metrics":
+            # Older report which isn't being written yet is replaced by this one
+            for i in range(1 if self.offset else 0, len(self.queue)):
+                if self.queue[i][0] == command:
+                    del self.queue[i]
+                    break
+
+        data = ForkingPickler.dumps((command, payload))
+        if len(data) > 0x7fffffff:
+            header = struct.pack("!iQ", -1, len(data))
+        else:
+            header = struct.pack("!i", len(data))
+        self.queue.append((command, memoryview(header + data)))
+        self.drained.clear()
+        self.write()
+
+    def write(self):
+        while self.queue:
+            command, frame = self.queue[0]
+            try:
+                self.offset += self.socket.send(frame[self.offset:], socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            except OSError:
+                logger.error("Failed to send command", command=command, peer=self.peer)
+                self.broken = True
+                self.queue.clear()
+                break
+            if self.offset == len(frame):
+                self.queue.popleft()
+                self.offset = 0
+
+        loop = asyncio.get_running_loop()
+        if self.queue and not self.writing:
+            loop.add_writer(self.socket.fileno(), self.write)
+            self.writing = True
+        elif not self.queue:
+            if self.writing:
+                loop.remove_writer(self.socket.fileno())
+                self.writing = False
+            self.drained.set()
+
+    async def drain(self):
+        await self.drained.wait()
+
+    def close(self):
+        if self.writing:
+            asyncio.get_running_loop().remove_writer(self.socket.fileno())
+            self.writing = False
+        self.socket.close()
+
+
+class Supervisor:
+    """
+    Gets updates from Telegram and hands them off to worker processes without parsing.
+    Each worker has its own dispatcher and database engine, so update parsing, filters, handlers
+    and logging are spread between CPU cores.
+
+    Shared listening socket (SO_REUSEPORT) is not used: the bot uses long polling, where only one
+    getUpdates consumer is allowed, and the kernel would balance connections, not users,
+    so messages of one user could be handled by several processes at once.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.processes: list[BaseProcess] = list()
+        self.connections: list[Connection] = list()
+        self.senders: list[PipeSender] = list()
+        self.worker_metrics: dict[int, MetricsRegistry] = dict()
+        self.ready_workers: set[int] = set()
+        self.allowed_updates: list[str] | None = None
+        self.pair_file: PairFile | None = None
+        self.ready = asyncio.Event()
+        self.stopping = asyncio.Event()
+
+    async def run(self):
+        log_config: LogConfig = get_config(model=LogConfig, root_key="logs")
+        structlog.configure(**get_structlog_config(log_config))
+        bot_config: BotConfig = get_config(model=BotConfig, root_key="bot")
+        pair_file_config: PairFileConfig = get_optional_config(model=PairFileConfig, root_key="pair_file")
+        if pair_file_config.enabled:
+            # Supervisor is the only writer, workers open the file read-only, so it must exist before them
+            self.pair_file = PairFile.create(pair_file_config.path, pair_file_config.capacity)
+
+        loop = asyncio.get_running_loop()
+        # Workers are started from scratch, so that they don't inherit supervisor's event loop and sockets
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.workers):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=run_worker,
+                args=(index, worker_connection),
+                name=f"worker-{index}",
+            )
+            process.start()
+            worker_connection.close()
+            self.processes.append(process)
+            self.connections.append(connection)
+            self.senders.append(PipeSender(connection, peer=process.name))
+            loop.add_reader(connection.fileno(), self.receive, index)
+
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, self.stopping.set)
+        # Profiler runs in every worker
+        loop.add_signal_handler(signal.SIGUSR1, self.forward_signal, signal.SIGUSR1)
+
+        await self.wait_for(self.ready)
+        if not self.stopping.is_set():
+            metrics_config: MetricsConfig = get_optional_config(model=MetricsConfig, root_key="metrics")
+            if metrics_config.enabled:
+                await start_metrics_server(metrics_config, render=self.render_metrics)
+
+            await logger.ainfo("Starting polling...", workers=self.workers)
+            api_server = get_api_server(bot_config)
+            polling = asyncio.create_task(self.poll(
+                api_server.api_url(token=bot_config.token.get_secret_value(), method="getUpdates"),
+            ))
+            await self.stopping.wait()
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+
+        await self.stop()
+
+    async def wait_for(self, event: asyncio.Event):
+        # Returns early if supervisor is stopped, e.g. because a worker failed to start
+        waiters = [asyncio.create_task(event.wait()), asyncio.create_task(self.stopping.wait())]
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        for waiter in waiters:
+            waiter.cancel()
+
+    async def stop(self):
+        await logger.ainfo("Stopping workers...")
+        for sender, process in zip(self.senders, self.processes):
+            if process.is_alive():
+                sender.send("stop")
+        for process in self.processes:
+            await asyncio.to_thread(process.join, SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                await logger.aerror("Worker did not stop in time", worker=process.name)
+                process.terminate()
+
+        loop = asyncio.get_running_loop()
+        for connection, sender in zip(self.connections, self.senders):
+            loop.remove_reader(connection.fileno())
+            sender.close()
+            connection.close()
+        if self.pair_file is not None:
+            self.pair_file.close()
+
+    def forward_signal(self, signal_number: int):
+        for process in self.processes:
+            if process.is_alive():
+                os.kill(process.pid, signal_number)
+
+    async def poll(self, url: str):
+        params: dict[str, Any] = {
+            "timeout": POLLING_TIMEOUT,
+            "allowed_updates": self.allowed_updates,
+        }
+        backoff = 1
+        async with ClientSession(timeout=ClientTimeout(total=POLLING_TIMEOUT + 10)) as http:
+            while True:
+                try:
+                    async with http.post(url, json=params) as response:
+                        result = await response.json()
+                except (ClientError, asyncio.TimeoutError, ValueError):
+                    await logger.aexception("Failed to get updates", retry_in=backoff)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+                    continue
+
+                if not result.get("ok"):
+                    await logger.aerror("Failed to get updates", error=result.get("description"), retry_in=backoff)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+                    continue
+                backoff = 1
+
+                updates: list[dict] = result["result"]
+                if updates:
+                    params["offset"] = updates[-1]["update_id"] + 1
+                    self.dispatch(updates)
+                # When a worker is too far behind, new updates wait in Telegram
+                for sender in self.senders:
+                    if sender.full:
+                        await sender.drain()
+
+    def dispatch(self, updates: list[dict]):
+        batches: list[list[dict]] = [list() for _ in range(self.workers)]
+        for raw_update in updates:
+            batches[get_worker_index(raw_update, self.workers)].append(raw_update)
+        for sender, batch in zip(self.senders, batches):
+            if batch:
+                sender.send("updates", batch)
+        updates_counter.inc(len(updates))
+
+    def receive(self, index: int):
+        connection = self.connections[index]
+        while connection.poll():
+            try:
+                command, payload = connection.recv()
+            except EOFError:
+                asyncio.get_running_loop().remove_reader(connection.fileno())
+                if not self.stopping.is_set():
+                    logger.error("Worker exited unexpectedly, stopping", worker=index)
+                    self.stopping.set()
+                return
+
+            if command == "ready":
+                self.ready_workers.add(index)
+                if index == 0:
+                    self.allowed_updates = payload
+                if len(self.ready_workers) == self.workers:
+                    self.ready.set()
+            elif command == "metrics":
+                self.worker_metrics[index] = payload
+            elif command == "topic_created":
+                # Messages in this topic are handled by another worker, which could have
+                # remembered it as a topic without user
+                owner = get_topic_worker_index(payload, self.workers)
+                self.senders[owner].send("topic_created", payload)
+            elif command == "pairs_created":
+                if self.pair_file is not None:
+                    for bot_id, pairs in payload:
+                        self.pair_file.add_many(bot_id, pairs)
+            elif command == "ban_changed":
+                for other, sender in enumerate(self.senders):
+                    if other != index:
+                        sender.send("ban_changed", payload)
+
+    def render_metrics(self) -> str:
+        merged = MetricsRegistry()
+        merged.merge(registry)
+        for worker_registry in self.worker_metrics.values():
+            merged.merge(worker_registry)
+        return merged.render()
+
+
+def run_worker(index: int, connection: Connection):
+    # Ctrl+C is delivered to the whole process group, but only supervisor decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop_config: EventLoopConfig = get_optional_config(model=EventLoopConfig, root_key="event_loop")
+    run(Worker(index, connection).run(), loop_config)
+
+
+class Worker:
+    """
+    Handles raw updates received from supervisor with its own dispatcher.
+    Updates are handled concurrently, same as with polling in single-process mode.
+    """
+
+    def __init__(self, index: int, connection: Connection):
+        self.index = index
+        self.connection = connection
+        self.sender: PipeSender | None = None
+        # Saved pairs by bot id, which are sent to supervisor together, not after every commit
+        self.pairs: dict[int, list[StoredPair]] = dict()
+        self.tasks: set[asyncio.Task] = set()
+        self.stopped = asyncio.Event()
+        self.bot: Bot | None = None
+        self.dp: Dispatcher | None = None
+
+    async def run(self):
+        log_config: LogConfig = get_config(model=LogConfig, root_key="logs")
+        structlog.configure(**get_structlog_config(log_config))
+        bot_config: BotConfig = get_config(model=BotConfig, root_key="bot")
+        pair_file_config: PairFileConfig = get_optional_config(model=PairFileConfig, root_key="pair_file")
+        self.sender = PipeSender(self.connection, peer="supervisor")
+
+        http_config: HttpConfig = get_optional_config(model=HttpConfig, root_key="http")
+        self.bot = Bot(
+            bot_config.token.get_secret_value(),
+            session=TunedAiohttpSession(http_config, api=get_api_server(bot_config)),
+        )
+        self.dp = await create_dispatcher(
+            self.bot,
+            is_primary=self.index == 0,
+            on_topic_created=lambda topic_id: self.send("topic_created", topic_id),
+            on_pairs_created=self.add_pairs,
+        )
+        # Bans made in this worker are applied by all other workers
+        self.dp["ban_list"].listeners.append(lambda user_id, banned: self.send("ban_changed", (user_id, banned)))
+        workflow_data = {"dispatcher": self.dp, "bots": [self.bot], **self.dp.workflow_data}
+        await self.dp.emit_startup(bot=self.bot, **workflow_data)
+
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.connection.fileno(), self.receive)
+        self.send("ready", self.dp.resolve_used_update_types())
+        await logger.ainfo("Worker started", worker=self.index)
+
+        metrics_task = asyncio.create_task(self.report_metrics())
+        pairs_task = asyncio.create_task(self.report_pairs(pair_file_config.flush_interval))
+        await self.stopped.wait()
+        loop.remove_reader(self.connection.fileno())
+        metrics_task.cancel()
+        pairs_task.cancel()
+
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        try:
+            await self.dp.emit_shutdown(bot=self.bot, **workflow_data)
+        finally:
+            await self.bot.session.close()
+        self.send_pairs()
+        self.send("metrics", registry)
+        await self.sender.drain()
+        self.sender.close()
+        self.connection.close()
+        await logger.ainfo("Worker stopped", worker=self.index)
+
+    def receive(self):
+        while self.connection.poll():
+            try:
+                command, payload = self.connection.recv()
+            except EOFError:
+                # Supervisor is gone
+                asyncio.get_running_loop().remove_reader(self.connection.fileno())
+                self.stopped.set()
+                return
+
+            if command == "updates":
+                for raw_update in payload:
+                    task = asyncio.create_task(self.process_update(raw_update))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
+            elif command == "topic_created":
+                self.dp["unroutable_topics"].pop(payload, None)
+            elif command == "ban_changed":
+                self.dp["ban_list"].apply(*payload)
+            elif command == "stop":
+                self.stopped.set()
+
+    async def process_update(self, raw_update: dict):
+        try:
+            await self.dp.feed_raw_update(self.bot, raw_update)
+        except Exception:
+            await logger.aexception("Failed to process update", update_id=raw_update.get("update_id"))
+
+    async def report_metrics(self):
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            self.send("metrics", registry)
+
+    def add_pairs(self, bot_id: int, pairs: list[StoredPair]):
+        self.pairs.setdefault(bot_id, list()).extend(pairs)
+
+    def send_pairs(self):
+        if self.pairs:
+            self.send("pairs_created", list(self.pairs.items()))
+            self.pairs = dict()
+
+    async def report_pairs(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.send_pairs()
+
+    def send(self, command: str, payload: Any = None):
+        self.sender.send(command, payload)